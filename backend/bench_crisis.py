@@ -0,0 +1,131 @@
+"""Crisis detector regression check and micro-benchmark.
+
+Run from the backend folder:
+    python bench_crisis.py                 # regression corpus + timings
+    python bench_crisis.py --sizes 100 1000 5000 --budget-us 1000
+
+Exits non-zero if a corpus message is misclassified or if detection on a
+maximum-length message exceeds the per-call budget at any lexicon size.
+"""
+import os
+import sys
+import json
+import random
+import argparse
+import timeit
+import statistics
+
+from crisis import CrisisMatcher, load_lexicon
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+LEXICON_FILE = os.path.join(BASE_DIR, "crisis_lexicon.json")
+CORPUS_FILE = os.path.join(BASE_DIR, "crisis_corpus.jsonl")
+MAX_MESSAGE_LENGTH = 1000  # ChatInput.message max_length
+
+FILLER_WORDS = [
+    "aaj", "mera", "din", "kaafi", "lamba", "tha", "yaar", "office", "mein",
+    "today", "was", "long", "and", "tiring", "but", "okay", "I", "guess",
+    "आज", "दिन", "बहुत", "लंबा", "था", "लेकिन", "ठीक", "है",
+]
+
+
+class LegacySubstringMatcher:
+    """The original detect_crisis: per-character cleanup, one substring scan per keyword."""
+
+    def __init__(self, phrases):
+        self.phrases = [p.lower() for p in phrases]
+
+    def matches(self, message: str) -> bool:
+        message_lower = message.lower()
+        message_clean = ''.join(c if c.isalnum() or c.isspace() else '' for c in message_lower)
+        return any(keyword in message_clean for keyword in self.phrases)
+
+
+def load_corpus():
+    with open(CORPUS_FILE, mode='r', encoding='utf-8') as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def check_corpus(matcher: CrisisMatcher) -> int:
+    failures = 0
+    corpus = load_corpus()
+    for case in corpus:
+        found = matcher.search(case["text"])
+        if (found is not None) != case["crisis"]:
+            failures += 1
+            print(f"❌ expected crisis={case['crisis']} (matched {found!r}): {case['text']}")
+    print(f"{'✅' if not failures else '❌'} Regression corpus: {len(corpus) - failures}/{len(corpus)} correct")
+    return failures
+
+
+def synthetic_lexicon(base, size, rng):
+    """Pad the real lexicon with random 2-4 word phrases up to ``size`` entries."""
+    phrases = list(base)
+    vocabulary = [w for p in base for w in p.replace("*", "").split()]
+    while len(phrases) < size:
+        phrases.append(" ".join(rng.choice(vocabulary) for _ in range(rng.randint(2, 4))) + " zz")
+    return phrases
+
+
+def filler_message(length, rng):
+    words = []
+    while sum(len(w) + 1 for w in words) < length:
+        words.append(rng.choice(FILLER_WORDS))
+    return " ".join(words)[:length]
+
+
+def time_per_call_us(fn, message, repeat=5, number=200):
+    runs = timeit.repeat(lambda: fn(message), repeat=repeat, number=number)
+    return statistics.median(runs) / number * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Crisis detector regression check and benchmark")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[0, 250, 1000, 5000],
+                        help="Lexicon sizes to benchmark (0 = shipped lexicon only)")
+    parser.add_argument("--budget-us", type=float, default=1000.0,
+                        help="Per-call budget for a maximum-length message, in microseconds")
+    parser.add_argument("--json", help="Write results to this JSON file")
+    args = parser.parse_args()
+
+    rng = random.Random(42)
+    base = load_lexicon(LEXICON_FILE)
+    failures = check_corpus(CrisisMatcher(base))
+
+    short_message = "aaj ka din thoda heavy tha, kuch samajh nahi aa raha"
+    long_message = filler_message(MAX_MESSAGE_LENGTH, rng)
+
+    print("\n" + "=" * 72)
+    print(f"{'phrases':>8} {'build ms':>9} {'short µs':>9} {'long µs':>9} {'legacy long µs':>15}")
+    print("=" * 72)
+    results = []
+    for size in args.sizes:
+        phrases = synthetic_lexicon(base, size, rng)
+        start = timeit.default_timer()
+        matcher = CrisisMatcher(phrases)
+        build_ms = (timeit.default_timer() - start) * 1000
+        legacy = LegacySubstringMatcher(phrases)
+
+        row = {
+            "phrases": matcher.phrase_count,
+            "build_ms": round(build_ms, 2),
+            "short_us": round(time_per_call_us(matcher.matches, short_message), 2),
+            "long_us": round(time_per_call_us(matcher.matches, long_message), 2),
+            "legacy_long_us": round(time_per_call_us(legacy.matches, long_message), 2),
+        }
+        results.append(row)
+        over = " ⚠️ over budget" if row["long_us"] > args.budget_us else ""
+        print(f"{row['phrases']:>8} {row['build_ms']:>9} {row['short_us']:>9} "
+              f"{row['long_us']:>9} {row['legacy_long_us']:>15}{over}")
+    print("=" * 72)
+
+    if args.json:
+        with open(args.json, mode='w', encoding='utf-8') as f:
+            json.dump({"corpus_failures": failures, "budget_us": args.budget_us, "results": results}, f, indent=2)
+
+    over_budget = [r for r in results if r["long_us"] > args.budget_us]
+    sys.exit(1 if failures or over_budget else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,386 @@
+"""Offline load test and benchmark for the API, against the fake model.
+
+Run from the backend folder:
+    python bench_load.py
+    python bench_load.py --users 200 --concurrency 64 --requests 5000 --storage sqlite
+    python bench_load.py --model-latency 0.5 --rate-limit-rate 0.01 --stream-ratio 0.3
+    python bench_load.py --output after.json --compare before.json
+
+Runs the app in-process (FAKE_GEMINI=1, scratch directory) and drives
+/chat, /chat/stream, /history, /export and /stats with a weighted mix of
+requests from ``--concurrency`` clients spread over ``--users`` users; a
+share of the chats are crisis messages. The fake model's latency
+distribution, 429 bursts, server errors and streaming chunking are all
+configurable. Afterwards the hot helpers (detect_crisis, context building,
+save_chat_history) are timed on the populated store.
+
+Reports p50/p95/p99 per endpoint, requests/s and memory growth, and writes
+everything to a JSON file. With ``--compare`` the run is checked against an
+earlier result file and exits non-zero if a median/p95 latency or a
+helper timing regressed by more than ``--regression-pct``.
+"""
+import os
+import sys
+import gc
+import json
+import time
+import random
+import asyncio
+import logging
+import argparse
+import tempfile
+import statistics
+import subprocess
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from metrics import percentile
+
+CRISIS_MESSAGE = "I want to end my life, I can't do this anymore"
+CHAT_MESSAGES = [
+    "rough day at work, my manager keeps piling things on",
+    "aaj bahut stress tha yaar, neend nahi aa rahi",
+    "I had a nice walk today and felt a bit better",
+    "my exams are next week and I can't focus",
+    "I keep overthinking everything my friends say",
+]
+
+# Relative weight of each operation in the request mix
+DEFAULT_MIX = "chat=60,history=20,export=5,stats=5,crisis=10"
+
+
+def summarize(samples):
+    """Latency summary in milliseconds."""
+    if not samples:
+        return None
+    ms = [s * 1000 for s in samples]
+    return {
+        "p50_ms": round(percentile(ms, 50), 3),
+        "p95_ms": round(percentile(ms, 95), 3),
+        "p99_ms": round(percentile(ms, 99), 3),
+        "max_ms": round(max(ms), 3),
+        "mean_ms": round(statistics.mean(ms), 3),
+    }
+
+
+def rss_bytes() -> int:
+    """Current resident set size (Linux), falling back to the peak RSS elsewhere."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == "darwin" else peak * 1024
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, timeout=5,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+        ).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def parse_mix(spec: str):
+    mix = {}
+    for part in spec.split(","):
+        name, _, weight = part.partition("=")
+        mix[name.strip()] = float(weight)
+    unknown = set(mix) - {"chat", "history", "export", "stats", "crisis"}
+    if unknown:
+        raise SystemExit(f"Unknown operations in --mix: {', '.join(sorted(unknown))}")
+    return mix
+
+
+class Recorder:
+    def __init__(self):
+        self.latencies = {}
+        self.statuses = {}
+
+    def record(self, op: str, status: int, seconds: float):
+        self.latencies.setdefault(op, []).append(seconds)
+        counts = self.statuses.setdefault(op, {})
+        counts[status] = counts.get(status, 0) + 1
+
+
+async def send_chat(client, recorder: Recorder, user: str, message: str, op: str):
+    start = time.perf_counter()
+    r = await client.post("/chat", json={"message": message, "userName": user})
+    recorder.record(op, r.status_code, time.perf_counter() - start)
+
+
+async def send_stream(app, recorder: Recorder, user: str, message: str):
+    """POST /chat/stream straight through ASGI: httpx's ASGI transport buffers the
+    whole body, which would hide the time to the first chunk."""
+    body = json.dumps({"message": message, "userName": user}).encode()
+    scope = {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "POST",
+        "scheme": "http", "path": "/chat/stream", "raw_path": b"/chat/stream", "query_string": b"",
+        "root_path": "", "headers": [(b"content-type", b"application/json"), (b"host", b"bench")],
+        "client": ("127.0.0.1", 1234), "server": ("bench", 80),
+    }
+    sent = False
+    done = asyncio.Event()
+    state = {"status": 0, "first": None}
+    start = time.perf_counter()
+
+    async def receive():
+        nonlocal sent
+        if not sent:
+            sent = True
+            return {"type": "http.request", "body": body, "more_body": False}
+        await done.wait()
+        return {"type": "http.disconnect"}
+
+    async def send(event):
+        if event["type"] == "http.response.start":
+            state["status"] = event["status"]
+        elif event["type"] == "http.response.body":
+            chunk = event.get("body", b"")
+            if chunk and state["first"] is None:
+                state["first"] = time.perf_counter() - start
+            if b"event: error" in chunk:
+                state["status"] = 599  # the stream itself was fine; generation failed
+            if not event.get("more_body", False):
+                done.set()
+
+    await app(scope, receive, send)
+    recorder.record("stream", state["status"], time.perf_counter() - start)
+    if state["first"] is not None:
+        recorder.record("stream_first_chunk", state["status"], state["first"])
+
+
+async def client_loop(client, app, recorder: Recorder, worker: int, args, mix, deadline, counter):
+    rng = random.Random(args.seed * 1000 + worker)
+    ops, weights = list(mix), list(mix.values())
+    while counter[0] < args.requests and time.perf_counter() < deadline:
+        counter[0] += 1
+        op = rng.choices(ops, weights)[0]
+        user = f"bench{rng.randrange(args.users)}"
+        if op == "chat":
+            message = f"{rng.choice(CHAT_MESSAGES)} ({counter[0]})"
+            if rng.random() < args.stream_ratio:
+                await send_stream(app, recorder, user, message)
+            else:
+                await send_chat(client, recorder, user, message, "chat")
+        elif op == "crisis":
+            await send_chat(client, recorder, user, CRISIS_MESSAGE, "crisis")
+        else:
+            path = {"history": f"/history/{user}", "export": f"/export/{user}", "stats": "/stats"}[op]
+            start = time.perf_counter()
+            r = await client.get(path)
+            recorder.record(op, r.status_code, time.perf_counter() - start)
+
+
+def time_call(fn, repeat: int):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return (time.perf_counter() - start) / repeat
+
+
+async def time_async(fn, repeat: int):
+    runs = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        await fn()
+        runs.append(time.perf_counter() - start)
+    return statistics.median(runs)
+
+
+async def component_timings(main, args):
+    """Per-call timings of the helpers on the request path, on the populated store."""
+    messages = CHAT_MESSAGES + [CRISIS_MESSAGE, "x" * 1000]
+    detect_s = time_call(lambda: [main.crisis_matcher.matches(m) for m in messages], 200) / len(messages)
+
+    users = [f"bench{i}" for i in range(min(args.users, 50))]
+    rings = [(await main.conversation_store.get_messages(u), await main.conversation_store.get_summary(u))
+             for u in users]
+    rings = [(ring, summary) for ring, summary in rings if ring]
+    build_s = (time_call(lambda: [main.context_builder.build(ring, summary) for ring, summary in rings], 50)
+               / max(1, len(rings)))
+
+    save_s = await time_async(main.save_chat_history, 5)
+    return {
+        "detect_crisis_us": round(detect_s * 1e6, 3),
+        "context_build_us": round(build_s * 1e6, 3),
+        "save_chat_history_ms": round(save_s * 1000, 3),
+    }
+
+
+async def run(args):
+    import httpx
+    logging.basicConfig(level=args.log_level, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    import main
+
+    await main.startup_event()
+    await main.startup_phases.wait("storage", "models")
+    for i, (_, fake) in enumerate(main.models):
+        fake.latency_s = args.model_latency
+        fake.latency_sigma = args.latency_sigma
+        fake.error_rate = args.error_rate
+        fake.rate_limit_rate = args.rate_limit_rate
+        fake.rate_limit_burst_s = args.rate_limit_burst
+        fake.chunk_count = args.chunks
+        fake.chunk_interval_s = args.chunk_interval
+        fake.rng = random.Random(args.seed + i)
+    main.retry_handler.base_delay = args.retry_base_delay
+
+    for u in range(args.users if args.seed_messages else 0):
+        for m in range(args.seed_messages):
+            await main.store_message(f"bench{u}", "user" if m % 2 == 0 else "assistant",
+                                     f"{CHAT_MESSAGES[m % len(CHAT_MESSAGES)]} (seed {m})")
+    gc.collect()
+    rss_start = rss_bytes()
+
+    recorder = Recorder()
+    mix = parse_mix(args.mix)
+    counter = [0]
+    transport = httpx.ASGITransport(app=main.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=120) as client:
+        started = time.perf_counter()
+        deadline = started + args.duration if args.duration else float("inf")
+        await asyncio.gather(*(client_loop(client, main.app, recorder, w, args, mix, deadline, counter)
+                               for w in range(args.concurrency)))
+        elapsed = time.perf_counter() - started
+
+    await asyncio.gather(*main.crisis_writes)
+    rss_peak = rss_bytes()
+    components = await component_timings(main, args)
+    stats = main.quota_governor.stats(), main.model_router.stats(), main.crisis_slo.stats()
+    await main.shutdown_event()
+    gc.collect()
+    rss_end = rss_bytes()
+
+    total = sum(len(v) for op, v in recorder.latencies.items() if op != "stream_first_chunk")
+    endpoints = {}
+    for op, samples in sorted(recorder.latencies.items()):
+        endpoints[op] = {
+            "count": len(samples),
+            "statuses": {str(k): v for k, v in sorted(recorder.statuses[op].items())},
+            **summarize(samples),
+        }
+    quota, router, crisis = stats
+    return {
+        "timestamp": datetime.now().isoformat(),
+        "commit": git_commit(),
+        "config": {k: v for k, v in vars(args).items() if k not in ("output", "compare")},
+        "requests": total,
+        "elapsed_s": round(elapsed, 3),
+        "requests_per_s": round(total / elapsed, 2) if elapsed else None,
+        "endpoints": endpoints,
+        "components": components,
+        "memory": {
+            "rss_start_mb": round(rss_start / 2**20, 2),
+            "rss_after_load_mb": round(rss_peak / 2**20, 2),
+            "rss_end_mb": round(rss_end / 2**20, 2),
+            "growth_mb": round((rss_peak - rss_start) / 2**20, 2),
+        },
+        "model_calls": sum(fake.calls for _, fake in main.models),
+        "failovers": router["failovers"],
+        "quota": {k: quota[k] for k in ("admitted", "rejected", "timed_out", "wait_p95_s")},
+        "crisis_slo": {k: crisis[k] for k in ("slo_ms", "count", "breaches", "p99_ms")},
+    }
+
+
+def print_report(result):
+    print("=" * 78)
+    print(f"{'endpoint':>20} {'count':>7} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'max ms':>9}  statuses")
+    for op, e in result["endpoints"].items():
+        statuses = " ".join(f"{k}:{v}" for k, v in e["statuses"].items())
+        print(f"{op:>20} {e['count']:>7} {e['p50_ms']:>9.2f} {e['p95_ms']:>9.2f} "
+              f"{e['p99_ms']:>9.2f} {e['max_ms']:>9.2f}  {statuses}")
+    print("=" * 78)
+    m, c = result["memory"], result["components"]
+    print(f"{result['requests']} requests in {result['elapsed_s']}s → {result['requests_per_s']} req/s, "
+          f"{result['model_calls']} model calls, {result['failovers']} failovers, "
+          f"{result['quota']['rejected']} quota rejections")
+    print(f"Memory: RSS {m['rss_start_mb']} → {m['rss_after_load_mb']} MB (+{m['growth_mb']} MB), "
+          f"{m['rss_end_mb']} MB after shutdown")
+    print(f"Components: detect_crisis {c['detect_crisis_us']}µs, context build {c['context_build_us']}µs, "
+          f"save_chat_history {c['save_chat_history_ms']}ms")
+
+
+def compare(result, baseline, threshold_pct: float) -> int:
+    """Print changes against an earlier run; return the number of regressions."""
+    rows = []
+    for op, e in result["endpoints"].items():
+        before = baseline.get("endpoints", {}).get(op)
+        if before:
+            # p99 of a few thousand requests is too noisy to gate on
+            rows += [(f"{op} p50_ms", before["p50_ms"], e["p50_ms"]), (f"{op} p95_ms", before["p95_ms"], e["p95_ms"])]
+    for key, value in result["components"].items():
+        if key in baseline.get("components", {}):
+            rows.append((key, baseline["components"][key], value))
+
+    regressions = 0
+    print(f"\nCompared with {baseline.get('commit') or 'baseline'} ({baseline.get('timestamp', '?')}):")
+    for label, before, after in rows:
+        change = (after - before) / before * 100 if before else 0.0
+        regressed = change > threshold_pct
+        regressions += regressed
+        print(f"  {'❌' if regressed else '✅'} {label:>28} {before:>10.2f} → {after:>10.2f} ({change:+.0f}%)")
+    return regressions
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description="Offline load test against the fake model")
+    load = parser.add_argument_group("load")
+    load.add_argument("--users", type=int, default=50, help="Distinct users")
+    load.add_argument("--concurrency", type=int, default=32, help="Concurrent clients")
+    load.add_argument("--requests", type=int, default=2000, help="Total requests")
+    load.add_argument("--duration", type=float, default=0, help="Stop after this many seconds (0 = no limit)")
+    load.add_argument("--mix", default=DEFAULT_MIX, help="Operation weights, e.g. chat=60,history=20,crisis=10")
+    load.add_argument("--stream-ratio", type=float, default=0.2, help="Share of chats sent to /chat/stream")
+    load.add_argument("--seed-messages", type=int, default=20, help="History per user before the run")
+    load.add_argument("--storage", choices=("json", "sqlite"), default="json", help="STORAGE_BACKEND")
+    load.add_argument("--seed", type=int, default=1)
+
+    model = parser.add_argument_group("fake model")
+    model.add_argument("--model-latency", type=float, default=0.05, help="Median latency (s)")
+    model.add_argument("--latency-sigma", type=float, default=0.5, help="Log-normal sigma (tail weight)")
+    model.add_argument("--error-rate", type=float, default=0.0, help="Share of calls failing with a 503")
+    model.add_argument("--rate-limit-rate", type=float, default=0.0, help="Chance per call of starting a 429 burst")
+    model.add_argument("--rate-limit-burst", type=float, default=1.0, help="429 burst length (s)")
+    model.add_argument("--chunks", type=int, default=4, help="Chunks per streamed response")
+    model.add_argument("--chunk-interval", type=float, default=0.01, help="Delay between chunks (s)")
+    model.add_argument("--retry-base-delay", type=float, default=0.1, help="Backoff base delay after 429s (s)")
+    model.add_argument("--rpm", default="0", help="GEMINI_RPM for the governor (0 = unlimited)")
+
+    out = parser.add_argument_group("output")
+    out.add_argument("--output", default="bench_load_results.json", help="Result file")
+    out.add_argument("--compare", help="Earlier result file to check for regressions")
+    out.add_argument("--regression-pct", type=float, default=25, help="Allowed slowdown before failing")
+    out.add_argument("--log-level", default="ERROR")
+    args = parser.parse_args()
+
+    output = os.path.abspath(args.output)
+    baseline = None
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)
+
+    os.environ["FAKE_GEMINI"] = "1"
+    os.environ["STORAGE_BACKEND"] = args.storage
+    os.environ.setdefault("GEMINI_RPM", args.rpm)
+    os.environ.setdefault("GEMINI_TPM", "0")
+    os.environ.setdefault("GEMINI_MAX_CONCURRENCY", str(max(16, args.concurrency)))
+    with tempfile.TemporaryDirectory() as scratch:
+        os.chdir(scratch)
+        result = asyncio.run(run(args))
+
+    print_report(result)
+    with open(output, mode="w", encoding="utf-8") as f:
+        json.dump(result, f, indent=2)
+    print(f"📄 Results written to {output}")
+
+    if baseline is not None and compare(result, baseline, args.regression_pct):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main_cli()
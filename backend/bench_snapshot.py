@@ -0,0 +1,152 @@
+"""Snapshot format benchmark: file size and load times, JSON vs binary.
+
+Run from the backend folder:
+    python bench_snapshot.py
+    python bench_snapshot.py --users 5000 --messages 30 --hindi 0.5 --runs 5 --output snapshot.json
+
+Seeds ``--users`` x ``--messages`` of history (``--hindi`` of the messages
+in Devanagari, like the Hindi replies the bot gives) in a scratch
+directory, writes it as the current JSON snapshot and as a binary
+snapshot, and times, for each format:
+
+- load: ``JsonConversationStore.load`` from the snapshot (startup)
+- cold read: fetching one user that is not in memory (``get_messages`` after a cache eviction)
+- read all: decoding every user's history
+
+The JSON store parses the whole file for both load and cold reads; the
+binary store parses its index on load and decodes single users on demand.
+"""
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import argparse
+import tempfile
+import statistics
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from cache import ConversationCache
+from snapshot import json_to_snapshot
+from storage import JournalStore, JsonConversationStore
+
+ENGLISH = [
+    "Today was a long day and I feel tired, work has been a lot lately.",
+    "I hear you. It makes sense to feel drained after a week like that. What has been the hardest part?",
+]
+HINDI = [
+    "आज का दिन बहुत लंबा था और मैं थका हुआ महसूस कर रहा हूँ।",
+    "मैं समझ सकता हूँ। ऐसे हफ्ते के बाद थकान महसूस होना स्वाभाविक है। सबसे मुश्किल क्या रहा?",
+]
+
+
+def seed_history(path: str, users: int, messages: int, hindi: float, seed: int):
+    rng = random.Random(seed)
+    now = datetime.now()
+    history = {}
+    for u in range(users):
+        history[f"user{u}"] = [
+            {
+                "role": "user" if m % 2 == 0 else "assistant",
+                "content": f"{(HINDI if rng.random() < hindi else ENGLISH)[m % 2]} ({m})",
+                "timestamp": (now - timedelta(minutes=messages - m)).isoformat(),
+            }
+            for m in range(messages)
+        ]
+    # Same layout the JSON store writes on compaction
+    with open(path, mode="w", encoding="utf-8") as f:
+        f.write(json.dumps(history, indent=2))
+
+
+def make_store(scratch: str, fmt: str, cache_users: int) -> JsonConversationStore:
+    journal = JournalStore(
+        os.path.join(scratch, "chat_history.snap" if fmt == "binary" else "chat_history.json"),
+        os.path.join(scratch, f"{fmt}.journal"),
+        max_messages_per_user=10_000,
+        snapshot_format=fmt,
+    )
+    return JsonConversationStore(journal, ConversationCache(max_users=cache_users, max_bytes=1 << 40), 10_000)
+
+
+async def measure(scratch: str, fmt: str, users: int) -> dict:
+    store = make_store(scratch, fmt, cache_users=max(users // 10, 1))
+    started = time.perf_counter()
+    await store.load()
+    load_s = time.perf_counter() - started
+
+    cold_user = f"user{users - 1}"
+    store.cache.pop(cold_user)
+    started = time.perf_counter()
+    messages = await store.get_messages(cold_user)
+    cold_s = time.perf_counter() - started
+    assert len(messages), "cold user missing"
+
+    started = time.perf_counter()
+    total = 0
+    async for _, ring in store.iter_histories(1000):
+        total += len(ring)
+    all_s = time.perf_counter() - started
+    await store.journal.close()
+    return {"load_s": load_s, "cold_read_s": cold_s, "read_all_s": all_s, "messages": total}
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description="Compare JSON and binary snapshot size and load time")
+    parser.add_argument("--users", type=int, default=2000)
+    parser.add_argument("--messages", type=int, default=30, help="Messages per user")
+    parser.add_argument("--hindi", type=float, default=0.5, help="Fraction of messages in Hindi")
+    parser.add_argument("--runs", type=int, default=3, help="Runs per format (median reported)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Write the report to this JSON file")
+    args = parser.parse_args()
+
+    results = {}
+    with tempfile.TemporaryDirectory() as scratch:
+        json_path = os.path.join(scratch, "chat_history.json")
+        seed_history(json_path, args.users, args.messages, args.hindi, args.seed)
+        started = time.perf_counter()
+        json_to_snapshot(json_path, os.path.join(scratch, "chat_history.snap"))
+        convert_s = time.perf_counter() - started
+        sizes = {
+            "json": os.path.getsize(json_path),
+            "binary": os.path.getsize(os.path.join(scratch, "chat_history.snap")),
+        }
+        for fmt in ("json", "binary"):
+            runs = [asyncio.run(measure(scratch, fmt, args.users)) for _ in range(args.runs)]
+            results[fmt] = {key: round(statistics.median(run[key] for run in runs), 4)
+                            for key in ("load_s", "cold_read_s", "read_all_s")}
+            results[fmt]["bytes"] = sizes[fmt]
+            results[fmt]["messages"] = runs[0]["messages"]
+
+    print("=" * 72)
+    print(f"History: {args.users} users x {args.messages} messages, {args.hindi:.0%} Hindi; "
+          f"conversion {convert_s:.2f}s")
+    print(f"{'format':>8} {'size MB':>9} {'load ms':>9} {'cold read ms':>13} {'read all ms':>12}")
+    for fmt, r in results.items():
+        print(f"{fmt:>8} {r['bytes'] / 1e6:>9.2f} {r['load_s'] * 1000:>9.1f} "
+              f"{r['cold_read_s'] * 1000:>13.2f} {r['read_all_s'] * 1000:>12.1f}")
+    j, b = results["json"], results["binary"]
+    print(f"binary: {b['bytes'] / j['bytes']:.0%} of the JSON size, load {j['load_s'] / b['load_s']:.0f}x faster, "
+          f"cold read {j['cold_read_s'] / b['cold_read_s']:.0f}x faster")
+    print("=" * 72)
+    if j["messages"] != b["messages"]:
+        print(f"❌ formats disagree: {j['messages']} vs {b['messages']} messages")
+        sys.exit(1)
+
+    if args.output:
+        with open(args.output, mode="w", encoding="utf-8") as f:
+            json.dump({
+                "timestamp": datetime.now().isoformat(),
+                "users": args.users,
+                "messages_per_user": args.messages,
+                "hindi": args.hindi,
+                "formats": results,
+            }, f, indent=2)
+        print(f"📄 Report written to {args.output}")
+
+
+if __name__ == "__main__":
+    main_cli()
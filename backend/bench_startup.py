@@ -0,0 +1,156 @@
+"""Cold-start report: import time, time to live and time to ready.
+
+Run from the backend folder:
+    python bench_startup.py
+    python bench_startup.py --users 5000 --messages 30 --runs 5 --output startup.json
+
+Each run is a fresh interpreter in a scratch directory seeded with
+``--users`` x ``--messages`` of history. It times ``import main``, then
+starts the app and polls /health/live and /health/ready through ASGI until
+each answers 200. Time to live is when a rolling restart can start
+health-checking the process; time to ready is when it should get traffic.
+Both backends are measured. The model phase goes through the real Gemini
+SDK with a placeholder key (no network is used to construct models);
+``--fake`` uses the local fake model instead.
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import statistics
+import subprocess
+from datetime import datetime, timedelta
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def child():
+    """One cold start, reported as a JSON line on stdout."""
+    started = time.perf_counter()
+    sys.path.insert(0, BACKEND_DIR)
+    import main
+    imported = time.perf_counter()
+
+    import asyncio
+    import httpx
+
+    async def poll(client, path):
+        while (await client.get(path)).status_code != 200:
+            await asyncio.sleep(0.005)
+        return time.perf_counter()
+
+    async def run():
+        await main.startup_event()
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://startup") as client:
+            live = await poll(client, "/health/live")
+            ready = await poll(client, "/health/ready")
+            report = (await client.get("/health/ready")).json()
+        await main.shutdown_event()
+        return live, ready, report
+
+    live, ready, report = asyncio.run(run())
+    print(json.dumps({
+        "import_s": imported - started,
+        "live_s": live - started,
+        "ready_s": ready - started,
+        "phases": {name: phase["seconds"] for name, phase in report["phases"].items()},
+        "users": main.conversation_store.user_count(),
+    }))
+
+
+def seed_history(path: str, users: int, messages: int):
+    now = datetime.now()
+    history = {}
+    for u in range(users):
+        history[f"user{u}"] = [
+            {
+                "role": "user" if m % 2 == 0 else "assistant",
+                "content": f"message {m} from user {u}: today was a long day and I feel tired",
+                "timestamp": (now - timedelta(minutes=messages - m)).isoformat(),
+            }
+            for m in range(messages)
+        ]
+    with open(path, mode="w", encoding="utf-8") as f:
+        json.dump(history, f)
+
+
+def sdk_import_s() -> float:
+    """Cold import time of the Gemini SDK, which used to sit on the import path."""
+    out = subprocess.run(
+        [sys.executable, "-c",
+         "import time; t = time.perf_counter(); import google.generativeai; print(time.perf_counter() - t)"],
+        capture_output=True, text=True,
+    )
+    return float(out.stdout.strip().splitlines()[-1])
+
+
+def cold_start(scratch: str, env: dict) -> dict:
+    out = subprocess.run([sys.executable, os.path.abspath(__file__), "--child"],
+                         cwd=scratch, env=env, capture_output=True, text=True, timeout=300)
+    if out.returncode != 0:
+        raise RuntimeError(f"cold start failed:\n{out.stderr[-2000:]}")
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description="Measure import time, time to live and time to ready")
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--messages", type=int, default=30, help="Messages per user")
+    parser.add_argument("--runs", type=int, default=3, help="Cold starts per backend (median reported)")
+    parser.add_argument("--backends", nargs="+", default=["json", "sqlite"], choices=["json", "sqlite"])
+    parser.add_argument("--fake", action="store_true", help="Use the fake model instead of the Gemini SDK")
+    parser.add_argument("--output", help="Write the report to this JSON file")
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        child()
+        return
+
+    sdk_s = sdk_import_s()
+    results = {}
+    for backend in args.backends:
+        env = dict(os.environ, STORAGE_BACKEND=backend)
+        if args.fake:
+            env["FAKE_GEMINI"] = "1"
+        else:
+            env["FAKE_GEMINI"] = "0"
+            env.setdefault("GOOGLE_API_KEY", "startup-benchmark-placeholder")
+        with tempfile.TemporaryDirectory() as scratch:
+            seed_history(os.path.join(scratch, "chat_history.json"), args.users, args.messages)
+            if backend == "sqlite":
+                cold_start(scratch, env)  # first start imports the JSON history into the database
+            runs = [cold_start(scratch, env) for _ in range(args.runs)]
+        results[backend] = {
+            key: round(statistics.median(run[key] for run in runs), 3) for key in ("import_s", "live_s", "ready_s")
+        }
+        results[backend]["phases"] = {
+            name: round(statistics.median(run["phases"][name] for run in runs), 3) for name in runs[0]["phases"]
+        }
+        results[backend]["users"] = runs[0]["users"]
+
+    print("=" * 72)
+    print(f"History: {args.users} users x {args.messages} messages; "
+          f"Gemini SDK import (now off the import path): {sdk_s:.3f}s")
+    print(f"{'backend':>8} {'import s':>9} {'live s':>8} {'ready s':>8}  phases")
+    for backend, r in results.items():
+        phases = ", ".join(f"{name} {seconds:.3f}s" for name, seconds in r["phases"].items())
+        print(f"{backend:>8} {r['import_s']:>9.3f} {r['live_s']:>8.3f} {r['ready_s']:>8.3f}  {phases}")
+    print("=" * 72)
+
+    if args.output:
+        with open(args.output, mode="w", encoding="utf-8") as f:
+            json.dump({
+                "timestamp": datetime.now().isoformat(),
+                "users": args.users,
+                "messages_per_user": args.messages,
+                "sdk_import_s": round(sdk_s, 3),
+                "backends": results,
+            }, f, indent=2)
+        print(f"📄 Report written to {args.output}")
+
+
+if __name__ == "__main__":
+    main_cli()
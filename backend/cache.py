@@ -0,0 +1,109 @@
+import logging
+from collections import OrderedDict
+from typing import Dict, Optional
+
+from messages import MessageRing
+
+logger = logging.getLogger(__name__)
+
+# Rough CPython cost of one Message (slots object, str header, float
+# timestamp and its ring slot) on top of the characters themselves
+MESSAGE_OVERHEAD_BYTES = 140
+RING_OVERHEAD_BYTES = 100
+
+
+def estimate_size(messages: MessageRing) -> int:
+    """Approximate resident bytes of a user's message ring."""
+    return RING_OVERHEAD_BYTES + 8 * messages.capacity + sum(
+        MESSAGE_OVERHEAD_BYTES + len(msg.content) for msg in messages
+    )
+
+
+class ConversationCache:
+    """LRU cache of hot conversations, bounded by user count and approximate bytes.
+
+    Recency is updated on every ``get`` and ``put``. Evicted conversations are
+    simply dropped: stores write through on every change, so the durable copy
+    is already up to date and the next ``get`` miss reloads it. A limit of
+    None leaves that dimension unbounded.
+    """
+
+    def __init__(self, max_users: Optional[int], max_bytes: Optional[int]):
+        self.max_users = max_users
+        self.max_bytes = max_bytes
+        self._entries: "OrderedDict[str, MessageRing]" = OrderedDict()
+        self._sizes: Dict[str, int] = {}
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __contains__(self, user: str) -> bool:
+        return user in self._entries
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def users(self):
+        return self._entries.keys()
+
+    def items(self):
+        """Cached conversations, without touching recency or counters."""
+        return self._entries.items()
+
+    def get(self, user: str) -> Optional[MessageRing]:
+        messages = self._entries.get(user)
+        if messages is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._entries.move_to_end(user)
+        return messages
+
+    def peek(self, user: str) -> Optional[MessageRing]:
+        """Look up without touching recency or counters."""
+        return self._entries.get(user)
+
+    def put(self, user: str, messages: MessageRing):
+        """Insert or refresh a conversation and make it most recently used."""
+        size = estimate_size(messages)
+        self.bytes += size - self._sizes.get(user, 0)
+        self._sizes[user] = size
+        self._entries[user] = messages
+        self._entries.move_to_end(user)
+        self._evict(keep=user)
+
+    def pop(self, user: str) -> Optional[MessageRing]:
+        messages = self._entries.pop(user, None)
+        if messages is not None:
+            self.bytes -= self._sizes.pop(user)
+        return messages
+
+    def clear(self):
+        self._entries.clear()
+        self._sizes.clear()
+        self.bytes = 0
+
+    def _evict(self, keep: str):
+        while ((self.max_users is not None and len(self._entries) > self.max_users)
+               or (self.max_bytes is not None and self.bytes > self.max_bytes)):
+            user = next(iter(self._entries))
+            if user == keep:
+                # A single conversation larger than the byte budget stays cached
+                break
+            self.pop(user)
+            self.evictions += 1
+            logger.debug(f"♻️ Evicted {user} from conversation cache")
+
+    def stats(self) -> Dict:
+        lookups = self.hits + self.misses
+        return {
+            "users": len(self._entries),
+            "bytes": self.bytes,
+            "max_users": self.max_users,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else None,
+        }
@@ -0,0 +1,118 @@
+"""Crisis fast-lane check: crisis reply latency with and without chat load.
+
+Run from the backend folder:
+    python check_crisis_lane.py
+    python check_crisis_lane.py --load 200 --model-latency 0.5 --samples 50
+
+Runs the API in-process against the fake model (FAKE_GEMINI=1) in a
+scratch directory. Crisis latency is measured end to end through the ASGI
+app, first on an idle service and then while normal chats keep the model
+quota saturated (requests queueing and being turned away with 503s).
+Exits non-zero if the crisis p99 under load exceeds the SLO or if crisis
+turns were not all persisted.
+"""
+import os
+import sys
+import time
+import asyncio
+import argparse
+import tempfile
+import statistics
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from metrics import percentile
+
+CRISIS_MESSAGE = "I want to end my life, I can't do this anymore"
+
+
+async def measure_crisis(client, samples: int, prefix: str):
+    latencies = []
+    for i in range(samples):
+        start = time.perf_counter()
+        r = await client.post("/chat", json={"message": CRISIS_MESSAGE, "userName": f"{prefix}{i % 5}"})
+        latencies.append((time.perf_counter() - start) * 1000)
+        assert r.status_code == 200 and r.json()["is_crisis"], r.text
+        await asyncio.sleep(0.01)
+    return latencies
+
+
+async def chat_load(client, user: int, stop: asyncio.Event, statuses: dict):
+    i = 0
+    while not stop.is_set():
+        r = await client.post("/chat", json={"message": f"rough day at work {i}", "userName": f"load{user}"})
+        statuses[r.status_code] = statuses.get(r.status_code, 0) + 1
+        i += 1
+        if r.status_code != 200:
+            await asyncio.sleep(0.05)
+
+
+async def run(args):
+    import httpx
+    import main
+
+    await main.startup_event()
+    await main.startup_phases.wait("storage", "models")
+    for _, fake in main.models:
+        fake.latency_s = args.model_latency
+    transport = httpx.ASGITransport(app=main.app)
+    failures = 0
+    async with httpx.AsyncClient(transport=transport, base_url="http://test", timeout=60) as client:
+        idle = await measure_crisis(client, args.samples, "idle")
+
+        stop = asyncio.Event()
+        statuses: dict = {}
+        load = [asyncio.create_task(chat_load(client, u, stop, statuses)) for u in range(args.load)]
+        await asyncio.sleep(1.0)  # let the queue fill
+        queued = main.quota_governor.queue_depth
+        loaded = await measure_crisis(client, args.samples, "busy")
+        stop.set()
+        await asyncio.gather(*load)
+
+    await asyncio.gather(*main.crisis_writes)
+    stored = 0
+    for prefix in ("idle", "busy"):
+        for u in range(5):
+            messages = await main.conversation_store.get_messages(f"{prefix}{u}")
+            stored += sum(1 for m in messages if m.content == CRISIS_MESSAGE)
+    await main.shutdown_event()
+
+    slo = main.CRISIS_SLO_MS
+    print("=" * 64)
+    print(f"{'':>12} {'p50 ms':>9} {'p99 ms':>9} {'max ms':>9} {'mean ms':>9}")
+    for label, samples in (("idle", idle), ("under load", loaded)):
+        print(f"{label:>12} {percentile(samples, 50):>9.2f} {percentile(samples, 99):>9.2f} "
+              f"{max(samples):>9.2f} {statistics.mean(samples):>9.2f}")
+    print("=" * 64)
+    print(f"Chat load: {args.load} clients, responses {statuses}, queue depth {queued} when measuring")
+
+    expected = 2 * args.samples
+    for label, ok in [
+        (f"crisis p99 under load {percentile(loaded, 99):.2f}ms within SLO {slo:g}ms", percentile(loaded, 99) <= slo),
+        (f"service was saturated (queue depth {queued}, {statuses.get(503, 0)} rejected)",
+         queued > 0 or statuses.get(503, 0) > 0),
+        (f"crisis turns persisted: {stored}/{expected}", stored == expected),
+    ]:
+        print(f"{'✅' if ok else '❌'} {label}")
+        failures += not ok
+    return failures
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description="Crisis latency under saturating chat load")
+    parser.add_argument("--load", type=int, default=100, help="Concurrent normal chat clients")
+    parser.add_argument("--samples", type=int, default=40, help="Crisis requests per phase")
+    parser.add_argument("--model-latency", type=float, default=0.3, help="Median fake model latency (s)")
+    args = parser.parse_args()
+
+    os.environ["FAKE_GEMINI"] = "1"
+    os.environ.setdefault("GEMINI_MAX_CONCURRENCY", "4")
+    os.environ.setdefault("GEMINI_QUEUE_MAX", "16")
+    with tempfile.TemporaryDirectory() as scratch:
+        os.chdir(scratch)
+        failures = asyncio.run(run(args))
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,213 @@
+"""Crash-recovery check for the JSON journal store.
+
+Run from the backend folder:
+    python check_journal.py
+    python check_journal.py --format binary --users 8000
+
+Simulates crashes (the store is dropped without closing) at the points
+the journal has to survive: a torn last line from a crash mid-append, a
+crash during compaction with the rotated ``.compacting`` segment still
+on disk (torn as well), and a crash after the segment was dropped but
+before the new snapshot was moved into place. After each one the store
+is reloaded and must have every acknowledged message, including the
+ones appended after the restart. Also checks that an append that is due
+an fsync doesn't wait for a running compaction. Exits non-zero if any
+scenario misbehaves.
+"""
+import os
+import sys
+import time
+import asyncio
+import argparse
+import tempfile
+from typing import Dict, List
+
+from messages import Message, MessageRing, Role
+from storage import JournalStore
+
+
+class Checks:
+    def __init__(self):
+        self.failures = 0
+
+    def expect(self, label: str, ok: bool):
+        print(f"  {'✅' if ok else '❌'} {label}")
+        self.failures += not ok
+
+
+def open_store(scratch: str, fmt: str) -> JournalStore:
+    return JournalStore(
+        os.path.join(scratch, "chat_history.snap" if fmt == "binary" else "chat_history.json"),
+        os.path.join(scratch, "chat_history.journal"),
+        max_messages_per_user=10_000,
+        fsync_policy="always",
+        snapshot_format=fmt,
+    )
+
+
+def crash(store: JournalStore):
+    """Drop the store the way a killed process would: no final fsync, no compaction."""
+    for fd in (store._fd, store._lock_fd):
+        if fd is not None:
+            os.close(fd)
+    store._fd = store._lock_fd = None
+    if store._reader is not None:
+        store._reader.close()
+        store._reader = None
+
+
+def contents(history: Dict[str, MessageRing], user: str) -> List[str]:
+    ring = history.get(user)
+    return [m.content for m in ring.to_list()] if ring is not None else []
+
+
+async def load(store: JournalStore) -> Dict[str, MessageRing]:
+    history, _, cold = await store.load()
+    if cold:
+        history.update(await store.read_users(list(cold)))
+    return history
+
+
+async def append(store: JournalStore, history: Dict[str, MessageRing], user: str, content: str):
+    message = Message(Role.USER, content, time.time())
+    history.setdefault(user, MessageRing(store.max_messages_per_user)).append(message)
+    await store.append(user, message)
+
+
+def collector(history: Dict[str, MessageRing]):
+    return lambda: (dict(history), [], {})
+
+
+async def torn_tail(checks: Checks, scratch: str, fmt: str):
+    print("Torn last journal line")
+    store = open_store(scratch, fmt)
+    history = await load(store)
+    for i in range(3):
+        await append(store, history, "sam", f"m{i}")
+    crash(store)
+    with open(store.journal_path, "ab") as f:
+        f.write(b'{"op": "append", "user": "sam", "mess')
+
+    store = open_store(scratch, fmt)
+    history = await load(store)
+    await append(store, history, "sam", "after")
+    crash(store)
+
+    store = open_store(scratch, fmt)
+    history = await load(store)
+    checks.expect(f"history after restart: {contents(history, 'sam')}",
+                  contents(history, "sam") == ["m0", "m1", "m2", "after"])
+    crash(store)
+
+
+async def crash_during_compaction(checks: Checks, scratch: str, fmt: str):
+    print("Crash during compaction (segment still on disk)")
+    store = open_store(scratch, fmt)
+    history = await load(store)
+    for i in range(3):
+        await append(store, history, "kim", f"k{i}")
+    await store.compact(collector(history))
+    await append(store, history, "kim", "k3")
+    # Compaction got as far as rotating the journal and starting the snapshot
+    store._rotate()
+    with open(store._snapshot_tmp_path, "wb") as f:
+        f.write(b'{"kim": [')
+    await append(store, history, "kim", "k4")
+    crash(store)
+    with open(store._segment_path, "ab") as f:
+        f.write(b'{"op": "append", "us')
+
+    store = open_store(scratch, fmt)
+    history = await load(store)
+    checks.expect("incomplete snapshot discarded", not os.path.exists(store._snapshot_tmp_path))
+    await append(store, history, "kim", "k5")
+    # The next compaction folds the journal into the leftover segment
+    await store.compact(collector(history))
+    checks.expect("segment dropped by the next compaction", not os.path.exists(store._segment_path))
+    crash(store)
+
+    store = open_store(scratch, fmt)
+    history = await load(store)
+    checks.expect(f"history after restart: {contents(history, 'kim')}",
+                  contents(history, "kim") == [f"k{i}" for i in range(6)])
+    crash(store)
+
+
+async def crash_before_snapshot_replace(checks: Checks, scratch: str, fmt: str):
+    print("Crash after the segment was dropped, before the snapshot was replaced")
+    store = open_store(scratch, fmt)
+    history = await load(store)
+    for i in range(3):
+        await append(store, history, "ana", f"a{i}")
+
+    replace = os.replace
+
+    def crash_on_snapshot(src, dst):
+        if src == store._snapshot_tmp_path:
+            raise OSError("simulated crash")
+        replace(src, dst)
+
+    os.replace = crash_on_snapshot
+    try:
+        await store.compact(collector(history))
+    finally:
+        os.replace = replace
+    checks.expect("new snapshot left as a temp file",
+                  os.path.exists(store._snapshot_tmp_path) and not os.path.exists(store._segment_path))
+    crash(store)
+
+    store = open_store(scratch, fmt)
+    history = await load(store)
+    checks.expect("temp snapshot moved into place", not os.path.exists(store._snapshot_tmp_path))
+    checks.expect(f"history after restart: {contents(history, 'ana')}",
+                  contents(history, "ana") == ["a0", "a1", "a2"])
+    await store.close()
+
+
+async def fsync_during_compaction(checks: Checks, scratch: str, fmt: str, users: int):
+    print(f"Appends during a compaction of {users} users (fsync always)")
+    store = open_store(scratch, fmt)
+    history = await load(store)
+    for u in range(users):
+        ring = history.setdefault(f"user{u}", MessageRing(store.max_messages_per_user))
+        for m in range(30):
+            ring.append(Message(Role.USER, f"Today was a long day and I feel tired ({m})", time.time()))
+
+    started = time.perf_counter()
+    compaction = asyncio.create_task(store.compact(collector(history)))
+    await asyncio.sleep(0.01)
+    waits = []
+    while not compaction.done():
+        began = time.perf_counter()
+        await append(store, history, "sam", "during compaction")
+        waits.append(time.perf_counter() - began)
+        await asyncio.sleep(0.01)
+    await compaction
+    compaction_s = time.perf_counter() - started
+    longest = max(waits, default=0.0)
+    checks.expect(f"{len(waits)} appends, longest {longest * 1000:.1f} ms during a {compaction_s * 1000:.0f} ms compaction",
+                  bool(waits) and longest < compaction_s / 2)
+    await store.close()
+
+
+async def run(args) -> int:
+    checks = Checks()
+    for scenario in (torn_tail, crash_during_compaction, crash_before_snapshot_replace):
+        with tempfile.TemporaryDirectory() as scratch:
+            await scenario(checks, scratch, args.format)
+    with tempfile.TemporaryDirectory() as scratch:
+        await fsync_during_compaction(checks, scratch, args.format, args.users)
+    print(f"\n{'✅ All journal checks passed' if not checks.failures else f'❌ {checks.failures} checks failed'}")
+    return checks.failures
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description="Check journal crash recovery")
+    parser.add_argument("--format", choices=["json", "binary"], default="json", help="Snapshot format")
+    parser.add_argument("--users", type=int, default=4000, help="Users in the compaction timing check")
+    args = parser.parse_args()
+    sys.exit(1 if asyncio.run(run(args)) else 0)
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,228 @@
+"""Model router check against local fake models.
+
+Run from the backend folder:
+    python check_router.py
+
+Covers failover on a 429 storm, the circuit breaker opening and closing
+again, failover on server errors, streaming failover before the first
+chunk, errors that must not fail over or open a breaker (bad requests,
+blocked prompts and streams), classification by error type and status
+code, and hedging a slow tail. Exits non-zero if any scenario misbehaves.
+"""
+import sys
+import asyncio
+import statistics
+
+from fake_gemini import FakeAPIError, FakeGeminiModel
+from metrics import percentile
+from router import CLOSED, OPEN, ModelRouter
+
+RATE_LIMIT_KEYWORDS = ['429', 'resource_exhausted', 'quota', 'rate_limit', 'too_many_requests']
+
+
+def is_rate_limit(error: Exception) -> bool:
+    return any(keyword in str(error).lower() for keyword in RATE_LIMIT_KEYWORDS)
+
+
+def make_router(*models, **kwargs) -> ModelRouter:
+    kwargs.setdefault("attempt_timeout_s", 2.0)
+    return ModelRouter([(m.model_name, m) for m in models], is_rate_limit=is_rate_limit, **kwargs)
+
+
+class Checks:
+    def __init__(self):
+        self.failures = 0
+
+    def expect(self, label: str, ok: bool):
+        print(f"  {'✅' if ok else '❌'} {label}")
+        self.failures += not ok
+
+
+async def rate_limit_storm(checks: Checks):
+    print("429 storm on the primary")
+    primary = FakeGeminiModel("primary", latency_s=0.01, seed=1)
+    backup = FakeGeminiModel("backup", latency_s=0.01, seed=2)
+    router = make_router(primary, backup, breaker_threshold=3, cooldown_s=0.3)
+    primary.rate_limit_for(0.25)
+
+    answered = [(await router.generate("hi"))[1] for _ in range(10)]
+    checks.expect("every request answered by the backup", answered == ["backup"] * 10)
+    checks.expect(f"primary called only until its breaker opened ({primary.calls} calls)", primary.calls == 3)
+    checks.expect("primary breaker open", router.health["primary"].state == OPEN)
+
+    await asyncio.sleep(0.35)
+    _, name = await router.generate("hi")
+    checks.expect("probe after cooldown goes back to the primary", name == "primary")
+    checks.expect("primary breaker closed again", router.health["primary"].state == CLOSED)
+
+
+async def all_rate_limited(checks: Checks):
+    print("every model rate limited")
+    a = FakeGeminiModel("a", latency_s=0.01)
+    b = FakeGeminiModel("b", latency_s=0.01)
+    router = make_router(a, b)
+    a.rate_limit_for(10)
+    b.rate_limit_for(10)
+    try:
+        await router.generate("hi")
+        checks.expect("raises the rate limit so callers can back off", False)
+    except FakeAPIError as e:
+        checks.expect("raises the rate limit so callers can back off", is_rate_limit(e))
+    checks.expect("each model tried once", (a.calls, b.calls) == (1, 1))
+
+
+async def server_errors(checks: Checks):
+    print("server errors and timeouts")
+    flaky = FakeGeminiModel("flaky", latency_s=0.01, error_rate=1.0)
+    slow = FakeGeminiModel("slow", latency_s=1.0, latency_sigma=0.0)
+    good = FakeGeminiModel("good", latency_s=0.01)
+    router = make_router(flaky, slow, good, attempt_timeout_s=0.2)
+    text, name = await router.generate("hi")
+    checks.expect("503 then timeout fail over to the third model", name == "good" and text.startswith("[good]"))
+    checks.expect("two failovers counted", router.failovers == 2)
+
+
+async def non_retryable(checks: Checks):
+    print("errors that should not fail over")
+
+    class Broken(FakeGeminiModel):
+        async def generate_content_async(self, prompt, stream=False, **kwargs):
+            self.calls += 1
+            raise FakeAPIError("400 Request payload size exceeds the limit: 50000 bytes.")
+
+    broken = Broken("broken")
+    other = FakeGeminiModel("other", latency_s=0.01)
+    router = make_router(broken, other, breaker_threshold=3)
+    for _ in range(3):
+        try:
+            await router.generate("hi")
+            checks.expect("bad request raised without trying other models", False)
+        except FakeAPIError:
+            pass
+    checks.expect("bad request (with 50000 in it) raised without trying other models", other.calls == 0)
+    checks.expect("bad requests leave the breaker closed", router.health["broken"].state == CLOSED)
+
+
+async def blocked_prompts(checks: Checks):
+    print("blocked prompts")
+
+    class Blocked:
+        @property
+        def text(self):
+            raise ValueError("Invalid operation: the response was blocked (finish_reason SAFETY)")
+
+    class Guarded(FakeGeminiModel):
+        async def generate_content_async(self, prompt, stream=False, **kwargs):
+            self.calls += 1
+            return Blocked() if "blocked" in prompt else await super().generate_content_async(prompt, stream)
+
+    primary = Guarded("primary", latency_s=0.01)
+    backup = FakeGeminiModel("backup", latency_s=0.01)
+    router = make_router(primary, backup, breaker_threshold=3)
+    for _ in range(3):
+        try:
+            await router.generate("blocked")
+        except ValueError:
+            pass
+    _, name = await router.generate("hi")
+    checks.expect("three blocked prompts keep the primary's breaker closed",
+                  router.health["primary"].state == CLOSED and name == "primary")
+    checks.expect("blocked prompts not sent to the backup", backup.calls == 0)
+
+
+async def typed_errors(checks: Checks):
+    print("errors classified by type and status code")
+    from google.api_core import exceptions as google_errors
+    router = make_router(FakeGeminiModel("a"))
+    for error, expected in [
+        (google_errors.ServiceUnavailable("The model is overloaded."), True),
+        (google_errors.InternalServerError("An internal error has occurred."), True),
+        (google_errors.DeadlineExceeded("Deadline exceeded"), True),
+        (ConnectionResetError("Connection reset by peer"), True),
+        (google_errors.InvalidArgument("Request payload size exceeds the limit: 50000 bytes."), False),
+        (google_errors.InvalidArgument("Internal field 503 is not a valid connection"), False),
+        (ValueError("Timeout value 500 is out of range"), False),
+    ]:
+        checks.expect(f"{type(error).__name__}: {str(error)[:48]} → "
+                      f"{'fail over' if expected else 'raise'}", router.should_fail_over(error) == expected)
+
+
+async def streaming(checks: Checks):
+    print("streaming failover")
+    primary = FakeGeminiModel("primary", latency_s=0.01)
+    backup = FakeGeminiModel("backup", latency_s=0.01, chunk_count=3)
+    router = make_router(primary, backup)
+    primary.rate_limit_for(10)
+    chunks = [chunk async for chunk in router.stream("hi")]
+    checks.expect(f"stream served by the backup in {len(chunks)} chunks",
+                  len(chunks) == 3 and all(name == "backup" for name, _ in chunks))
+
+    class BlockedChunk:
+        @property
+        def text(self):
+            raise ValueError("Invalid operation: the response was blocked (finish_reason SAFETY)")
+
+    class BlockedStream:
+        def __aiter__(self):
+            return self
+
+        async def __anext__(self):
+            return BlockedChunk()
+
+    class Guarded(FakeGeminiModel):
+        async def generate_content_async(self, prompt, stream=False, **kwargs):
+            self.calls += 1
+            return BlockedStream()
+
+    guarded = Guarded("guarded", latency_s=0.01)
+    backup = FakeGeminiModel("backup", latency_s=0.01)
+    router = make_router(guarded, backup, breaker_threshold=3)
+    raised = 0
+    for _ in range(3):
+        try:
+            [chunk async for chunk in router.stream("blocked")]
+        except ValueError:
+            raised += 1
+    health = router.health["guarded"]
+    checks.expect(f"blocked streams raised ({raised}/3) and counted as rejections ({health.rejections})",
+                  raised == 3 and health.rejections == 3)
+    checks.expect("blocked streams keep the breaker closed and don't reach the backup",
+                  health.state == CLOSED and backup.calls == 0)
+
+
+async def hedging(checks: Checks):
+    print("hedging a slow tail")
+    samples = {}
+    for hedge in (None, 90):
+        # Heavy-tailed primary: most answers fast, some very slow
+        primary = FakeGeminiModel("primary", latency_s=0.02, latency_sigma=1.2, seed=7)
+        backup = FakeGeminiModel("backup", latency_s=0.02, latency_sigma=0.2, seed=8)
+        router = make_router(primary, backup, hedge_percentile=hedge, hedge_min_samples=20)
+        latencies = []
+        loop = asyncio.get_running_loop()
+        for _ in range(150):
+            start = loop.time()
+            await router.generate("hi")
+            latencies.append(loop.time() - start)
+        samples[hedge] = (percentile(latencies, 99), statistics.mean(latencies), router)
+
+    p99_off, mean_off, _ = samples[None]
+    p99_on, mean_on, router = samples[90]
+    print(f"     p99 {p99_off * 1000:.0f}ms → {p99_on * 1000:.0f}ms, "
+          f"mean {mean_off * 1000:.0f}ms → {mean_on * 1000:.0f}ms, "
+          f"{router.hedges} hedges, {router.hedge_wins} won by the backup")
+    checks.expect("hedged requests were sent", router.hedges > 0)
+    checks.expect("hedging cuts the p99", p99_on < p99_off)
+
+
+async def main():
+    checks = Checks()
+    for scenario in (rate_limit_storm, all_rate_limited, server_errors, non_retryable, blocked_prompts,
+                     typed_errors, streaming, hedging):
+        await scenario(checks)
+    print(f"\n{'✅ All router checks passed' if not checks.failures else f'❌ {checks.failures} checks failed'}")
+    sys.exit(1 if checks.failures else 0)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,138 @@
+"""Multi-worker check for the shared SQLite store.
+
+Run from the backend folder:
+    python check_shared_store.py                         # 4 workers x 200 messages
+    python check_shared_store.py --workers 8 --messages 500 --users 5
+
+Starts several processes against one database, each appending messages
+to the same small set of users (reading history between writes, as /chat
+does), then checks that every message was stored, that the per-user
+counts and totals agree with the rows, and that a worker's cached view
+matches the database. Exits non-zero on any mismatch.
+"""
+import os
+import sys
+import time
+import asyncio
+import argparse
+import sqlite3
+import tempfile
+import multiprocessing
+
+from cache import ConversationCache
+from messages import Message, Role
+from storage import SQLiteConversationStore
+
+
+def open_store(db_path: str) -> SQLiteConversationStore:
+    # Window large enough that nothing is trimmed, so every message can be counted
+    return SQLiteConversationStore(
+        db_path,
+        cache=ConversationCache(max_users=100, max_bytes=64 * 1024 * 1024),
+        max_messages_per_user=1_000_000,
+        shared=True,
+    )
+
+
+async def run_worker(db_path: str, worker: int, messages: int, users: int):
+    store = open_store(db_path)
+    await store.load()
+    for i in range(messages):
+        user = f"user{i % users}"
+        await store.get_messages(user)
+        await store.append(user, Message(Role.USER, f"w{worker}-{i}", time.time()))
+    await store.close()
+
+
+async def init_store(db_path: str):
+    store = open_store(db_path)
+    await store.load()
+    await store.close()
+
+
+def worker_main(db_path: str, worker: int, messages: int, users: int, start):
+    start.wait()
+    asyncio.run(run_worker(db_path, worker, messages, users))
+
+
+async def verify(db_path: str, workers: int, messages: int, users: int) -> int:
+    failures = 0
+    expected = workers * messages
+
+    conn = sqlite3.connect(db_path)
+    rows = conn.execute("SELECT COUNT(*) FROM messages").fetchone()[0]
+    distinct = conn.execute("SELECT COUNT(DISTINCT content) FROM messages").fetchone()[0]
+    mismatched = conn.execute(
+        "SELECT COUNT(*) FROM users u WHERE message_count != "
+        "(SELECT COUNT(*) FROM messages m WHERE m.user = u.name)"
+    ).fetchone()[0]
+    totals = conn.execute("SELECT users, messages FROM totals").fetchone()
+    conn.close()
+
+    for label, ok in [
+        (f"rows stored: {rows}/{expected}", rows == expected),
+        (f"distinct messages: {distinct}/{expected}", distinct == expected),
+        (f"users with wrong message_count: {mismatched}", mismatched == 0),
+        (f"totals: {totals[0]} users, {totals[1]} messages", totals == (users, expected)),
+    ]:
+        print(f"{'✅' if ok else '❌'} {label}")
+        failures += not ok
+
+    store = open_store(db_path)
+    await store.load()
+    for i in range(users):
+        user = f"user{i}"
+        cached = len(await store.get_messages(user))
+        if cached != workers * (messages // users + (i < messages % users)):
+            failures += 1
+            print(f"❌ {user}: {cached} messages visible through the store")
+    await store.close()
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check that concurrent workers lose no messages")
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--messages", type=int, default=200, help="Messages appended per worker")
+    parser.add_argument("--users", type=int, default=3, help="Users shared by all workers")
+    parser.add_argument("--db", help="Database path (default: a temporary file)")
+    args = parser.parse_args()
+
+    tmp_dir = None
+    db_path = args.db
+    if db_path is None:
+        tmp_dir = tempfile.TemporaryDirectory()
+        db_path = os.path.join(tmp_dir.name, "shared.db")
+
+    # Create the schema once so workers start against the same empty database
+    asyncio.run(init_store(db_path))
+
+    ctx = multiprocessing.get_context("spawn")
+    start = ctx.Event()
+    processes = [
+        ctx.Process(target=worker_main, args=(db_path, w, args.messages, args.users, start))
+        for w in range(args.workers)
+    ]
+    for p in processes:
+        p.start()
+    began = time.perf_counter()
+    start.set()
+    for p in processes:
+        p.join()
+    elapsed = time.perf_counter() - began
+
+    crashed = [p.exitcode for p in processes if p.exitcode != 0]
+    total = args.workers * args.messages
+    print(f"⏱️ {args.workers} workers appended {total} messages in {elapsed:.2f}s "
+          f"({total / elapsed:.0f} msg/s)")
+    if crashed:
+        print(f"❌ {len(crashed)} workers exited with errors: {crashed}")
+
+    failures = asyncio.run(verify(db_path, args.workers, args.messages, args.users))
+    if tmp_dir is not None:
+        tmp_dir.cleanup()
+    sys.exit(1 if failures or crashed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+"""Aborted-stream check: a client that disconnects mid-stream keeps the partial reply.
+
+Run from the backend folder:
+    python check_stream_abort.py                   # both storage backends
+    python check_stream_abort.py --backend sqlite
+
+Runs the API in-process against the fake model (FAKE_GEMINI=1) in a
+scratch directory, once per storage backend. Each run opens /chat/stream,
+disconnects after the first delta, and checks that the user's message and
+the partial reply were both stored, and that the user's next turn still
+goes through. Exits non-zero on any failure.
+"""
+import os
+import sys
+import json
+import asyncio
+import argparse
+import tempfile
+import subprocess
+
+USER = "abort-check"
+
+
+async def aborted_stream(app, message: str) -> list:
+    """POST /chat/stream through the raw ASGI interface, disconnecting after the first delta."""
+    body = json.dumps({"message": message, "userName": USER}).encode()
+    disconnected = asyncio.Event()
+    deltas = []
+    scope = {
+        "type": "http", "asgi": {"version": "3.0", "spec_version": "2.0"}, "http_version": "1.1",
+        "method": "POST", "scheme": "http", "path": "/chat/stream", "raw_path": b"/chat/stream",
+        "query_string": b"", "root_path": "", "server": ("test", 80), "client": ("127.0.0.1", 1234),
+        "headers": [(b"host", b"test"), (b"content-type", b"application/json"),
+                    (b"content-length", str(len(body)).encode())],
+    }
+    sent_body = False
+
+    async def receive():
+        nonlocal sent_body
+        if not sent_body:
+            sent_body = True
+            return {"type": "http.request", "body": body, "more_body": False}
+        await disconnected.wait()
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        if message["type"] == "http.response.body" and b'"delta"' in message.get("body", b""):
+            deltas.append(message["body"])
+            disconnected.set()
+
+    await asyncio.wait_for(app(scope, receive, send), timeout=30)
+    return deltas
+
+
+async def run() -> int:
+    import httpx
+    import main
+
+    await main.startup_event()
+    await main.startup_phases.wait("storage", "models")
+    for _, fake in main.models:
+        # Slow enough that the disconnect lands between chunks
+        fake.latency_s = 0.0
+        fake.chunk_count = 8
+        fake.chunk_interval_s = 0.2
+
+    deltas = await aborted_stream(main.app, "I had a long day and feel tired")
+    await asyncio.sleep(0.1)
+    stored = (await main.conversation_store.get_messages(USER)).to_list()
+
+    transport = httpx.ASGITransport(app=main.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test", timeout=30) as client:
+        r = await asyncio.wait_for(client.post("/chat", json={"message": "Still here", "userName": USER}), 10)
+    after = (await main.conversation_store.get_messages(USER)).to_list()
+    await main.shutdown_event()
+
+    roles = [m.role.label for m in stored]
+    partial = stored[1].content if len(stored) > 1 else ""
+    failures = 0
+    for label, ok in [
+        (f"client disconnected after {len(deltas)} delta(s)", len(deltas) == 1),
+        (f"stored roles after the abort: {roles}", roles == ["user", "assistant"]),
+        (f"partial reply stored ({len(partial)} chars)", bool(partial) and not partial.endswith("chars)")),
+        (f"next turn answered with {r.status_code}, history now {len(after)} messages",
+         r.status_code == 200 and len(after) == 4),
+    ]:
+        print(f"{'✅' if ok else '❌'} {label}")
+        failures += not ok
+    return failures
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description="Check that aborted streams keep their partial reply")
+    parser.add_argument("--backend", choices=["json", "sqlite"], help="Storage backend (default: both)")
+    args = parser.parse_args()
+
+    if args.backend is None:
+        failures = 0
+        for backend in ("json", "sqlite"):
+            print(f"--- STORAGE_BACKEND={backend}", flush=True)
+            failures += subprocess.call([sys.executable, os.path.abspath(__file__), "--backend", backend]) != 0
+        sys.exit(1 if failures else 0)
+
+    os.environ["FAKE_GEMINI"] = "1"
+    os.environ["STORAGE_BACKEND"] = args.backend
+    os.environ["GEMINI_RPM"] = "100000"
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    with tempfile.TemporaryDirectory() as scratch:
+        os.chdir(scratch)
+        failures = asyncio.run(run())
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,149 @@
+import asyncio
+import logging
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+from governor import CHARS_PER_TOKEN, estimate_tokens
+from messages import Message, MessageRing, Role, Summary
+
+logger = logging.getLogger(__name__)
+
+TRUNCATION_MARK = "…"
+
+
+def _truncate(text: str, max_tokens: int) -> str:
+    max_chars = max(0, max_tokens * CHARS_PER_TOKEN - len(TRUNCATION_MARK))
+    return text if len(text) <= max_chars else text[:max_chars].rstrip() + TRUNCATION_MARK
+
+
+def format_turn(message: Message) -> str:
+    prefix = "User" if message.role == Role.USER else "Wellness Bot"
+    return f"{prefix}: {message.content}"
+
+
+class ContextBuilder:
+    """Builds the conversation context for a prompt within a token budget.
+
+    Turns newer than the user's rolling summary are packed newest first
+    until ``token_budget`` is used up; the summary stands in for everything
+    before them. Turns that neither fit nor are summarized yet are reported
+    back so a summary refresh can be scheduled.
+    """
+
+    def __init__(self, token_budget: int, summary_token_budget: int):
+        self.token_budget = token_budget
+        self.summary_token_budget = summary_token_budget
+
+    def pack(self, messages: MessageRing, summary: Optional[Summary]) -> Tuple[List[str], List[Message]]:
+        """Return (turn lines that fit, oldest first) and the unsummarized turns left out."""
+        covered_until = summary.covered_until if summary else float("-inf")
+        candidates = [msg for msg in messages if msg.timestamp > covered_until]
+
+        lines: List[str] = []
+        remaining = self.token_budget
+        index = len(candidates)
+        while index > 0:
+            line = format_turn(candidates[index - 1])
+            cost = estimate_tokens(line)
+            if cost > remaining:
+                if not lines:
+                    # Always keep the latest turn, cut down to the budget
+                    lines.append(_truncate(line, remaining))
+                    index -= 1
+                break
+            lines.append(line)
+            remaining -= cost
+            index -= 1
+        lines.reverse()
+        return lines, candidates[:index]
+
+    def build(self, messages: MessageRing, summary: Optional[Summary]) -> Tuple[str, List[Message]]:
+        """Return the context string and the unsummarized turns left out of it."""
+        lines, left_out = self.pack(messages, summary)
+        parts = []
+        if summary:
+            parts.append(f"\n\nEarlier in your conversation (summary):\n{_truncate(summary.text, self.summary_token_budget)}\n")
+        if lines:
+            context = "\n".join(lines)
+            parts.append(f"\n\nConversation context:\n{context}\n")
+        return "".join(parts), left_out
+
+
+class SummaryRefresher:
+    """Folds turns that no longer fit the context into each user's rolling summary.
+
+    Refreshes run as background tasks, at most one per user, once at least
+    ``batch_messages`` turns are waiting; they never block a request.
+    ``summarize(user, previous_text, turns)`` produces the new summary text.
+    Refreshes are skipped while ``busy()`` is true so they don't compete
+    with user requests for model quota.
+    """
+
+    def __init__(
+        self,
+        store,
+        builder: ContextBuilder,
+        summarize: Callable[[str, Optional[str], List[Message]], Awaitable[str]],
+        batch_messages: int,
+        busy: Callable[[], bool] = lambda: False,
+    ):
+        self.store = store
+        self.builder = builder
+        self.summarize = summarize
+        self.batch_messages = batch_messages
+        self.busy = busy
+        self._tasks: Dict[str, asyncio.Task] = {}
+        self.refreshes = 0
+        self.failures = 0
+        self.skipped_busy = 0
+
+    def maybe_schedule(self, user: str, left_out: List[Message]):
+        if len(left_out) < self.batch_messages or user in self._tasks:
+            return
+        if self.busy():
+            self.skipped_busy += 1
+            return
+        task = asyncio.create_task(self._refresh(user))
+        self._tasks[user] = task
+        task.add_done_callback(lambda _: self._tasks.pop(user, None))
+
+    async def _refresh(self, user: str):
+        try:
+            # Re-read: the request that scheduled us has moved on
+            messages = await self.store.get_messages(user)
+            summary = await self.store.get_summary(user)
+            _, left_out = self.builder.pack(messages, summary)
+            if len(left_out) < self.batch_messages:
+                return
+
+            text = await self.summarize(user, summary.text if summary else None, left_out)
+            last = left_out[-1]
+            current = await self.store.get_messages(user)
+            if not any(m.timestamp == last.timestamp and m.content == last.content for m in current):
+                return  # history was cleared or expired while we summarized
+            await self.store.set_summary(user, Summary(
+                text.strip(),
+                covered_until=last.timestamp,
+                message_count=(summary.message_count if summary else 0) + len(left_out),
+            ))
+            self.refreshes += 1
+            logger.info(f"📝 Summarized {len(left_out)} older messages for {user}")
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            self.failures += 1
+            logger.warning(f"⚠️ Summary refresh failed for {user}: {str(e)[:100]}")
+
+    async def stop(self):
+        tasks = list(self._tasks.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def stats(self) -> Dict:
+        return {
+            "in_flight": len(self._tasks),
+            "refreshes": self.refreshes,
+            "failures": self.failures,
+            "skipped_busy": self.skipped_busy,
+            "batch_messages": self.batch_messages,
+        }
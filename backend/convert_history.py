@@ -0,0 +1,58 @@
+"""Convert chat history snapshots between the JSON and binary formats.
+
+Run from the backend folder, with the server stopped:
+    python convert_history.py chat_history.json chat_history.snap
+    python convert_history.py chat_history.snap chat_history.json
+
+The direction follows the input: a binary snapshot (see snapshot.py) is
+written out as JSON, anything else is read as JSON and written as a binary
+snapshot. Only the snapshot is converted; fold the journal in first by
+starting and stopping the server once, which compacts it. Switching
+SNAPSHOT_FORMAT back from "binary" to "json" needs this conversion, since
+the JSON file is not kept up to date while the binary format is in use.
+"""
+import os
+import sys
+import time
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from snapshot import SnapshotReader, is_binary_snapshot, json_to_snapshot, snapshot_to_json
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description="Convert chat history between JSON and binary snapshots")
+    parser.add_argument("source", help="Snapshot to read (JSON or binary)")
+    parser.add_argument("target", help="File to write, in the other format")
+    parser.add_argument("--force", action="store_true", help="Overwrite the target if it exists")
+    args = parser.parse_args()
+
+    if not os.path.exists(args.source):
+        print(f"❌ {args.source} not found")
+        sys.exit(1)
+    if os.path.exists(args.target) and not args.force:
+        print(f"❌ {args.target} exists; pass --force to overwrite it")
+        sys.exit(1)
+
+    started = time.perf_counter()
+    temp_path = f"{args.target}.tmp"
+    if is_binary_snapshot(args.source):
+        with SnapshotReader(args.source) as reader:
+            users = len(reader)
+        size = snapshot_to_json(args.source, temp_path)
+        direction = "binary -> JSON"
+    else:
+        size = json_to_snapshot(args.source, temp_path)
+        with SnapshotReader(temp_path) as reader:
+            users = len(reader)
+        direction = "JSON -> binary"
+    os.replace(temp_path, args.target)
+
+    source_size = os.path.getsize(args.source)
+    print(f"✅ {direction}: {users} users, {source_size / 1024:.1f} KB -> {size / 1024:.1f} KB "
+          f"({size / max(source_size, 1):.0%}) in {time.perf_counter() - started:.2f}s")
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,175 @@
+import re
+import json
+import time
+import logging
+import unicodedata
+from bisect import bisect_right
+from collections import deque
+from typing import Dict, Iterable, List, Optional
+
+from metrics import percentile
+
+logger = logging.getLogger(__name__)
+
+# Characters that belong to a word. \w already covers Latin letters, digits and
+# Devanagari consonants/vowels, but not the combining vowel signs and virama,
+# so the whole Devanagari block is added explicitly.
+WORD_CHARS = r"\w\u0900-\u097F"
+WORD_BOUNDARY_BEFORE = rf"(?<![{WORD_CHARS}])"
+WORD_BOUNDARY_AFTER = rf"(?![{WORD_CHARS}])"
+# Messages checked together are joined with this character; it is never part
+# of a separator, so a match can't run from one message into the next.
+BATCH_DELIMITER = "\x00"
+# Between words we accept any run of spaces/punctuation, including none, so
+# "self-harm", "self  harm" and "selfharm" all match "self harm".
+SEPARATOR = rf"[^{WORD_CHARS}\x00]*"
+# A trailing "*" in a lexicon phrase matches any word ending ("suicid*")
+WILDCARD = rf"[{WORD_CHARS}]*"
+_WORD_CHAR_RE = re.compile(rf"[{WORD_CHARS}]")
+
+_END = ""
+
+
+def normalize(text: str) -> str:
+    """Canonical form used for both lexicon phrases and messages."""
+    return unicodedata.normalize("NFC", text).casefold()
+
+
+def _tokenize_phrase(phrase: str) -> List[str]:
+    """Split a phrase into single characters plus SEPARATOR/WILDCARD markers."""
+    units: List[str] = []
+    phrase = normalize(phrase).strip()
+    wildcard = phrase.endswith("*")
+    if wildcard:
+        phrase = phrase[:-1]
+    for ch in phrase:
+        if _WORD_CHAR_RE.match(ch):
+            units.append(ch)
+        elif units and units[-1] != SEPARATOR:
+            units.append(SEPARATOR)
+    while units and units[-1] == SEPARATOR:
+        units.pop()
+    if wildcard and units:
+        units.append(WILDCARD)
+    return units
+
+
+def _trie_to_pattern(node: Dict) -> str:
+    """Emit a regex for a character trie, sharing common prefixes between phrases."""
+    alternatives = []
+    for unit in sorted(k for k in node if k != _END):
+        token = unit if unit in (SEPARATOR, WILDCARD) else re.escape(unit)
+        alternatives.append(token + _trie_to_pattern(node[unit]))
+
+    if not alternatives:
+        return ""
+    if len(alternatives) == 1 and _END not in node:
+        return alternatives[0]
+    group = "(?:" + "|".join(alternatives) + ")"
+    return group + "?" if _END in node else group
+
+
+class CrisisMatcher:
+    """Precompiled single-pass matcher for a crisis lexicon.
+
+    All phrases are folded into one character trie and compiled into a single
+    regex, so matching cost depends on message length and phrase depth rather
+    than on how many phrases the lexicon holds.
+    """
+
+    def __init__(self, phrases: Iterable[str]):
+        trie: Dict = {}
+        count = 0
+        for phrase in phrases:
+            units = _tokenize_phrase(phrase)
+            if not units:
+                continue
+            node = trie
+            for unit in units:
+                node = node.setdefault(unit, {})
+            node[_END] = True
+            count += 1
+
+        self.phrase_count = count
+        if count:
+            body = _trie_to_pattern(trie)
+            self.pattern = re.compile(f"{WORD_BOUNDARY_BEFORE}(?:{body}){WORD_BOUNDARY_AFTER}")
+        else:
+            self.pattern = None
+
+    def search(self, message: str) -> Optional[str]:
+        """Return the first matching phrase as it appears in the message, if any."""
+        if self.pattern is None:
+            return None
+        match = self.pattern.search(normalize(message).replace(BATCH_DELIMITER, ""))
+        return match.group(0) if match else None
+
+    def matches(self, message: str) -> bool:
+        return self.search(message) is not None
+
+    def search_many(self, messages: List[str]) -> List[Optional[str]]:
+        """``search`` for each message, with one regex pass over the whole batch."""
+        results: List[Optional[str]] = [None] * len(messages)
+        if self.pattern is None or not messages:
+            return results
+        starts = []
+        parts = []
+        offset = 0
+        for message in messages:
+            part = normalize(message).replace(BATCH_DELIMITER, "")
+            starts.append(offset)
+            parts.append(part)
+            offset += len(part) + 1
+        for match in self.pattern.finditer(BATCH_DELIMITER.join(parts)):
+            index = bisect_right(starts, match.start()) - 1
+            if results[index] is None:
+                results[index] = match.group(0)
+        return results
+
+
+def load_lexicon(path: str) -> List[str]:
+    """Load crisis phrases from a JSON file of {language: [phrases]}."""
+    with open(path, mode='r', encoding='utf-8') as f:
+        lexicon = json.load(f)
+    phrases = [phrase for language_phrases in lexicon.values() for phrase in language_phrases]
+    logger.info(f"✅ Loaded {len(phrases)} crisis phrases ({', '.join(lexicon)}) from {path}")
+    return phrases
+
+
+class CrisisLatencySLO:
+    """Latency of crisis replies against a target, over a window of recent replies.
+
+    ``breaches`` counts replies slower than ``slo_ms``; alert on it rising or
+    on ``p99_ms`` approaching the target.
+    """
+
+    def __init__(self, slo_ms: float, window: int = 1000):
+        self.slo_ms = slo_ms
+        self.count = 0
+        self.breaches = 0
+        self.last_breach: Optional[float] = None
+        self._recent: deque = deque(maxlen=window)
+
+    def observe(self, latency_s: float):
+        latency_ms = latency_s * 1000
+        self.count += 1
+        self._recent.append(latency_ms)
+        if latency_ms > self.slo_ms:
+            self.breaches += 1
+            self.last_breach = time.time()
+            logger.warning(f"⏱️ Crisis reply took {latency_ms:.1f}ms (SLO {self.slo_ms:g}ms)")
+
+    def percentile(self, p: float) -> Optional[float]:
+        value = percentile(self._recent, p)
+        return round(value, 3) if value is not None else None
+
+    def stats(self) -> Dict:
+        return {
+            "slo_ms": self.slo_ms,
+            "count": self.count,
+            "breaches": self.breaches,
+            "p50_ms": self.percentile(50),
+            "p99_ms": self.percentile(99),
+            "max_ms": round(max(self._recent), 3) if self._recent else None,
+            "last_breach": self.last_breach,
+        }
@@ -0,0 +1,104 @@
+"""Local stand-in for genai.GenerativeModel, for checks and benchmarks.
+
+Latency is drawn from a log-normal distribution around ``latency_s``;
+failures and 429 bursts are raised with the same messages the real client
+uses, so retry, failover and breaker logic see them exactly as in
+production.
+"""
+import math
+import time
+import random
+import asyncio
+from typing import Optional
+
+
+class FakeAPIError(Exception):
+    pass
+
+
+class FakeResponse:
+    def __init__(self, text: str):
+        self.text = text
+
+
+class FakeStream:
+    """Async iterator of response chunks, opened like ``generate_content_async(stream=True)``."""
+
+    def __init__(self, model: "FakeGeminiModel", chunks):
+        self.model = model
+        self.chunks = chunks
+
+    def __aiter__(self):
+        return self._iterate()
+
+    async def _iterate(self):
+        for i, text in enumerate(self.chunks):
+            if i:
+                await asyncio.sleep(self.model.chunk_interval_s)
+            yield FakeResponse(text)
+
+
+class FakeGeminiModel:
+    """Fake model with configurable latency, errors and rate-limit bursts.
+
+    ``rate_limit_rate`` starts a burst with that probability per call; during
+    a burst (``rate_limit_burst_s`` long) every call is rejected with a 429,
+    the way a quota window behaves.
+    """
+
+    def __init__(
+        self,
+        name: str = "fake-model",
+        latency_s: float = 0.05,
+        latency_sigma: float = 0.3,
+        error_rate: float = 0.0,
+        rate_limit_rate: float = 0.0,
+        rate_limit_burst_s: float = 1.0,
+        chunk_count: int = 4,
+        chunk_interval_s: float = 0.01,
+        seed: Optional[int] = None,
+    ):
+        self.model_name = name
+        self.latency_s = latency_s
+        self.latency_sigma = latency_sigma
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.rate_limit_burst_s = rate_limit_burst_s
+        self.chunk_count = chunk_count
+        self.chunk_interval_s = chunk_interval_s
+        self.rng = random.Random(seed)
+        self.calls = 0
+        self.rate_limited_until = 0.0
+
+    def rate_limit_for(self, seconds: float):
+        """Reject every call with a 429 for the next ``seconds``."""
+        self.rate_limited_until = time.monotonic() + seconds
+
+    def _latency(self) -> float:
+        if self.latency_s <= 0:
+            return 0.0
+        return self.rng.lognormvariate(math.log(self.latency_s), self.latency_sigma)
+
+    def _reply(self, prompt: str) -> str:
+        return (f"[{self.model_name}] I hear you, and it makes sense to feel that way. "
+                f"What has been weighing on you most today? (#{self.calls}, {len(prompt)} chars)")
+
+    async def generate_content_async(self, prompt: str, stream: bool = False, **kwargs):
+        self.calls += 1
+        now = time.monotonic()
+        if now >= self.rate_limited_until and self.rng.random() < self.rate_limit_rate:
+            self.rate_limit_for(self.rate_limit_burst_s)
+        if now < self.rate_limited_until:
+            await asyncio.sleep(0.001)
+            raise FakeAPIError("429 Resource has been exhausted (e.g. check quota).")
+
+        await asyncio.sleep(self._latency())
+        if self.rng.random() < self.error_rate:
+            raise FakeAPIError("503 The service is currently unavailable.")
+
+        text = self._reply(prompt)
+        if not stream:
+            return FakeResponse(text)
+        words = text.split(" ")
+        size = max(1, math.ceil(len(words) / self.chunk_count))
+        return FakeStream(self, [" ".join(words[i:i + size]) + " " for i in range(0, len(words), size)])
@@ -0,0 +1,218 @@
+import time
+import asyncio
+import logging
+from collections import deque
+from typing import Deque, Dict, List, Optional
+
+from metrics import percentile
+
+logger = logging.getLogger(__name__)
+
+# Rough Gemini tokenization for English/Hinglish text
+CHARS_PER_TOKEN = 4
+
+
+def estimate_tokens(text: str) -> int:
+    return len(text) // CHARS_PER_TOKEN + 1
+
+
+class QuotaExceeded(Exception):
+    """Raised instead of queueing when a request can't be admitted in time."""
+
+    def __init__(self, reason: str, retry_after_s: float):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after_s = retry_after_s
+
+
+class TokenBucket:
+    """Classic token bucket refilled continuously at ``per_minute`` / 60 per second."""
+
+    def __init__(self, per_minute: float):
+        self.capacity = per_minute
+        self.rate = per_minute / 60.0
+        self.tokens = per_minute
+        self.updated = time.monotonic()
+
+    def refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_for(self, amount: float) -> float:
+        """Seconds until ``amount`` can be taken (0 if available now)."""
+        # A request larger than the whole bucket waits for a full bucket
+        missing = min(amount, self.capacity) - self.tokens
+        return max(0.0, missing / self.rate)
+
+    def take(self, amount: float):
+        self.tokens -= min(amount, self.capacity)
+
+    def drain(self):
+        self.tokens = min(self.tokens, 0.0)
+
+
+class _Waiter:
+    __slots__ = ("tokens", "future", "enqueued")
+
+    def __init__(self, tokens: int, future: asyncio.Future):
+        self.tokens = tokens
+        self.future = future
+        self.enqueued = time.monotonic()
+
+
+class QuotaGovernor:
+    """Admission control in front of the model API.
+
+    A request needs a concurrency slot, one token from the requests/min
+    bucket and its estimated tokens from the tokens/min bucket. Requests
+    that can't start immediately wait in a bounded FIFO queue. A request
+    is rejected straight away (``QuotaExceeded``) if the queue is full or
+    if its estimated wait is longer than ``max_wait_s``. It is also
+    rejected if it is still queued when that deadline passes.
+    A limit of 0 disables that bucket.
+    """
+
+    def __init__(self, rpm: float, tpm: float, max_concurrency: int, max_queue: int, max_wait_s: float):
+        self.requests = TokenBucket(rpm) if rpm > 0 else None
+        self.tokens = TokenBucket(tpm) if tpm > 0 else None
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.max_wait_s = max_wait_s
+        self.active = 0
+        self._queue: Deque[_Waiter] = deque()
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self.admitted = 0
+        self.rejected = 0
+        self.timed_out = 0
+        self.wait_total_s = 0.0
+        self.wait_max_s = 0.0
+        self._recent_waits: Deque[float] = deque(maxlen=500)
+
+    @property
+    def queue_depth(self) -> int:
+        return len(self._queue)
+
+    # --- Admission ---
+    def _buckets(self) -> List[TokenBucket]:
+        return [b for b in (self.requests, self.tokens) if b is not None]
+
+    def _bucket_wait(self, request_count: int, token_count: int, now: float) -> float:
+        wait = 0.0
+        if self.requests is not None:
+            self.requests.refill(now)
+            wait = max(wait, self.requests.wait_for(request_count))
+        if self.tokens is not None:
+            self.tokens.refill(now)
+            wait = max(wait, self.tokens.wait_for(token_count))
+        return wait
+
+    def _take(self, tokens: int):
+        if self.requests is not None:
+            self.requests.take(1)
+        if self.tokens is not None:
+            self.tokens.take(tokens)
+        self.active += 1
+        self.admitted += 1
+
+    def _estimated_wait(self, tokens: int, now: float) -> float:
+        """Bucket-limited wait if this request joined the back of the queue."""
+        needed = [(self.requests, len(self._queue) + 1),
+                  (self.tokens, sum(w.tokens for w in self._queue) + tokens)]
+        wait = 0.0
+        for bucket, amount in needed:
+            if bucket is not None:
+                bucket.refill(now)
+                wait = max(wait, (amount - bucket.tokens) / bucket.rate)
+        return wait
+
+    def _reject(self, reason: str, retry_after_s: float):
+        self.rejected += 1
+        retry_after_s = max(1.0, retry_after_s)
+        logger.warning(f"🚦 Rejected model request: {reason} (retry after {retry_after_s:.0f}s)")
+        raise QuotaExceeded(reason, retry_after_s)
+
+    async def acquire(self, tokens: int):
+        now = time.monotonic()
+        # Fast path: nobody queued and everything available
+        if not self._queue and self.active < self.max_concurrency and self._bucket_wait(1, tokens, now) == 0:
+            self._take(tokens)
+            self._record_wait(0.0)
+            return
+
+        if len(self._queue) >= self.max_queue:
+            self._reject("queue full", self._estimated_wait(tokens, now) or self.max_wait_s)
+        estimated = self._estimated_wait(tokens, now)
+        if estimated > self.max_wait_s:
+            self._reject(f"estimated wait {estimated:.1f}s exceeds {self.max_wait_s:g}s", estimated)
+
+        waiter = _Waiter(tokens, asyncio.get_running_loop().create_future())
+        self._queue.append(waiter)
+        self._dispatch()
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter.future), timeout=self.max_wait_s)
+        except asyncio.TimeoutError:
+            if waiter.future.done():
+                return
+            self._queue.remove(waiter)
+            self.timed_out += 1
+            self._dispatch()
+            self._reject("timed out in queue", self._estimated_wait(tokens, time.monotonic()))
+        except asyncio.CancelledError:
+            if waiter.future.done():
+                self.release()  # admitted just as the caller went away
+            else:
+                self._queue.remove(waiter)
+                self._dispatch()
+            raise
+
+    def release(self):
+        self.active -= 1
+        self._dispatch()
+
+    def on_rate_limited(self):
+        """Upstream returned 429 anyway: stop admitting until the buckets refill."""
+        for bucket in self._buckets():
+            bucket.drain()
+
+    def _dispatch(self):
+        """Admit queued requests, in order, while resources allow."""
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        now = time.monotonic()
+        while self._queue and self.active < self.max_concurrency:
+            waiter = self._queue[0]
+            wait = self._bucket_wait(1, waiter.tokens, now)
+            if wait > 0:
+                # Head of the queue waits for the buckets; wake up when it can go
+                self._timer = asyncio.get_running_loop().call_later(wait, self._dispatch)
+                return
+            self._queue.popleft()
+            self._take(waiter.tokens)
+            self._record_wait(now - waiter.enqueued)
+            waiter.future.set_result(None)
+
+    def _record_wait(self, wait_s: float):
+        self.wait_total_s += wait_s
+        self.wait_max_s = max(self.wait_max_s, wait_s)
+        self._recent_waits.append(wait_s)
+
+    def stats(self) -> Dict:
+        now = time.monotonic()
+        for bucket in self._buckets():
+            bucket.refill(now)
+        return {
+            "active": self.active,
+            "max_concurrency": self.max_concurrency,
+            "queue_depth": self.queue_depth,
+            "max_queue": self.max_queue,
+            "max_wait_s": self.max_wait_s,
+            "admitted": self.admitted,
+            "rejected": self.rejected,
+            "timed_out": self.timed_out,
+            "wait_avg_s": round(self.wait_total_s / self.admitted, 4) if self.admitted else None,
+            "wait_p95_s": round(percentile(self._recent_waits, 95), 4) if self._recent_waits else None,
+            "wait_max_s": round(self.wait_max_s, 4),
+            "rpm_available": round(self.requests.tokens, 2) if self.requests else None,
+            "tpm_available": round(self.tokens.tokens) if self.tokens else None,
+        }
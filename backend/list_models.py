@@ -1,36 +1,225 @@
+"""Model latency probe: rank candidate models and write the profile the backend starts from.
+
+Run from the backend folder:
+    python list_models.py                      # probe MODEL_OPTIONS, write model_profile.json
+    python list_models.py --rounds 3 --models gemini-2.5-flash gemini-2.0-flash
+    python list_models.py --fake               # offline, against local fake models
+    python list_models.py --list               # just list models that support generateContent
+
+Each model gets a warm-up call, then the standard prompt set ``--rounds``
+times, one call at a time so the numbers aren't skewed by our own
+concurrency. Every call is streamed: time to first token is when the
+first non-empty chunk arrives, total latency when the stream ends. A
+timeout or exception counts as an error. Models are ranked healthy
+first (error rate at most ``--max-error-rate``), then by median total
+latency, and written to ``--output``. On startup the backend reorders
+MODEL_OPTIONS (models_config.py) by that file (see MODEL_PROFILE_FILE in
+main.py), so the router prefers the fastest healthy model.
+"""
 import os
-import google.generativeai as genai
-from dotenv import load_dotenv
-
-load_dotenv()
-
-api_key = os.getenv("GOOGLE_API_KEY")
-if not api_key:
-    print("❌ ERROR: GOOGLE_API_KEY not found in .env file")
-    print("Make sure your .env file has: GOOGLE_API_KEY=your_actual_key")
-    exit(1)
-
-genai.configure(api_key=api_key)
-
-print("\n" + "="*60)
-print("Available models for generateContent:")
-print("="*60)
-
-try:
-    models_found = False
-    for model in genai.list_models():
-        if 'generateContent' in model.supported_generation_methods:
-            print(f"✅ {model.name}")
-            models_found = True
-    
-    if not models_found:
-        print("❌ No models found with generateContent support")
-    
-except Exception as e:
-    print(f"❌ Error listing models: {e}")
-    print("\nCheck that:")
-    print("1. Your GOOGLE_API_KEY is correct")
-    print("2. You're connected to internet")
-    print("3. The key has API access enabled")
-
-print("="*60 + "\n")
+import sys
+import json
+import time
+import random
+import asyncio
+import argparse
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from metrics import percentile
+from model_profile import PROFILE_VERSION, rank_models
+
+# Representative turns, wrapped in a short version of the chat prompt
+PROBE_PROMPTS = [
+    "I had a rough day at work and I just feel drained.",
+    "I can't sleep, my mind keeps racing about exams next week.",
+    "Today was actually pretty good, I went for a walk with a friend!",
+    "I feel lonely since I moved to a new city.",
+    "My parents keep arguing and I don't know what to do.",
+]
+PROBE_TEMPLATE = (
+    "You are Wellness Bot, an empathetic AI mental health companion.\n"
+    "You're talking with Sam. Be warm and validate their feelings first. "
+    "Keep responses concise (2-3 sentences).\n\n"
+    "Sam just said: \"{message}\"\n\n"
+    "Your compassionate response:"
+)
+
+
+def list_models():
+    """Print the models this API key can call generateContent on."""
+    from models_config import api_key
+    if not api_key:
+        print("❌ ERROR: GOOGLE_API_KEY not found in .env file")
+        print("Make sure your .env file has: GOOGLE_API_KEY=your_actual_key")
+        sys.exit(1)
+    import google.generativeai as genai
+    genai.configure(api_key=api_key)
+
+    print("\n" + "=" * 60)
+    print("Available models for generateContent:")
+    print("=" * 60)
+    try:
+        models_found = False
+        for model in genai.list_models():
+            if 'generateContent' in model.supported_generation_methods:
+                print(f"✅ {model.name}")
+                models_found = True
+        if not models_found:
+            print("❌ No models found with generateContent support")
+    except Exception as e:
+        print(f"❌ Error listing models: {e}")
+        print("\nCheck that:")
+        print("1. Your GOOGLE_API_KEY is correct")
+        print("2. You're connected to internet")
+        print("3. The key has API access enabled")
+    print("=" * 60 + "\n")
+
+
+def create_clients(names: List[str], fake: bool, seed: int) -> List[Tuple[str, object]]:
+    if fake:
+        from fake_gemini import FakeGeminiModel
+        rng = random.Random(seed)
+        # Different speeds and reliability per model, so the ranking has something to find
+        return [(name, FakeGeminiModel(name, latency_s=rng.uniform(0.02, 0.2),
+                                       error_rate=rng.choice([0.0, 0.0, 0.0, 0.4]), seed=rng.random()))
+                for name in names]
+
+    from models_config import api_key, safety_settings
+    if not api_key:
+        print("❌ GOOGLE_API_KEY not found; use --fake to probe offline")
+        sys.exit(1)
+    import google.generativeai as genai
+    genai.configure(api_key=api_key)
+    return [(name, genai.GenerativeModel(name, safety_settings=safety_settings)) for name in names]
+
+
+async def probe_call(client, prompt: str, timeout_s: float) -> Tuple[Optional[float], float, Optional[str]]:
+    """One streamed call: (time to first token, total seconds, error or None)."""
+    started = time.perf_counter()
+    first_token: List[float] = []
+
+    async def run():
+        stream = await client.generate_content_async(prompt, stream=True)
+        async for chunk in stream:
+            if not first_token and chunk.text:
+                first_token.append(time.perf_counter() - started)
+
+    try:
+        await asyncio.wait_for(run(), timeout=timeout_s)
+    except asyncio.TimeoutError:
+        return None, time.perf_counter() - started, f"timeout after {timeout_s:g}s"
+    except Exception as e:
+        return None, time.perf_counter() - started, str(e)[:160]
+    return (first_token[0] if first_token else None), time.perf_counter() - started, None
+
+
+async def probe_model(name: str, client, rounds: int, warmup: int, timeout_s: float, pause_s: float) -> Dict:
+    prompts = [PROBE_TEMPLATE.format(message=message) for message in PROBE_PROMPTS]
+    for _ in range(warmup):
+        await probe_call(client, prompts[0], timeout_s)
+
+    ttfts, totals, errors = [], [], []
+    for _ in range(rounds):
+        for prompt in prompts:
+            ttft, total, error = await probe_call(client, prompt, timeout_s)
+            if error:
+                errors.append(error)
+            else:
+                totals.append(total)
+                if ttft is not None:
+                    ttfts.append(ttft)
+            if pause_s:
+                await asyncio.sleep(pause_s)
+
+    calls = rounds * len(prompts)
+
+    def rounded(value: Optional[float]) -> Optional[float]:
+        return round(value, 4) if value is not None else None
+
+    return {
+        "name": name,
+        "calls": calls,
+        "successes": len(totals),
+        "errors": len(errors),
+        "error_rate": round(len(errors) / calls, 4) if calls else 0.0,
+        "ttft_p50_s": rounded(percentile(ttfts, 50)),
+        "ttft_p95_s": rounded(percentile(ttfts, 95)),
+        "total_p50_s": rounded(percentile(totals, 50)),
+        "total_p95_s": rounded(percentile(totals, 95)),
+        "last_error": errors[-1] if errors else None,
+    }
+
+
+async def run(args) -> Dict:
+    if args.models:
+        names = args.models
+    else:
+        from models_config import MODEL_OPTIONS
+        names = MODEL_OPTIONS
+    clients = create_clients(names, args.fake, args.seed)
+
+    results = []
+    for name, client in clients:
+        print(f"⏱️ Probing {name}...", flush=True)
+        results.append(await probe_model(name, client, args.rounds, args.warmup, args.timeout, args.pause))
+
+    return {
+        "version": PROFILE_VERSION,
+        "generated_at": datetime.now().isoformat(),
+        "generated_ts": time.time(),
+        "source": "fake" if args.fake else "gemini",
+        "prompts": len(PROBE_PROMPTS),
+        "rounds": args.rounds,
+        "max_error_rate": args.max_error_rate,
+        "models": rank_models(results, args.max_error_rate),
+    }
+
+
+def print_report(profile: Dict):
+    def ms(value: Optional[float]) -> str:
+        return f"{value * 1000:.0f}" if value is not None else "-"
+
+    print("=" * 84)
+    print(f"{'#':>2} {'model':<24} {'healthy':>7} {'errors':>8} {'ttft p50':>9} {'ttft p95':>9} "
+          f"{'total p50':>10} {'total p95':>10}")
+    for entry in profile["models"]:
+        print(f"{entry['rank']:>2} {entry['name']:<24} {'yes' if entry['healthy'] else 'no':>7} "
+              f"{entry['error_rate']:>8.0%} {ms(entry['ttft_p50_s']):>9} {ms(entry['ttft_p95_s']):>9} "
+              f"{ms(entry['total_p50_s']):>10} {ms(entry['total_p95_s']):>10}")
+    print("=" * 84)
+    print("Latencies in ms.")
+    for entry in profile["models"]:
+        if entry["last_error"]:
+            print(f"⚠️ {entry['name']} last error: {entry['last_error']}")
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description="Probe model latency and write a ranked model profile")
+    parser.add_argument("--models", nargs="+", help="Models to probe (default: MODEL_OPTIONS from models_config.py)")
+    parser.add_argument("--rounds", type=int, default=2, help="Passes over the prompt set per model")
+    parser.add_argument("--warmup", type=int, default=1, help="Untimed calls per model before measuring")
+    parser.add_argument("--timeout", type=float, default=30.0, help="Per-call timeout in seconds")
+    parser.add_argument("--pause", type=float, default=0.0, help="Seconds between calls (to stay under RPM quotas)")
+    parser.add_argument("--max-error-rate", type=float, default=0.2, help="Highest error rate still ranked healthy")
+    parser.add_argument("--output", default="model_profile.json", help="Profile file to write")
+    parser.add_argument("--fake", action="store_true", help="Probe local fake models instead of the Gemini API")
+    parser.add_argument("--seed", type=int, default=0, help="Seed for the fake models' latency and errors")
+    parser.add_argument("--list", action="store_true", help="Only list models that support generateContent")
+    args = parser.parse_args()
+
+    if args.list:
+        list_models()
+        return
+
+    profile = asyncio.run(run(args))
+    print_report(profile)
+    with open(args.output, mode="w", encoding="utf-8") as f:
+        json.dump(profile, f, indent=2)
+    print(f"📄 Profile written to {args.output}")
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -1,18 +1,39 @@
-import os
 import time
+IMPORT_STARTED = time.perf_counter()  # for the startup report on /health/ready
+import os
+import hmac
+import math
 import random
 import asyncio
-from typing import Dict, List, Optional
-import google.generativeai as genai
-from fastapi import FastAPI, HTTPException
+import anyio
+from typing import Dict, List, Optional, Sequence, Tuple
+from contextlib import AsyncExitStack, asynccontextmanager
+from fastapi import Body, FastAPI, HTTPException, Query, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
 from pydantic import BaseModel, Field, validator
 from dotenv import load_dotenv
 import logging
-from datetime import datetime, timedelta
+from datetime import datetime
 import json
-import aiofiles
-import aiofiles.os as async_os
+from cache import ConversationCache
+from messages import Message, MessageRing, Role
+from storage import JournalStore, JsonConversationStore, SQLiteConversationStore
+from retention import RetentionWorker
+from crisis import CrisisLatencySLO, CrisisMatcher, load_lexicon
+try:
+    from mood import MoodStore
+except ImportError:  # numpy not installed: mood check-ins aren't stored
+    MoodStore = None
+from turns import UserTurnQueue
+from router import ModelRouter
+from governor import QuotaExceeded, QuotaGovernor, estimate_tokens
+from context import ContextBuilder, SummaryRefresher, format_turn
+from fake_gemini import FakeGeminiModel
+from model_profile import load_profile, order_models
+from models_config import MODEL_OPTIONS, api_key, safety_settings
+from readiness import NotReady, StartupPhases
+from metrics import HTTPMetricsMiddleware, Registry
 
 # Configure logging
 logging.basicConfig(
@@ -25,64 +46,203 @@ logger = logging.getLogger(__name__)
 load_dotenv()
 
 # --- Configure Gemini API ---
-api_key = os.getenv("GOOGLE_API_KEY")
-if not api_key:
-    raise ValueError("GOOGLE_API_KEY not found in .env file")
-    
-genai.configure(api_key=api_key)
-logger.info("✅ Gemini API configured")
-
-# Model options
-MODEL_OPTIONS = [
-    'gemini-2.5-flash',
-    'gemini-2.5-pro',
-    'gemini-2.0-flash',
-    'gemini-flash-latest',
-    'gemini-pro-latest',
-]
+# FAKE_GEMINI=1 swaps every model for a local fake (see fake_gemini.py),
+# for development and load testing without an API key. The key, MODEL_OPTIONS
+# and safety settings are in models_config.py, shared with list_models.py
+FAKE_GEMINI = os.getenv("FAKE_GEMINI", "0").lower() in ("1", "true", "yes")
 
-# Safety settings
-safety_settings = [
-    {"category": "HARM_CATEGORY_HARASSMENT", "threshold": "BLOCK_NONE"},
-    {"category": "HARM_CATEGORY_HATE_SPEECH", "threshold": "BLOCK_NONE"},
-    {"category": "HARM_CATEGORY_SEXUALLY_EXPLICIT", "threshold": "BLOCK_NONE"},
-    {"category": "HARM_CATEGORY_DANGEROUS_CONTENT", "threshold": "BLOCK_MEDIUM_AND_ABOVE"}
-]
+# Latency profile from the probe (python list_models.py). When present and
+# younger than MODEL_PROFILE_MAX_AGE_H (0: any age), it reorders
+# MODEL_OPTIONS at startup: fastest healthy models first, unmeasured ones
+# next, models the probe saw failing last.
+MODEL_PROFILE_FILE = os.getenv("MODEL_PROFILE_FILE", "model_profile.json")
+MODEL_PROFILE_MAX_AGE_H = float(os.getenv("MODEL_PROFILE_MAX_AGE_H", "168"))
 
-# Model initialization
-model = None
-selected_model_name = None
-for model_name in MODEL_OPTIONS:
-    try:
-        test_model = genai.GenerativeModel(model_name, safety_settings=safety_settings)
-        model = test_model
-        selected_model_name = model_name
-        logger.info(f"✅ Successfully loaded model: {selected_model_name}")
-        break
-    except Exception as e:
-        logger.warning(f"⚠️ Model {model_name} not available: {str(e)[:80]}")
-        continue
+# Model initialization: every model that constructs is kept, in
+# MODEL_OPTIONS order, so requests can fail over between them at runtime.
+# The Gemini SDK takes most of a second to import, so this runs in the
+# background after the server starts (see init_models); a missing key or
+# no usable model fails the "models" readiness phase instead of the import.
+models = []
+
+# Preferred model, reported when no model was called (e.g. crisis replies)
+selected_model_name = MODEL_OPTIONS[0]
 
-if model is None:
-    error_msg = "❌ No Gemini models available. Check API key at https://aistudio.google.com"
-    logger.error(error_msg)
-    raise ValueError(error_msg)
+def create_models() -> List[Tuple[str, object]]:
+    """Configure Gemini and construct the available models (blocking; run in a thread)"""
+    if FAKE_GEMINI:
+        logger.warning("🧪 FAKE_GEMINI is set: responses come from a local fake model")
+    elif not api_key:
+        raise ValueError("GOOGLE_API_KEY not found in .env file")
+    else:
+        import google.generativeai as genai
+        genai.configure(api_key=api_key)
+        logger.info("✅ Gemini API configured")
+    
+    profile = load_profile(MODEL_PROFILE_FILE, MODEL_PROFILE_MAX_AGE_H * 3600)
+    preferences = order_models(MODEL_OPTIONS, profile)
+    if profile:
+        logger.info(f"📊 Model order from {MODEL_PROFILE_FILE} ({profile['source']}, {profile['generated_at']}): "
+                    f"{', '.join(preferences)}")
+    
+    loaded = []
+    for model_name in preferences:
+        try:
+            if FAKE_GEMINI:
+                loaded.append((model_name, FakeGeminiModel(model_name)))
+            else:
+                loaded.append((model_name, genai.GenerativeModel(model_name, safety_settings=safety_settings)))
+            logger.info(f"✅ Successfully loaded model: {model_name}")
+        except Exception as e:
+            logger.warning(f"⚠️ Model {model_name} not available: {str(e)[:80]}")
+            continue
+    
+    if not loaded:
+        error_msg = "❌ No Gemini models available. Check API key at https://aistudio.google.com"
+        logger.error(error_msg)
+        raise ValueError(error_msg)
+    return loaded
 
 # --- Chat History Persistence ---
 CHAT_HISTORY_FILE = "chat_history.json"
-conversation_history: Dict[str, List[Dict[str, str]]] = {}
+CHAT_JOURNAL_FILE = "chat_history.journal"
+CHAT_DB_FILE = os.getenv("CHAT_DB_FILE", "chat_history.db")
 MAX_USERS = 1000
 MAX_MESSAGES_PER_USER = 30
 MAX_FILE_SIZE_MB = 100
 
+# Hot conversations kept in memory (least recently used are evicted first;
+# their history stays on disk and is reloaded on next access). Applies to
+# SQLite and to SNAPSHOT_FORMAT=binary: the JSON snapshot has no per-user
+# index, so reloading one user means parsing the whole file, and the JSON
+# format keeps every conversation in memory instead.
+CACHE_MAX_USERS = int(os.getenv("CACHE_MAX_USERS", str(MAX_USERS)))
+CACHE_MAX_BYTES = int(os.getenv("CACHE_MAX_MB", "64")) * 1024 * 1024
+
+# Journal durability: "always" fsyncs every message, "interval" at most once
+# per JOURNAL_FSYNC_INTERVAL seconds, "never" leaves it to the OS
+JOURNAL_FSYNC = os.getenv("JOURNAL_FSYNC", "interval")
+JOURNAL_FSYNC_INTERVAL = float(os.getenv("JOURNAL_FSYNC_INTERVAL", "1.0"))
+JOURNAL_COMPACT_EVERY = int(os.getenv("JOURNAL_COMPACT_EVERY", "500"))
+
+# Snapshot format for the JSON backend. "binary" writes CHAT_SNAPSHOT_FILE
+# in the indexed format from snapshot.py: startup reads only its index and
+# users are decoded when first used. The first start converts
+# CHAT_HISTORY_FILE and leaves it in place; convert_history.py converts
+# either way by hand.
+SNAPSHOT_FORMAT = os.getenv("SNAPSHOT_FORMAT", "json").lower()
+CHAT_SNAPSHOT_FILE = os.getenv("CHAT_SNAPSHOT_FILE", "chat_history.snap")
+
+# Messages older than RETENTION_DAYS are expired in the background, at most
+# RETENTION_BATCH_USERS users per tick; mood check-ins past the same cutoff
+# are dropped on each tick too
+RETENTION_DAYS = float(os.getenv("RETENTION_DAYS", "30"))
+RETENTION_INTERVAL_S = float(os.getenv("RETENTION_INTERVAL_S", "60"))
+RETENTION_BATCH_USERS = int(os.getenv("RETENTION_BATCH_USERS", "200"))
+
+# Mood check-ins sent along with chat messages (moodHistory) are kept per
+# user as array-backed time series, up to MOOD_MAX_SAMPLES_PER_USER each,
+# snapshotted to MOOD_FILE every MOOD_SAVE_INTERVAL_S. /mood/{userName}/trend
+# serves rollups over MOOD_TREND_DAYS; MOOD_CONTEXT adds a one-line mood
+# summary to the prompt. Needs numpy; without it the app runs with mood
+# tracking off. Mood series live in each process's memory and MOOD_FILE,
+# so mood tracking is also off under SHARED_STATE: workers would each
+# serve their own trends and overwrite each other's file. A message carries
+# at most MOOD_HISTORY_MAX_ITEMS check-ins (the client sends its last 10).
+MOOD_FILE = os.getenv("MOOD_FILE", "mood_history.npz")
+MOOD_MAX_SAMPLES_PER_USER = int(os.getenv("MOOD_MAX_SAMPLES_PER_USER", "2000"))
+MOOD_SAVE_INTERVAL_S = float(os.getenv("MOOD_SAVE_INTERVAL_S", "60"))
+MOOD_TREND_DAYS = int(os.getenv("MOOD_TREND_DAYS", "30"))
+MOOD_PROMPT_DAYS = int(os.getenv("MOOD_PROMPT_DAYS", "7"))
+MOOD_CONTEXT = os.getenv("MOOD_CONTEXT", "1").lower() in ("1", "true", "yes")
+MOOD_HISTORY_MAX_ITEMS = int(os.getenv("MOOD_HISTORY_MAX_ITEMS", "50"))
+
+# "json" keeps all history in memory backed by the journal above;
+# "sqlite" loads users lazily from CHAT_DB_FILE; a newly created database
+# imports CHAT_HISTORY_FILE once
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "json").lower()
+
+# /history and /export/{userName} send the user's history version as an
+# ETag, so polling clients get a body-less 304 while nothing has changed.
+# The all-users export streams NDJSON, reading EXPORT_BATCH_USERS at a time.
+# It hands out everyone's conversations, so it is off (404) unless
+# EXPORT_TOKEN is set, and then needs "Authorization: Bearer <EXPORT_TOKEN>".
+EXPORT_BATCH_USERS = int(os.getenv("EXPORT_BATCH_USERS", "200"))
+EXPORT_TOKEN = os.getenv("EXPORT_TOKEN", "")
+
+# Set when several worker processes (uvicorn --workers N) share one store.
+# Only the SQLite backend supports it; cached conversations are then
+# revalidated against the database before being served. Per-user turn
+# ordering and double-submit coalescing (CHAT_COALESCE_WINDOW_S) stay
+# per process: two workers can interleave turns for the same user, so
+# route each user to one worker (sticky sessions) if order matters.
+SHARED_STATE = os.getenv("SHARED_STATE", "0").lower() in ("1", "true", "yes")
+
 # File lock for async operations
 file_lock = asyncio.Lock()
 
+def create_conversation_store():
+    cache = ConversationCache(max_users=CACHE_MAX_USERS, max_bytes=CACHE_MAX_BYTES)
+    if STORAGE_BACKEND == "json" and SNAPSHOT_FORMAT != "binary":
+        logger.info("🧠 JSON snapshot: keeping every conversation in memory "
+                    "(CACHE_MAX_USERS/CACHE_MAX_MB need SNAPSHOT_FORMAT=binary)")
+        cache = ConversationCache(max_users=None, max_bytes=None)
+    if STORAGE_BACKEND == "sqlite":
+        logger.info(f"🗄️ Using SQLite storage: {CHAT_DB_FILE}")
+        return SQLiteConversationStore(
+            CHAT_DB_FILE,
+            cache=cache,
+            max_messages_per_user=MAX_MESSAGES_PER_USER,
+            import_from=CHAT_HISTORY_FILE,
+            shared=SHARED_STATE,
+        )
+    if STORAGE_BACKEND != "json":
+        raise ValueError(f"Unknown STORAGE_BACKEND '{STORAGE_BACKEND}' (expected 'json' or 'sqlite')")
+    if SHARED_STATE:
+        raise ValueError("SHARED_STATE requires STORAGE_BACKEND=sqlite")
+    journal = JournalStore(
+        CHAT_SNAPSHOT_FILE if SNAPSHOT_FORMAT == "binary" else CHAT_HISTORY_FILE,
+        CHAT_JOURNAL_FILE,
+        max_messages_per_user=MAX_MESSAGES_PER_USER,
+        fsync_policy=JOURNAL_FSYNC,
+        fsync_interval=JOURNAL_FSYNC_INTERVAL,
+        compact_every=JOURNAL_COMPACT_EVERY,
+        lock=file_lock,
+        snapshot_format=SNAPSHOT_FORMAT,
+        import_from=CHAT_HISTORY_FILE,
+    )
+    return JsonConversationStore(journal, cache=cache, max_messages_per_user=MAX_MESSAGES_PER_USER)
+
+conversation_store = create_conversation_store()
+def create_mood_store() -> Optional["MoodStore"]:
+    if SHARED_STATE:
+        logger.warning("⚠️ SHARED_STATE: mood tracking is off (mood history is per process)")
+        return None
+    if MoodStore is None:
+        logger.warning("⚠️ numpy is not installed: mood check-ins are not stored (pip install numpy)")
+        return None
+    return MoodStore(
+        MOOD_FILE,
+        max_samples_per_user=MOOD_MAX_SAMPLES_PER_USER,
+        save_interval_s=MOOD_SAVE_INTERVAL_S,
+    )
+
+mood_store = create_mood_store()
+retention_worker = RetentionWorker(
+    conversation_store,
+    retention_days=RETENTION_DAYS,
+    interval_s=RETENTION_INTERVAL_S,
+    batch_users=RETENTION_BATCH_USERS,
+    mood_store=mood_store,
+)
+
 # --- Crisis Detection ---
-CRISIS_KEYWORDS = [
-    'suicide', 'kill myself', 'end my life', 'want to die', 
-    'self harm', 'hurt myself', 'no reason to live', 'give up'
-]
+# Phrases per language live in a data file; all of them are compiled into one matcher
+CRISIS_LEXICON_FILE = os.getenv(
+    "CRISIS_LEXICON_FILE",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "crisis_lexicon.json")
+)
+crisis_matcher = CrisisMatcher(load_lexicon(CRISIS_LEXICON_FILE))
 
 CRISIS_RESPONSE = (
     "I'm really concerned about what you're sharing. Your safety is the most important thing. "
@@ -92,140 +252,231 @@ CRISIS_RESPONSE = (
     "You don't have to face this alone. Please talk to someone who can help right away."
 )
 
+# Crisis replies skip the turn queue, model quota and storage on the
+# request path; the turn is persisted (and synced to disk) right after.
+# Replies slower than CRISIS_SLO_MS count as SLO breaches in /stats.
+CRISIS_SLO_MS = float(os.getenv("CRISIS_SLO_MS", "50"))
+crisis_slo = CrisisLatencySLO(slo_ms=CRISIS_SLO_MS)
+crisis_writes = set()
+
+# --- Metrics ---
+# Prometheus text format at /metrics. Request-path stages and model calls are
+# recorded as they happen; store sizes and component counters already kept
+# elsewhere are read at scrape time.
+metrics = Registry()
+http_requests_total = metrics.counter(
+    "wellness_http_requests_total", "HTTP requests by route and status", ["method", "path", "status"])
+http_request_seconds = metrics.histogram(
+    "wellness_http_request_duration_seconds", "HTTP request latency by route", ["path"])
+stage_seconds = metrics.histogram(
+    "wellness_stage_seconds",
+    "Time spent per chat stage (validation, detect_crisis, store_message, context_build, quota_wait, "
+    "generate, persistence)",
+    ["stage"])
+model_call_seconds = metrics.histogram(
+    "wellness_model_call_seconds", "Upstream model call latency by model and outcome", ["model", "outcome"])
+rate_limited_total = metrics.counter("wellness_rate_limited_total", "429 responses from the model API", ["model"])
+retries_total = metrics.counter("wellness_retries_total", "Backoff retries after every model was rate limited")
+crisis_total = metrics.counter("wellness_crisis_detected_total", "Messages answered with the crisis response")
+crisis_reply_seconds = metrics.histogram(
+    "wellness_crisis_reply_seconds", "Crisis reply latency inside the handler",
+    buckets=(0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1))
+
+metrics.gauge("wellness_users", "Users with stored history").set_function(lambda: conversation_store.user_count())
+metrics.gauge("wellness_messages", "Stored messages").set_function(lambda: conversation_store.message_count())
+metrics.gauge("wellness_storage_bytes", "Bytes used by history on disk").set_function(
+    lambda: conversation_store.disk_usage())
+metrics.gauge("wellness_mood_samples", "Stored mood check-ins").set_function(
+    lambda: mood_store.sample_count() if mood_store else 0)
+metrics.gauge("wellness_cache_users", "Conversations held in memory").set_function(
+    lambda: len(conversation_store.cache))
+metrics.counter("wellness_cache_evictions_total", "Conversations evicted from memory").set_function(
+    lambda: conversation_store.cache.evictions)
+metrics.gauge("wellness_quota_queue_depth", "Requests waiting for model quota").set_function(
+    lambda: quota_governor.queue_depth)
+metrics.gauge("wellness_quota_active", "Model calls holding a quota slot").set_function(
+    lambda: quota_governor.active)
+metrics.counter("wellness_quota_rejected_total", "Requests turned away by the quota governor").set_function(
+    lambda: quota_governor.rejected)
+metrics.counter("wellness_failovers_total", "Requests that moved on to another model").set_function(
+    lambda: model_router.failovers if model_router else 0)
+metrics.counter("wellness_coalesced_total", "Duplicate chat submissions that shared a turn").set_function(
+    lambda: chat_turns.coalesced)
+metrics.counter("wellness_crisis_slo_breaches_total", "Crisis replies slower than CRISIS_SLO_MS").set_function(
+    lambda: crisis_slo.breaches)
+
+def observe_model_call(model_name: str, seconds: float, outcome: str):
+    model_call_seconds.labels(model_name, outcome).observe(seconds)
+    if outcome == "rate_limited":
+        rate_limited_total.labels(model_name).inc()
+
 # --- Retry Logic ---
-class RetryHandler:
+RATE_LIMIT_KEYWORDS = ['429', 'resource_exhausted', 'quota', 'rate_limit', 'too_many_requests']
+
+class AsyncRetryHandler:
+    """Retry handler for coroutines; backs off with asyncio.sleep so the event loop keeps serving."""
+    
     def __init__(self, max_retries: int = 3, base_delay: float = 1, max_delay: float = 10):
         self.max_retries = max_retries
         self.base_delay = base_delay
         self.max_delay = max_delay
     
-    def execute_with_retry(self, func, *args, **kwargs):
+    def is_rate_limit(self, error: Exception) -> bool:
+        error_str = str(error).lower()
+        return any(keyword in error_str for keyword in RATE_LIMIT_KEYWORDS)
+    
+    def backoff_delay(self, attempt: int) -> float:
+        """Delay before the next attempt, or raise once retries are exhausted."""
+        if attempt == self.max_retries - 1:
+            logger.error(f"Max retries ({self.max_retries}) reached for rate limit")
+            raise HTTPException(status_code=429, detail="AI service is busy. Please try again in a moment.")
+        
+        delay = min(self.base_delay * (2 ** attempt) + random.uniform(0, 1), self.max_delay)
+        retries_total.inc()
+        logger.warning(f"Rate limited. Retry {attempt + 1}/{self.max_retries} after {delay:.2f}s")
+        return delay
+    
+    async def execute_with_retry(self, func, *args, **kwargs):
         last_exception = None
         for attempt in range(self.max_retries):
             try:
-                return func(*args, **kwargs)
+                return await func(*args, **kwargs)
             except Exception as e:
                 last_exception = e
-                error_str = str(e).lower()
-                is_rate_limit = any(keyword in error_str for keyword in 
-                                    ['429', 'resource_exhausted', 'quota', 'rate_limit', 'too_many_requests'])
-                
-                if is_rate_limit:
-                    if attempt == self.max_retries - 1:
-                        logger.error(f"Max retries ({self.max_retries}) reached for rate limit")
-                        raise HTTPException(status_code=429, detail="AI service is busy. Please try again in a moment.")
-                    
-                    delay = min(self.base_delay * (2 ** attempt) + random.uniform(0, 1), self.max_delay)
-                    logger.warning(f"Rate limited. Retry {attempt + 1}/{self.max_retries} after {delay:.2f}s")
-                    time.sleep(delay)
+                if self.is_rate_limit(e):
+                    await asyncio.sleep(self.backoff_delay(attempt))
                 else:
                     logger.error(f"Non-retryable error (attempt {attempt + 1}): {str(e)[:100]}")
                     raise
         raise last_exception
 
-retry_handler = RetryHandler(max_retries=3, base_delay=1, max_delay=8)
+retry_handler = AsyncRetryHandler(max_retries=3, base_delay=1, max_delay=8)
+
+# Per-attempt timeout for a single Gemini call, and how often to check
+# whether the client is still waiting for it
+GENERATION_TIMEOUT_S = float(os.getenv("GENERATION_TIMEOUT_S", "30"))
+DISCONNECT_POLL_INTERVAL_S = 0.5
+
+# Model failover: a model's breaker opens after MODEL_BREAKER_THRESHOLD
+# consecutive failures (e.g. a 429 storm) and it is skipped for
+# MODEL_BREAKER_COOLDOWN_S. Set MODEL_HEDGE_PERCENTILE (e.g. 95) to send a
+# backup request to the next model when the first is slower than that.
+MODEL_BREAKER_THRESHOLD = int(os.getenv("MODEL_BREAKER_THRESHOLD", "3"))
+MODEL_BREAKER_COOLDOWN_S = float(os.getenv("MODEL_BREAKER_COOLDOWN_S", "30"))
+MODEL_HEDGE_PERCENTILE = float(os.getenv("MODEL_HEDGE_PERCENTILE")) if os.getenv("MODEL_HEDGE_PERCENTILE") else None
+
+model_router: Optional[ModelRouter] = None  # built by init_models() at startup
+
+async def init_models():
+    """Startup phase: construct the models off the event loop and route across them"""
+    global models, model_router, selected_model_name
+    loaded = await asyncio.to_thread(create_models)
+    model_router = ModelRouter(
+        loaded,
+        is_rate_limit=retry_handler.is_rate_limit,
+        attempt_timeout_s=GENERATION_TIMEOUT_S,
+        breaker_threshold=MODEL_BREAKER_THRESHOLD,
+        cooldown_s=MODEL_BREAKER_COOLDOWN_S,
+        hedge_percentile=MODEL_HEDGE_PERCENTILE,
+        on_call=observe_model_call,
+    )
+    models = loaded
+    selected_model_name = model_router.primary
+    logger.info(f"Model: {selected_model_name} (failover: {', '.join(model_router.order[1:]) or 'none'})")
+
+# Proactive quota governor in front of the model API: requests/min and
+# tokens/min buckets (0 = unlimited) plus a concurrency cap. Up to
+# GEMINI_QUEUE_MAX requests wait for capacity; anything that couldn't start
+# within GEMINI_QUEUE_MAX_WAIT_S gets a fast 503 with Retry-After instead.
+GEMINI_RPM = float(os.getenv("GEMINI_RPM", "60"))
+GEMINI_TPM = float(os.getenv("GEMINI_TPM", "1000000"))
+GEMINI_MAX_CONCURRENCY = int(os.getenv("GEMINI_MAX_CONCURRENCY", "16"))
+GEMINI_QUEUE_MAX = int(os.getenv("GEMINI_QUEUE_MAX", "64"))
+GEMINI_QUEUE_MAX_WAIT_S = float(os.getenv("GEMINI_QUEUE_MAX_WAIT_S", "10"))
+ESTIMATED_OUTPUT_TOKENS = 256  # "2-3 sentences" plus headroom
+
+# The governor is per process. Under SHARED_STATE the limits above are the
+# budget for the whole deployment and are split evenly between
+# QUOTA_WORKERS processes (default: WEB_CONCURRENCY, the worker count
+# uvicorn and gunicorn read), so N workers don't get N times the quota.
+QUOTA_WORKERS = max(1, int(os.getenv("QUOTA_WORKERS", os.getenv("WEB_CONCURRENCY", "1")))) if SHARED_STATE else 1
+
+quota_governor = QuotaGovernor(
+    rpm=GEMINI_RPM / QUOTA_WORKERS,
+    tpm=GEMINI_TPM / QUOTA_WORKERS,
+    max_concurrency=max(1, GEMINI_MAX_CONCURRENCY // QUOTA_WORKERS),
+    max_queue=GEMINI_QUEUE_MAX,
+    max_wait_s=GEMINI_QUEUE_MAX_WAIT_S,
+)
+
+# Prompt context: recent turns are packed newest first into
+# CONTEXT_TOKEN_BUDGET; older turns are folded into a per-user rolling
+# summary (refreshed in the background once SUMMARY_BATCH_MESSAGES turns
+# have dropped out of the budget) that is stored with the history.
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "800"))
+SUMMARY_TOKEN_BUDGET = int(os.getenv("SUMMARY_TOKEN_BUDGET", "200"))
+SUMMARY_BATCH_MESSAGES = int(os.getenv("SUMMARY_BATCH_MESSAGES", "6"))
+CONTEXT_SUMMARIES = os.getenv("CONTEXT_SUMMARIES", "1").lower() in ("1", "true", "yes")
+
+context_builder = ContextBuilder(token_budget=CONTEXT_TOKEN_BUDGET, summary_token_budget=SUMMARY_TOKEN_BUDGET)
+
+# Each user's turns run one at a time in arrival order. The same message
+# resent within this window (double-submit, second tab) shares the first
+# turn's response instead of being stored and generated again; 0 disables.
+CHAT_COALESCE_WINDOW_S = float(os.getenv("CHAT_COALESCE_WINDOW_S", "2"))
+chat_turns = UserTurnQueue(coalesce_window_s=CHAT_COALESCE_WINDOW_S)
+
+# /chat/batch takes up to CHAT_BATCH_MAX_ITEMS turns in one request. Each
+# user's items run in order; up to CHAT_BATCH_CONCURRENCY generations run at
+# once across users, and every stored turn goes out in one group commit.
+CHAT_BATCH_MAX_ITEMS = int(os.getenv("CHAT_BATCH_MAX_ITEMS", "100"))
+CHAT_BATCH_CONCURRENCY = int(os.getenv("CHAT_BATCH_CONCURRENCY", "8"))
+
+# Startup is phased: the app answers /health/live as soon as it is up,
+# while storage and the model client warm up in the background.
+# /health/ready turns 200 once both are warm. Requests that arrive earlier
+# wait up to STARTUP_WAIT_S for what they need, then get a 503.
+STARTUP_WAIT_S = float(os.getenv("STARTUP_WAIT_S", "10"))
+startup_phases = StartupPhases(max_wait_s=STARTUP_WAIT_S, process_started=IMPORT_STARTED)
 
 # --- File Operations ---
 async def load_chat_history():
-    """Load chat history from JSON file on startup."""
-    global conversation_history
-    async with file_lock:
-        if not await async_os.path.exists(CHAT_HISTORY_FILE):
-            logger.info(f"'{CHAT_HISTORY_FILE}' not found, starting with empty history.")
-            conversation_history = {}
-            return
-
-        try:
-            async with aiofiles.open(CHAT_HISTORY_FILE, mode='r', encoding='utf-8') as f:
-                content = await f.read()
-                if content:
-                    try:
-                        conversation_history = json.loads(content)
-                        logger.info(f"✅ Successfully loaded chat history for {len(conversation_history)} users.")
-                    except json.JSONDecodeError:
-                        logger.error(f"❌ JSON corrupted in '{CHAT_HISTORY_FILE}'. Starting fresh.")
-                        conversation_history = {}
-                        # Backup corrupted file
-                        backup_file = f"{CHAT_HISTORY_FILE}.corrupted_{datetime.now().timestamp()}"
-                        async with aiofiles.open(backup_file, mode='w') as backup:
-                            await backup.write(content)
-                        logger.info(f"⚠️ Backed up corrupted file to {backup_file}")
-                else:
-                    logger.info("History file is empty, starting fresh.")
-                    conversation_history = {}
-        except Exception as e:
-            logger.error(f"❌ Error loading '{CHAT_HISTORY_FILE}': {e}. Starting with empty history.")
-            conversation_history = {}
+    """Open conversation storage on startup."""
+    await conversation_store.load()
 
 async def save_chat_history():
-    """Save conversation history to JSON file with backup."""
-    async with file_lock:
-        try:
-            # Create backup first
-            if await async_os.path.exists(CHAT_HISTORY_FILE):
-                try:
-                    backup_file = f"{CHAT_HISTORY_FILE}.backup"
-                    async with aiofiles.open(CHAT_HISTORY_FILE, mode='r') as f:
-                        content = await f.read()
-                    async with aiofiles.open(backup_file, mode='w') as f:
-                        await f.write(content)
-                except Exception as e:
-                    logger.warning(f"⚠️ Could not create backup: {e}")
-            
-            # Write new data
-            async with aiofiles.open(CHAT_HISTORY_FILE, mode='w', encoding='utf-8') as f:
-                await f.write(json.dumps(conversation_history, indent=2))
-            logger.debug(f"💾 Chat history saved ({len(conversation_history)} users)")
-        except Exception as e:
-            logger.error(f"❌ Error saving chat history to '{CHAT_HISTORY_FILE}': {e}")
+    """Flush conversation storage to its compact on-disk form."""
+    await conversation_store.flush()
+
+async def warm_storage():
+    """Startup phase: load history, then start background maintenance"""
+    await load_chat_history()
+    if mood_store:
+        await mood_store.load()
+    await check_file_size()
+    retention_worker.start()
+    if mood_store:
+        mood_store.start()
+    logger.info(f"Loaded {conversation_store.user_count()} active users from history")
 
 async def check_file_size():
     """Check file size and warn if too large."""
-    if await async_os.path.exists(CHAT_HISTORY_FILE):
-        try:
-            file_size = os.path.getsize(CHAT_HISTORY_FILE)
-            size_mb = file_size / (1024 * 1024)
-            
-            if size_mb > MAX_FILE_SIZE_MB:
-                logger.warning(f"⚠️ Chat history file is {size_mb:.2f} MB (limit: {MAX_FILE_SIZE_MB}MB)")
-            else:
-                logger.info(f"📊 Chat history file size: {size_mb:.2f} MB")
-        except Exception as e:
-            logger.error(f"❌ Error checking file size: {e}")
-
-async def cleanup_old_messages():
-    """Remove messages older than 30 days."""
-    cutoff_time = datetime.now() - timedelta(days=30)
-    cleaned_count = 0
-    
-    for user in list(conversation_history.keys()):
-        try:
-            original_count = len(conversation_history[user])
-            filtered = [
-                msg for msg in conversation_history[user]
-                if datetime.fromisoformat(msg['timestamp']) > cutoff_time
-            ]
-            
-            if len(filtered) < original_count:
-                cleaned_count += original_count - len(filtered)
-                conversation_history[user] = filtered
-                logger.info(f"🧹 Cleaned {original_count - len(filtered)} old messages for {user}")
-            
-            if not conversation_history[user]:
-                del conversation_history[user]
-                logger.info(f"🗑️ Removed empty user: {user}")
-        except Exception as e:
-            logger.error(f"❌ Error cleaning messages for {user}: {e}")
-    
-    if cleaned_count > 0:
-        await save_chat_history()
-        logger.info(f"✅ Cleanup complete: {cleaned_count} messages removed")
+    try:
+        file_size = conversation_store.disk_usage()
+        size_mb = file_size / (1024 * 1024)
+        
+        if size_mb > MAX_FILE_SIZE_MB:
+            logger.warning(f"⚠️ Chat history file is {size_mb:.2f} MB (limit: {MAX_FILE_SIZE_MB}MB)")
+        else:
+            logger.info(f"📊 Chat history file size: {size_mb:.2f} MB")
+    except Exception as e:
+        logger.error(f"❌ Error checking file size: {e}")
 
 # --- Pydantic Models ---
 class ChatInput(BaseModel):
     message: str = Field(..., min_length=1, max_length=1000, description="User message")
     userName: str = Field(..., min_length=1, max_length=50, description="Username")
-    moodHistory: Optional[List[Dict]] = Field(default=None, description="User mood history")
+    moodHistory: Optional[List[Dict]] = Field(default=None, max_length=MOOD_HISTORY_MAX_ITEMS, description="User mood history")
     messageCount: Optional[int] = Field(default=0, description="Message count")
     crisisLevel: Optional[str] = Field(default='none', description="Crisis level")
 
@@ -252,6 +503,18 @@ class ChatResponse(BaseModel):
     is_crisis: bool = Field(False, description="Whether crisis was detected")
     model: str = Field(..., description="Model used for response")
 
+class ChatBatchResult(BaseModel):
+    userName: Optional[str] = None
+    status_code: int = Field(..., description="Status this item would have had on /chat")
+    result: Optional[ChatResponse] = None
+    error: Optional[str] = None
+    retry_after: Optional[int] = None
+
+class ChatBatchResponse(BaseModel):
+    results: List[ChatBatchResult]
+    crisis_count: int
+    stored_messages: int
+
 class HistoryMessage(BaseModel):
     role: str
     content: str
@@ -261,6 +524,8 @@ class HistoryResponse(BaseModel):
     userName: str
     messages: List[HistoryMessage]
     total_messages: int
+    next_before: Optional[float] = Field(None, description="Cursor for the next (older) page; null on the last page")
+    next_before_seen: int = Field(0, description="Messages at exactly next_before already returned; pass back as before_seen")
 
 # --- FastAPI Setup ---
 app = FastAPI(
@@ -287,57 +552,84 @@ app.add_middleware(
     allow_methods=["*"],  # Allow all methods
     allow_headers=["*"],  # Allow all headers
 )
+
+app.add_middleware(HTTPMetricsMiddleware, requests=http_requests_total, duration=http_request_seconds)
 # --- Helper Functions ---
 def detect_crisis(message: str) -> bool:
-    """Detect crisis keywords"""
-    message_lower = message.lower()
-    message_clean = ''.join(c if c.isalnum() or c.isspace() else '' for c in message_lower)
-    return any(keyword in message_clean for keyword in CRISIS_KEYWORDS)
-
-def get_conversation_context(userName: str, max_messages: int = 6) -> str:
-    """Get recent conversation history"""
-    if userName not in conversation_history:
-        return ""
-    
-    recent_messages = conversation_history[userName][-max_messages:]
-    if not recent_messages:
+    """Detect crisis phrases"""
+    with stage_seconds.labels("detect_crisis").time():
+        return crisis_matcher.matches(message)
+
+def ingest_mood(chat_input: ChatInput):
+    """Store the mood check-ins the client sent along with a message.
+
+    Called after crisis detection, so crisis replies never wait on it; check-ins
+    skipped on a crisis turn are resent with the client's next message.
+    """
+    if mood_store and chat_input.moodHistory:
+        mood_store.ingest(chat_input.userName, chat_input.moodHistory)
+
+def observe_validation(request: Request, started: float):
+    """Time from the request arriving to the handler starting: body parsing and validation"""
+    received_at = getattr(request.state, "received_at", None)
+    if received_at is not None:
+        stage_seconds.labels("validation").observe(started - received_at)
+
+async def get_conversation_context(userName: str, pending: Sequence[Message] = ()) -> str:
+    """Get the summary plus as many recent turns as fit the token budget.
+
+    ``pending`` are turns of this user not yet written to the store (batch
+    items waiting for the group commit); they count as the newest turns.
+    """
+    messages = await conversation_store.get_messages(userName)
+    if pending:
+        messages = MessageRing(MAX_MESSAGES_PER_USER, [*messages, *pending])
+    if not messages:
         return ""
-    
-    context_parts = []
-    for msg in recent_messages:
-        prefix = "User" if msg['role'] == 'user' else "Wellness Bot"
-        context_parts.append(f"{prefix}: {msg['content']}")
-    
-    context = "\n".join(context_parts)
-    return f"\n\nConversation context:\n{context}\n" if context else ""
-
-async def store_message(userName: str, role: str, content: str):
-    """Store message and save to file"""
-    if userName not in conversation_history:
-        if len(conversation_history) >= MAX_USERS:
-            logger.warning(f"⚠️ Max users ({MAX_USERS}) reached, clearing oldest user")
-            oldest_user = next(iter(conversation_history))
-            del conversation_history[oldest_user]
-        
-        conversation_history[userName] = []
-    
-    conversation_history[userName].append({
-        'role': role,
-        'content': content,
-        'timestamp': datetime.now().isoformat()
-    })
-    
-    if len(conversation_history[userName]) > MAX_MESSAGES_PER_USER:
-        conversation_history[userName] = conversation_history[userName][-MAX_MESSAGES_PER_USER:]
-        logger.info(f"Trimmed history for {userName} to {MAX_MESSAGES_PER_USER} messages")
-    
-    await save_chat_history()
+    summary = await conversation_store.get_summary(userName) if summary_refresher else None
+    with stage_seconds.labels("context_build").time():
+        context, left_out = context_builder.build(messages, summary)
+    # A summary must not cover turns that aren't stored yet
+    if summary_refresher and not pending:
+        summary_refresher.maybe_schedule(userName, left_out)
+    return context
 
-def generate_ai_response(message: str, userName: str) -> str:
-    """Generate AI response"""
-    context = get_conversation_context(userName)
-    
+async def summarize_turns(userName: str, previous: Optional[str], turns: List[Message]) -> str:
+    """Fold older turns into the user's rolling summary (background, low priority)"""
+    transcript = "\n".join(format_turn(msg) for msg in turns)
     prompt = (
+        f"You keep private notes for Wellness Bot, an empathetic mental health companion, "
+        f"about its conversation with {userName}.\n"
+        f"Update the notes with the new messages below. Keep what matters for continuity: "
+        f"how {userName} has been feeling, what is worrying them, people and events they "
+        f"mentioned, and what helped. Write at most 120 words in plain sentences.\n\n"
+        f"Current notes:\n{previous or '(none yet)'}\n\n"
+        f"New messages:\n{transcript}\n\n"
+        f"Updated notes:"
+    )
+    async with model_quota(prompt):
+        text, _ = await governed_call(model_router.generate(prompt))
+    return text
+
+summary_refresher = SummaryRefresher(
+    conversation_store,
+    context_builder,
+    summarize_turns,
+    batch_messages=SUMMARY_BATCH_MESSAGES,
+    busy=lambda: quota_governor.queue_depth > 0,
+) if CONTEXT_SUMMARIES else None
+
+async def store_message(userName: str, role: str, content: str, stage: str = "store_message"):
+    """Store message through the conversation store"""
+    with stage_seconds.labels(stage).time():
+        await conversation_store.append(userName, Message(Role.parse(role), content, time.time()))
+
+async def build_prompt(message: str, userName: str, pending: Sequence[Message] = ()) -> str:
+    """Build the Gemini prompt for a user turn"""
+    context = await get_conversation_context(userName, pending)
+    mood = mood_store.prompt_summary(userName, MOOD_PROMPT_DAYS) if mood_store and MOOD_CONTEXT else ""
+    
+    return (
         f"You are Wellness Bot, an empathetic AI mental health companion.\n"
         f"You're talking with {userName}.\n\n"
         f"IMPORTANT GUIDELINES:\n"
@@ -349,16 +641,125 @@ def generate_ai_response(message: str, userName: str) -> str:
         f"- NEVER pretend to be a professional therapist\n"
         f"- If they mention serious mental health concerns, acknowledge and suggest professional help\n"
         f"- Ask gentle follow-up questions to show you care\n"
+        f"{mood}"
         f"{context}"
         f"\n{userName} just said: \"{message}\"\n\n"
         f"Your compassionate response:"
     )
+
+async def require_ready(*phases: str):
+    """Wait for the subsystems a request needs; 503 if they can't serve it yet"""
+    try:
+        await startup_phases.wait(*phases)
+    except NotReady as e:
+        logger.warning(f"⏳ Request refused: {e}")
+        raise HTTPException(
+            status_code=503,
+            detail="Service is starting up. Please try again shortly.",
+            headers={"Retry-After": str(math.ceil(e.retry_after_s))}
+        )
+
+async def with_generation_timeout(awaitable):
+    """Await a Gemini call, turning a timeout on every model into a 504"""
+    try:
+        return await awaitable
+    except asyncio.TimeoutError:
+        logger.error(f"⏱️ Generation timed out after {GENERATION_TIMEOUT_S}s")
+        raise HTTPException(status_code=504, detail="AI service took too long to respond. Please try again.")
+
+@asynccontextmanager
+async def model_quota(prompt: str):
+    """Hold a governor slot for one generation, or fail fast with a 503"""
+    try:
+        with stage_seconds.labels("quota_wait").time():
+            await quota_governor.acquire(estimate_tokens(prompt) + ESTIMATED_OUTPUT_TOKENS)
+    except QuotaExceeded as e:
+        raise HTTPException(
+            status_code=503,
+            detail="AI service is at capacity. Please try again shortly.",
+            headers={"Retry-After": str(math.ceil(e.retry_after_s))}
+        )
+    try:
+        yield
+    finally:
+        quota_governor.release()
+
+async def governed_call(awaitable):
+    """Await a model call, telling the governor when upstream rate limits us anyway"""
+    try:
+        return await with_generation_timeout(awaitable)
+    except Exception as e:
+        if retry_handler.is_rate_limit(e):
+            quota_governor.on_rate_limited()
+        raise
+
+async def generate_ai_response(message: str, userName: str, pending: Sequence[Message] = ()) -> Tuple[str, str]:
+    """Generate AI response without blocking the event loop; returns (text, model used)"""
+    prompt = await build_prompt(message, userName, pending)
+    
+    # The router fails over between models; backoff only kicks in once all are rate limited
+    async with model_quota(prompt):
+        with stage_seconds.labels("generate").time():
+            return await retry_handler.execute_with_retry(
+                lambda: governed_call(model_router.generate(prompt))
+            )
+
+async def stream_ai_response(message: str, userName: str):
+    """Yield (model used, text chunk) pairs as the response is generated"""
+    prompt = await build_prompt(message, userName)
     
-    def _generate():
-        response = model.generate_content(prompt)
-        return response.text.strip()
+    async def _start():
+        chunks = model_router.stream(prompt)
+        try:
+            return chunks, await governed_call(chunks.__anext__())
+        except StopAsyncIteration:
+            return chunks, None
     
-    return retry_handler.execute_with_retry(_generate)
+    async with model_quota(prompt):
+        # Retries only cover getting the first chunk; once text has been sent it can't be replayed
+        chunks, first = await retry_handler.execute_with_retry(_start)
+        if first is None:
+            return
+        yield first
+        while True:
+            try:
+                chunk = await with_generation_timeout(chunks.__anext__())
+            except StopAsyncIteration:
+                break
+            yield chunk
+
+def history_etag(version: int) -> str:
+    return f'"{version}"'
+
+def not_modified(request: Request, etag: str) -> Optional[Response]:
+    """304 response if the client's If-None-Match already has this version"""
+    header = request.headers.get("if-none-match")
+    if not header:
+        return None
+    tags = [tag.strip().removeprefix("W/") for tag in header.split(",")]
+    if etag in tags or "*" in tags:
+        return Response(status_code=304, headers={"ETag": etag, "Cache-Control": "no-cache"})
+    return None
+
+def sse_event(data: dict, event: Optional[str] = None) -> str:
+    """Format a server-sent event"""
+    prefix = f"event: {event}\n" if event else ""
+    return f"{prefix}data: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+async def cancel_on_disconnect(request: Request, coro):
+    """Await coro, cancelling it if the client disconnects first"""
+    task = asyncio.ensure_future(coro)
+    try:
+        while True:
+            done, _ = await asyncio.wait({task}, timeout=DISCONNECT_POLL_INTERVAL_S)
+            if done:
+                return task.result()
+            if await request.is_disconnected():
+                logger.info("🔌 Client disconnected, cancelling generation")
+                raise HTTPException(status_code=499, detail="Client closed request")
+    finally:
+        if not task.done():
+            task.cancel()
 
 # --- API Endpoints ---
 @app.get("/", tags=["Health"])
@@ -369,7 +770,7 @@ def read_root():
         "status": "healthy",
         "version": "1.0.0",
         "model": selected_model_name,
-        "active_users": len(conversation_history),
+        "active_users": conversation_store.user_count(),
         "max_users": MAX_USERS
     }
 
@@ -377,46 +778,94 @@ def read_root():
 def health_check():
     """Detailed health check"""
     return {
-        "status": "ok",
-        "model_loaded": selected_model_name is not None,
+        "status": "ok" if startup_phases.ready else "starting",
+        "model_loaded": model_router is not None,
         "model_name": selected_model_name,
-        "conversations_active": len(conversation_history),
+        "conversations_active": conversation_store.user_count(),
+        "startup": startup_phases.stats(),
         "timestamp": datetime.now().isoformat()
     }
 
+@app.get("/health/live", tags=["Health"])
+def liveness_probe():
+    """Liveness: the process is up and serving (restart it if this fails)"""
+    return {"status": "alive"}
+
+@app.get("/health/ready", tags=["Health"])
+def readiness_probe():
+    """Readiness: every subsystem is warm (send traffic only when this is 200)"""
+    stats = startup_phases.stats()
+    return JSONResponse(stats, status_code=200 if stats["ready"] else 503)
+
+async def persist_crisis_turn(userName: str, message: str, received_at: float):
+    """Store a crisis turn after the reply has gone out, in the user's turn order"""
+    try:
+        # The reply may go out before history has loaded; the write has to wait for it
+        if not await startup_phases.settled("storage"):
+            raise RuntimeError("storage failed to start")
+        async with chat_turns.hold(userName):
+            with stage_seconds.labels("persistence").time():
+                await conversation_store.append(userName, Message(Role.USER, message, received_at))
+                await conversation_store.append(userName, Message(Role.ASSISTANT, CRISIS_RESPONSE, time.time()))
+        with stage_seconds.labels("persistence").time():
+            await conversation_store.sync()
+    except Exception as e:
+        logger.error(f"❌ Failed to persist crisis turn for {userName}: {e}", exc_info=True)
+
+def crisis_fast_lane(userName: str, message: str):
+    """Answer a crisis message immediately and persist the turn in the background"""
+    logger.warning(f"🚨 CRISIS DETECTED for user: {userName}")
+    crisis_total.inc()
+    task = asyncio.create_task(persist_crisis_turn(userName, message, time.time()))
+    crisis_writes.add(task)
+    task.add_done_callback(crisis_writes.discard)
+
+async def run_chat_turn(chat_input: ChatInput) -> ChatResponse:
+    """Store the user's message and answer it; runs in the user's turn order"""
+    await store_message(chat_input.userName, 'user', chat_input.message)
+    
+    # Generate response
+    logger.info(f"🤖 Generating response for {chat_input.userName}...")
+    ai_response, model_used = await generate_ai_response(chat_input.message, chat_input.userName)
+    
+    await store_message(chat_input.userName, 'assistant', ai_response, stage="persistence")
+    
+    logger.info(f"✅ Response sent to {chat_input.userName} ({len(ai_response)} chars, {model_used})")
+    
+    return ChatResponse(
+        response=ai_response,
+        timestamp=datetime.now().isoformat(),
+        is_crisis=False,
+        model=model_used
+    )
+
 @app.post("/chat", response_model=ChatResponse, tags=["Chat"])
-async def chat_with_ai(chat_input: ChatInput):
+async def chat_with_ai(chat_input: ChatInput, request: Request):
     """Main chat endpoint"""
+    started = time.perf_counter()
+    observe_validation(request, started)
     try:
         logger.info(f"📨 Message from {chat_input.userName}: {chat_input.message[:50]}...")
         
-        await store_message(chat_input.userName, 'user', chat_input.message)
-        
-        # Crisis detection
-        is_crisis = detect_crisis(chat_input.message)
-        if is_crisis:
-            logger.warning(f"🚨 CRISIS DETECTED for user: {chat_input.userName}")
-            await store_message(chat_input.userName, 'assistant', CRISIS_RESPONSE)
-            return ChatResponse(
+        # Crisis detection comes first: no queue, quota or storage before replying
+        if detect_crisis(chat_input.message):
+            crisis_fast_lane(chat_input.userName, chat_input.message)
+            response = ChatResponse(
                 response=CRISIS_RESPONSE,
                 timestamp=datetime.now().isoformat(),
                 is_crisis=True,
                 model=selected_model_name
             )
+            latency = time.perf_counter() - started
+            crisis_slo.observe(latency)
+            crisis_reply_seconds.observe(latency)
+            return response
         
-        # Generate response
-        logger.info(f"🤖 Generating response for {chat_input.userName}...")
-        ai_response = generate_ai_response(chat_input.message, chat_input.userName)
-        
-        await store_message(chat_input.userName, 'assistant', ai_response)
-        
-        logger.info(f"✅ Response sent to {chat_input.userName} ({len(ai_response)} chars)")
-        
-        return ChatResponse(
-            response=ai_response,
-            timestamp=datetime.now().isoformat(),
-            is_crisis=False,
-            model=selected_model_name
+        ingest_mood(chat_input)
+        await require_ready("storage", "models")
+        return await cancel_on_disconnect(
+            request,
+            chat_turns.run(chat_input.userName, chat_input.message, lambda: run_chat_turn(chat_input))
         )
         
     except HTTPException as http_ex:
@@ -442,69 +891,398 @@ async def chat_with_ai(chat_input: ChatInput):
             model=selected_model_name
         )
 
+async def stream_chat_turn(chat_input: ChatInput):
+    """SSE events for one streamed turn"""
+    await store_message(chat_input.userName, 'user', chat_input.message)
+    
+    parts: List[str] = []
+    model_used = selected_model_name
+    try:
+        logger.info(f"🤖 Streaming response for {chat_input.userName}...")
+        async for model_used, text in stream_ai_response(chat_input.message, chat_input.userName):
+            parts.append(text)
+            yield sse_event({"delta": text})
+        
+        ai_response = "".join(parts).strip()
+        logger.info(f"✅ Response streamed to {chat_input.userName} ({len(ai_response)} chars)")
+        yield sse_event({
+            "response": ai_response,
+            "timestamp": datetime.now().isoformat(),
+            "is_crisis": False,
+            "model": model_used
+        }, event="done")
+    except HTTPException as http_ex:
+        logger.error(f"❌ HTTP Error: {http_ex.detail}")
+        error = {"status_code": http_ex.status_code, "detail": http_ex.detail}
+        if http_ex.headers and "Retry-After" in http_ex.headers:
+            error["retry_after"] = int(http_ex.headers["Retry-After"])
+        yield sse_event(error, event="error")
+    except Exception as e:
+        logger.error(f"💥 Unexpected streaming error: {str(e)[:200]}", exc_info=True)
+        yield sse_event({
+            "status_code": 500,
+            "detail": f"I'm sorry {chat_input.userName}, I'm having technical difficulties. Please try again in a moment."
+        }, event="error")
+    finally:
+        # Persist whatever was generated, including streams the client aborted.
+        # Starlette cancels this generator on disconnect and keeps cancelling
+        # every await, so the write is shielded to run to completion.
+        partial = "".join(parts).strip()
+        if partial:
+            with anyio.CancelScope(shield=True):
+                await store_message(chat_input.userName, 'assistant', partial, stage="persistence")
+
+@app.post("/chat/stream", tags=["Chat"])
+async def chat_with_ai_stream(chat_input: ChatInput, request: Request):
+    """Streaming chat endpoint (server-sent events)"""
+    started = time.perf_counter()
+    observe_validation(request, started)
+    logger.info(f"📨 Streaming message from {chat_input.userName}: {chat_input.message[:50]}...")
+    
+    # Crisis detection runs before any queueing or generation
+    if detect_crisis(chat_input.message):
+        crisis_fast_lane(chat_input.userName, chat_input.message)
+        events = sse_event({"delta": CRISIS_RESPONSE}) + sse_event({
+            "response": CRISIS_RESPONSE,
+            "timestamp": datetime.now().isoformat(),
+            "is_crisis": True,
+            "model": selected_model_name
+        }, event="done")
+        latency = time.perf_counter() - started
+        crisis_slo.observe(latency)
+        crisis_reply_seconds.observe(latency)
+        return StreamingResponse(
+            iter([events]),
+            media_type="text/event-stream",
+            headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+        )
+    
+    ingest_mood(chat_input)
+    await require_ready("storage", "models")
+    
+    async def event_stream():
+        # Hold the user's turn for the whole stream so turns don't interleave
+        async with chat_turns.hold(chat_input.userName):
+            async for event in stream_chat_turn(chat_input):
+                yield event
+    
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+def batch_error(userName: Optional[str], error: Exception) -> ChatBatchResult:
+    """Per-item result for a batch item that failed, mirroring what /chat would have returned"""
+    if isinstance(error, HTTPException):
+        retry_after = error.headers.get("Retry-After") if error.headers else None
+        return ChatBatchResult(userName=userName, status_code=error.status_code, error=str(error.detail),
+                               retry_after=int(retry_after) if retry_after else None)
+    if isinstance(error, ValueError):
+        return ChatBatchResult(userName=userName, status_code=422, error=str(error)[:500])
+    logger.error(f"💥 Batch item for {userName} failed: {str(error)[:200]}", exc_info=error)
+    return ChatBatchResult(userName=userName, status_code=500,
+                           error="Technical difficulties generating this reply. Please try again.")
+
+async def run_batch_user(userName: str, items: List[Tuple[int, ChatInput, bool]],
+                         results: List[Optional[ChatBatchResult]], pending: List[Message],
+                         generations: asyncio.Semaphore):
+    """One user's batch items in order; stored turns are collected in ``pending``, not written"""
+    for index, chat_input, is_crisis in items:
+        user_message = Message(Role.USER, chat_input.message, time.time())
+        if is_crisis:
+            reply, model_used = CRISIS_RESPONSE, selected_model_name
+        else:
+            try:
+                async with generations:
+                    reply, model_used = await generate_ai_response(
+                        chat_input.message, userName, [*pending, user_message])
+            except Exception as e:
+                # Nothing is stored for a failed item, so the caller can just resend it
+                results[index] = batch_error(userName, e)
+                continue
+        pending.append(user_message)
+        pending.append(Message(Role.ASSISTANT, reply, time.time()))
+        results[index] = ChatBatchResult(userName=userName, status_code=200, result=ChatResponse(
+            response=reply,
+            timestamp=datetime.now().isoformat(),
+            is_crisis=is_crisis,
+            model=model_used
+        ))
+
+async def run_chat_batch(inputs: List[Tuple[int, ChatInput, bool]], results: List[Optional[ChatBatchResult]]) -> int:
+    """Answer valid batch items per user in order, then store every turn in one group commit"""
+    by_user: Dict[str, List[Tuple[int, ChatInput, bool]]] = {}
+    for entry in inputs:
+        by_user.setdefault(entry[1].userName, []).append(entry)
+    pending: Dict[str, List[Message]] = {user: [] for user in by_user}
+    generations = asyncio.Semaphore(CHAT_BATCH_CONCURRENCY)
+    
+    async with AsyncExitStack() as turns:
+        # Sorted, so two batches sharing users can't each hold a lock the other waits for
+        for user in sorted(by_user):
+            await turns.enter_async_context(chat_turns.hold(user))
+        await asyncio.gather(*(
+            run_batch_user(user, items, results, pending[user], generations)
+            for user, items in by_user.items()
+        ))
+        
+        entries = [(user, message) for user, messages in pending.items() for message in messages]
+        try:
+            with stage_seconds.labels("persistence").time():
+                await conversation_store.append_many(entries)
+        except Exception as e:
+            logger.error(f"❌ Failed to store batch of {len(entries)} messages: {e}", exc_info=True)
+            raise HTTPException(status_code=500, detail="Could not save the conversation. Please try again.")
+    return len(entries)
+
+@app.post("/chat/batch", response_model=ChatBatchResponse, tags=["Chat"])
+async def chat_batch(request: Request, items: List[Dict] = Body(..., description="ChatInput objects")):
+    """Answer several chat messages in one request; results come back in input order"""
+    started = time.perf_counter()
+    if len(items) > CHAT_BATCH_MAX_ITEMS:
+        raise HTTPException(status_code=413, detail=f"At most {CHAT_BATCH_MAX_ITEMS} messages per batch")
+    
+    results: List[Optional[ChatBatchResult]] = [None] * len(items)
+    valid: List[Tuple[int, ChatInput]] = []
+    for index, item in enumerate(items):
+        try:
+            valid.append((index, ChatInput(**item)))
+        except (TypeError, ValueError) as e:
+            user = item.get("userName") if isinstance(item, dict) else None
+            results[index] = batch_error(user if isinstance(user, str) else None, ValueError(str(e)))
+    observe_validation(request, time.perf_counter())
+    logger.info(f"📨 Batch of {len(items)} messages from {len({c.userName for _, c in valid})} users")
+    
+    # One pass of the crisis matcher over every message in the batch
+    with stage_seconds.labels("detect_crisis").time():
+        matches = crisis_matcher.search_many([chat_input.message for _, chat_input in valid])
+    inputs = [(index, chat_input, match is not None) for (index, chat_input), match in zip(valid, matches)]
+    crises = [chat_input for _, chat_input, is_crisis in inputs if is_crisis]
+    for _, chat_input, is_crisis in inputs:
+        if not is_crisis:
+            ingest_mood(chat_input)
+    
+    try:
+        await require_ready("storage", *(("models",) if len(crises) < len(inputs) else ()))
+    except HTTPException as not_ready:
+        if not crises:
+            raise
+        # Crisis replies never wait on warm-up: answer them through the fast lane
+        for index, chat_input, is_crisis in inputs:
+            if is_crisis:
+                crisis_fast_lane(chat_input.userName, chat_input.message)
+                results[index] = ChatBatchResult(userName=chat_input.userName, status_code=200, result=ChatResponse(
+                    response=CRISIS_RESPONSE,
+                    timestamp=datetime.now().isoformat(),
+                    is_crisis=True,
+                    model=selected_model_name
+                ))
+            else:
+                results[index] = batch_error(chat_input.userName, not_ready)
+        return ChatBatchResponse(results=results, crisis_count=len(crises), stored_messages=0)
+    
+    for chat_input in crises:
+        logger.warning(f"🚨 CRISIS DETECTED for user: {chat_input.userName}")
+        crisis_total.inc()
+    stored = await cancel_on_disconnect(request, run_chat_batch(inputs, results))
+    logger.info(f"✅ Batch answered: {sum(r.status_code == 200 for r in results)}/{len(items)} ok, "
+                f"{stored} messages stored in {time.perf_counter() - started:.2f}s")
+    return ChatBatchResponse(results=results, crisis_count=len(crises), stored_messages=stored)
+
 @app.get("/history/{userName}", response_model=HistoryResponse, tags=["History"])
-async def get_conversation_history(userName: str):
-    """Get conversation history"""
-    if userName not in conversation_history:
-        return HistoryResponse(userName=userName, messages=[], total_messages=0)
+async def get_conversation_history(
+    userName: str,
+    request: Request,
+    before: Optional[float] = Query(None, description="Only messages older than this cursor (next_before of the previous page)"),
+    before_seen: int = Query(0, ge=0, description="Messages at exactly the cursor already returned (next_before_seen of the previous page)"),
+    limit: Optional[int] = Query(None, ge=1, description="Page size: the newest messages before the cursor (all if omitted)"),
+):
+    """Get conversation history, optionally one page at a time"""
+    await require_ready("storage")
+    # Version before messages: a write in between only costs the client one extra fetch
+    etag = history_etag(await conversation_store.get_version(userName))
+    cached = not_modified(request, etag)
+    if cached is not None:
+        return cached
     
-    messages = [
-        HistoryMessage(role=msg['role'], content=msg['content'], timestamp=msg['timestamp'])
-        for msg in conversation_history[userName]
-    ]
+    stored = await conversation_store.get_messages(userName)
+    page = stored.to_list()
+    if before is not None:
+        # Messages can share a timestamp (batch and crisis turns), so the cursor
+        # also counts the newest ones at exactly `before` that were already sent
+        ties = sum(1 for msg in page if msg.timestamp == before) - before_seen
+        older = []
+        for msg in page:
+            if msg.timestamp == before:
+                if ties <= 0:
+                    continue
+                ties -= 1
+            elif msg.timestamp > before:
+                continue
+            older.append(msg)
+        page = older
+    next_before = None
+    next_before_seen = 0
+    if limit is not None and len(page) > limit:
+        page = page[-limit:]
+        next_before = page[0].timestamp
+        next_before_seen = sum(1 for msg in page if msg.timestamp == next_before)
+        if next_before == before:
+            next_before_seen += before_seen
     
-    return HistoryResponse(userName=userName, messages=messages, total_messages=len(messages))
+    # Plain dicts in the HistoryResponse shape; no per-message model objects
+    return JSONResponse({
+        "userName": userName,
+        "messages": [msg.to_dict() for msg in page],
+        "total_messages": len(stored),
+        "next_before": next_before,
+        "next_before_seen": next_before_seen,
+    }, headers={"ETag": etag, "Cache-Control": "no-cache"})
+
+@app.get("/mood/{userName}/trend", tags=["Mood"])
+async def get_mood_trend(
+    userName: str,
+    request: Request,
+    window: int = Query(5, ge=1, le=100, description="Samples per moving-average point"),
+    days: int = Query(MOOD_TREND_DAYS, ge=1, le=366, description="Days covered by the daily buckets and slope"),
+    utc_offset_minutes: int = Query(0, ge=-840, le=840, description="Client's offset from UTC, for day boundaries"),
+    points: int = Query(100, ge=0, le=1000, description="Most recent moving-average points to return"),
+):
+    """Mood trend rollups: recent average, moving average, daily buckets and slope"""
+    if mood_store is None:
+        raise HTTPException(status_code=501, detail="Mood tracking is not enabled on this server")
+    await require_ready("storage")
+    now = time.time()
+    # Daily buckets and the slope depend on today's date as well as the samples
+    today = int((now + utc_offset_minutes * 60) // 86400)
+    etag = f'"{mood_store.version(userName)}.{today}"'
+    cached = not_modified(request, etag)
+    if cached is not None:
+        return cached
+    trend = mood_store.trend(userName, window, days, utc_offset_minutes * 60, points, now)
+    return JSONResponse(
+        {"userName": userName, **trend},
+        headers={"ETag": etag, "Cache-Control": "no-cache"}
+    )
 
 @app.delete("/history/{userName}", tags=["History"])
 async def clear_conversation_history(userName: str):
     """Clear history"""
-    if userName in conversation_history:
-        msg_count = len(conversation_history[userName])
-        del conversation_history[userName]
-        await save_chat_history()
+    await require_ready("storage")
+    msg_count = await conversation_store.clear(userName)
+    if mood_store:
+        mood_store.clear(userName)
+    if msg_count:
         logger.info(f"🗑️ Cleared {msg_count} messages for {userName}")
         return {"message": f"Conversation history cleared for {userName}", "messages_cleared": msg_count}
     
     return {"message": f"No conversation history found for {userName}", "messages_cleared": 0}
 
+def require_export_token(request: Request):
+    """The bulk export only exists with EXPORT_TOKEN set, and only for its bearer"""
+    if not EXPORT_TOKEN:
+        raise HTTPException(status_code=404, detail="Not Found")
+    scheme, _, token = request.headers.get("authorization", "").partition(" ")
+    if scheme.lower() != "bearer" or not hmac.compare_digest(token.strip().encode(), EXPORT_TOKEN.encode()):
+        logger.warning(f"🔒 Bulk export refused for {request.client.host if request.client else 'unknown client'}")
+        raise HTTPException(status_code=403, detail="A valid export token is required")
+
+@app.get("/export", tags=["Admin"])
+async def export_all_users(request: Request):
+    """Stream every user's history as NDJSON, one user per line (needs EXPORT_TOKEN)"""
+    require_export_token(request)
+    await require_ready("storage")
+    export_date = datetime.now().isoformat()
+    
+    async def lines():
+        exported = 0
+        async for userName, messages in conversation_store.iter_histories(EXPORT_BATCH_USERS):
+            exported += 1
+            yield json.dumps({
+                "userName": userName,
+                "export_date": export_date,
+                "message_count": len(messages),
+                "messages": messages.to_dicts()
+            }, ensure_ascii=False) + "\n"
+        logger.info(f"📦 Exported {exported} users")
+    
+    return StreamingResponse(
+        lines(),
+        media_type="application/x-ndjson",
+        headers={"Content-Disposition": f'attachment; filename="chat_export_{export_date[:10]}.ndjson"'}
+    )
+
 @app.get("/export/{userName}", tags=["Admin"])
-async def export_user_data(userName: str):
+async def export_user_data(userName: str, request: Request):
     """Export user conversation data"""
-    if userName not in conversation_history:
+    await require_ready("storage")
+    etag = history_etag(await conversation_store.get_version(userName))
+    # Existence first: /history hands out ETags for empty histories too, and a
+    # user with no data must get a 404, never a 304
+    messages = await conversation_store.get_messages(userName)
+    if not messages:
         raise HTTPException(status_code=404, detail=f"No data for user {userName}")
+    cached = not_modified(request, etag)
+    if cached is not None:
+        return cached
     
-    return {
+    return JSONResponse({
         "userName": userName,
         "export_date": datetime.now().isoformat(),
-        "message_count": len(conversation_history[userName]),
-        "messages": conversation_history[userName]
-    }
+        "message_count": len(messages),
+        "messages": messages.to_dicts()
+    }, headers={"ETag": etag, "Cache-Control": "no-cache"})
 
 @app.get("/stats", tags=["Admin"])
 async def get_stats():
     """Get API statistics"""
-    total_messages = sum(len(msgs) for msgs in conversation_history.values())
+    if startup_phases.is_ready("storage"):
+        await conversation_store.sync_counts()
     return {
-        "active_conversations": len(conversation_history),
-        "total_messages": total_messages,
+        "active_conversations": conversation_store.user_count(),
+        "total_messages": conversation_store.message_count(),
+        "storage_backend": STORAGE_BACKEND,
+        "shared_state": SHARED_STATE,
+        "cache": conversation_store.cache.stats(),
+        "retention": retention_worker.stats(),
+        "mood": mood_store.stats() if mood_store else None,
+        "turns": chat_turns.stats(),
+        "summaries": summary_refresher.stats() if summary_refresher else None,
+        "crisis": {**crisis_slo.stats(), "pending_writes": len(crisis_writes)},
         "max_users": MAX_USERS,
         "max_messages_per_user": MAX_MESSAGES_PER_USER,
         "model": selected_model_name,
+        "models": model_router.stats() if model_router else None,
+        "startup": startup_phases.stats(),
+        "quota": {**quota_governor.stats(), "workers_sharing_quota": QUOTA_WORKERS},
         "timestamp": datetime.now().isoformat()
     }
 
+@app.get("/metrics", tags=["Admin"], response_class=PlainTextResponse)
+async def get_metrics():
+    """Prometheus metrics"""
+    if startup_phases.is_ready("storage"):
+        await conversation_store.sync_counts()
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
 # --- Startup & Shutdown Events ---
 @app.on_event("startup")
 async def startup_event():
-    """Load history and validate on startup"""
-    await load_chat_history()
-    await check_file_size()
-    await cleanup_old_messages()
+    """Start warming up storage and models; liveness is served straight away"""
+    startup_phases.start({"storage": warm_storage, "models": init_models})
     logger.info("="*60)
     logger.info("🚀 Mental Wellness API Starting")
-    logger.info(f"Model: {selected_model_name}")
+    logger.info(f"Imported in {startup_phases.import_s:.2f}s; warming up storage and models in the background")
     logger.info(f"Max Users: {MAX_USERS}")
-    logger.info(f"Loaded {len(conversation_history)} active users from history")
+    if SHARED_STATE:
+        logger.warning("⚠️ SHARED_STATE: turn ordering and coalescing are per worker; "
+                       "a user's turns may interleave across workers")
+        logger.info(f"🚦 Model quota split across {QUOTA_WORKERS} worker(s): "
+                    f"{GEMINI_RPM / QUOTA_WORKERS:g} RPM, {GEMINI_TPM / QUOTA_WORKERS:g} TPM in this one")
+        if QUOTA_WORKERS == 1:
+            logger.warning("⚠️ QUOTA_WORKERS is 1: every worker admits the full GEMINI_RPM/GEMINI_TPM; "
+                           "set QUOTA_WORKERS (or WEB_CONCURRENCY) to the worker count")
     logger.info("="*60)
 
 @app.on_event("shutdown")
@@ -512,8 +1290,26 @@ async def shutdown_event():
     """Graceful shutdown with final save"""
     logger.info("="*60)
     logger.info("🛑 Mental Wellness API Shutting Down")
-    await save_chat_history()
-    logger.info(f"✅ Saved {len(conversation_history)} conversations")
+    storage_ready = startup_phases.is_ready("storage")
+    await startup_phases.stop()
+    await retention_worker.stop()
+    if mood_store:
+        await mood_store.stop()
+    if crisis_writes:
+        await asyncio.gather(*crisis_writes, return_exceptions=True)
+    if summary_refresher:
+        await summary_refresher.stop()
+    if storage_ready:
+        # Never flush a store that didn't finish loading over the history on disk
+        await conversation_store.close()
+        logger.info(f"✅ Saved {conversation_store.user_count()} conversations")
+        if mood_store:
+            try:
+                await mood_store.save()
+            except Exception as e:
+                logger.error(f"❌ Failed to save mood history: {e}")
     logger.info("="*60)
 
+startup_phases.imported()
+
 # Run with: uvicorn main:app --reload
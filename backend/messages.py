@@ -0,0 +1,133 @@
+from datetime import datetime
+from enum import IntEnum
+from typing import Dict, Iterable, Iterator, List, Optional
+
+
+class Role(IntEnum):
+    USER = 0
+    ASSISTANT = 1
+
+    @property
+    def label(self) -> str:
+        return _ROLE_LABELS[self]
+
+    @classmethod
+    def parse(cls, label: str) -> "Role":
+        try:
+            return _ROLES_BY_LABEL[label]
+        except KeyError:
+            raise ValueError(f"Unknown message role '{label}'")
+
+
+_ROLE_LABELS = {Role.USER: "user", Role.ASSISTANT: "assistant"}
+_ROLES_BY_LABEL = {label: role for role, label in _ROLE_LABELS.items()}
+
+
+class Message:
+    """One chat message. Immutable by convention, so it can be shared freely."""
+
+    __slots__ = ("role", "content", "timestamp")
+
+    def __init__(self, role: Role, content: str, timestamp: float):
+        self.role = role
+        self.content = content
+        self.timestamp = timestamp  # epoch seconds
+
+    @property
+    def iso_timestamp(self) -> str:
+        return datetime.fromtimestamp(self.timestamp).isoformat()
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, str]) -> "Message":
+        """Build from the API/on-disk shape: {'role', 'content', 'timestamp' (ISO)}."""
+        return cls(Role.parse(data['role']), data['content'], datetime.fromisoformat(data['timestamp']).timestamp())
+
+    def to_dict(self) -> Dict[str, str]:
+        return {'role': self.role.label, 'content': self.content, 'timestamp': self.iso_timestamp}
+
+    def __repr__(self) -> str:
+        return f"Message({self.role.label}, {self.content[:30]!r}, {self.iso_timestamp})"
+
+
+class Summary:
+    """Rolling summary of a user's older turns, up to and including ``covered_until``."""
+
+    __slots__ = ("text", "covered_until", "message_count")
+
+    def __init__(self, text: str, covered_until: float, message_count: int):
+        self.text = text
+        self.covered_until = covered_until  # epoch seconds of the last summarized message
+        self.message_count = message_count
+
+    @classmethod
+    def from_dict(cls, data: Dict) -> "Summary":
+        return cls(data['text'], datetime.fromisoformat(data['covered_until']).timestamp(), data['message_count'])
+
+    def to_dict(self) -> Dict:
+        return {
+            'text': self.text,
+            'covered_until': datetime.fromtimestamp(self.covered_until).isoformat(),
+            'message_count': self.message_count,
+        }
+
+
+class MessageRing:
+    """Fixed-capacity buffer of a user's most recent messages.
+
+    Slots are allocated once; appending past capacity overwrites the oldest
+    message in O(1) instead of rebuilding the list. ``version`` is set by the
+    owning store to tell stale copies apart.
+    """
+
+    __slots__ = ("_slots", "_start", "_len", "version")
+
+    def __init__(self, capacity: int, messages: Iterable[Message] = (), version: int = 0):
+        self._slots: List[Optional[Message]] = [None] * capacity
+        self._start = 0
+        self._len = 0
+        self.version = version
+        for message in messages:
+            self.append(message)
+
+    @property
+    def capacity(self) -> int:
+        return len(self._slots)
+
+    def __len__(self) -> int:
+        return self._len
+
+    def __bool__(self) -> bool:
+        return self._len > 0
+
+    def append(self, message: Message) -> Optional[Message]:
+        """Append a message, returning the one it displaced when full."""
+        capacity = len(self._slots)
+        if self._len < capacity:
+            self._slots[(self._start + self._len) % capacity] = message
+            self._len += 1
+            return None
+        dropped = self._slots[self._start]
+        self._slots[self._start] = message
+        self._start = (self._start + 1) % capacity
+        return dropped
+
+    def __iter__(self) -> Iterator[Message]:
+        capacity = len(self._slots)
+        for i in range(self._len):
+            yield self._slots[(self._start + i) % capacity]
+
+    def recent(self, count: int) -> List[Message]:
+        """The last ``count`` messages, oldest first."""
+        capacity = len(self._slots)
+        count = min(count, self._len)
+        first = self._start + self._len - count
+        return [self._slots[(first + i) % capacity] for i in range(count)]
+
+    def oldest(self) -> Optional[Message]:
+        return self._slots[self._start] if self._len else None
+
+    def to_list(self) -> List[Message]:
+        return list(self)
+
+    def to_dicts(self) -> List[Dict[str, str]]:
+        return [message.to_dict() for message in self]
@@ -0,0 +1,68 @@
+"""Model latency profiles: written by the probe in list_models.py, read at startup.
+
+A profile ranks candidate models by measured latency and error rate so the
+router's preference order comes from data rather than a hand-kept list.
+"""
+import json
+import time
+import logging
+from typing import Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+PROFILE_VERSION = 1
+
+
+def rank_models(results: List[Dict], max_error_rate: float) -> List[Dict]:
+    """Order probe results: healthy models first, fastest median total latency first.
+
+    A model is healthy if at least one call succeeded and its error rate is
+    at most ``max_error_rate``. Unhealthy models stay in the ranking, last,
+    so the router can still fail over to them.
+    """
+    for result in results:
+        result["healthy"] = result["successes"] > 0 and result["error_rate"] <= max_error_rate
+    ranked = sorted(results, key=lambda r: (
+        not r["healthy"],
+        r["total_p50_s"] if r["total_p50_s"] is not None else float("inf"),
+        r["error_rate"],
+    ))
+    for rank, result in enumerate(ranked, 1):
+        result["rank"] = rank
+    return ranked
+
+
+def load_profile(path: str, max_age_s: float = 0) -> Optional[Dict]:
+    """Read a profile file; None if it is missing, unreadable or older than ``max_age_s`` (0: any age)."""
+    try:
+        with open(path, mode="r", encoding="utf-8") as f:
+            profile = json.load(f)
+    except FileNotFoundError:
+        return None
+    except (OSError, json.JSONDecodeError) as e:
+        logger.warning(f"⚠️ Ignoring unreadable model profile {path}: {e}")
+        return None
+    if profile.get("version") != PROFILE_VERSION or not isinstance(profile.get("models"), list):
+        logger.warning(f"⚠️ Ignoring model profile {path}: unsupported format")
+        return None
+    age_s = time.time() - profile.get("generated_ts", 0)
+    if max_age_s and age_s > max_age_s:
+        logger.warning(f"⚠️ Ignoring model profile {path}: {age_s / 3600:.1f}h old (limit {max_age_s / 3600:g}h)")
+        return None
+    return profile
+
+
+def order_models(options: List[str], profile: Optional[Dict]) -> List[str]:
+    """``options`` reordered by a profile: healthy models by rank, then unmeasured ones, then unhealthy ones.
+
+    Models the profile doesn't cover keep their configured order. Only
+    names in ``options`` are returned: a profile can reorder the configured
+    models but not add new ones.
+    """
+    if not profile:
+        return list(options)
+    ranked = sorted(profile["models"], key=lambda e: e.get("rank", float("inf")))
+    healthy = [e["name"] for e in ranked if e.get("healthy") and e["name"] in options]
+    unhealthy = [e["name"] for e in ranked if not e.get("healthy") and e["name"] in options]
+    unmeasured = [name for name in options if name not in healthy and name not in unhealthy]
+    return healthy + unmeasured + unhealthy
@@ -0,0 +1,438 @@
+import os
+import time
+import asyncio
+import logging
+from datetime import datetime, timezone
+from typing import Dict, Iterable, Optional, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Check-ins use the frontend's 1-5 mood scale
+MIN_VALUE = 1.0
+MAX_VALUE = 5.0
+SOURCES = ("other", "button", "voice", "video")
+_SOURCE_CODES = {name: code for code, name in enumerate(SOURCES)}
+# Samples stamped further than this in the future are treated as bad clocks
+MAX_CLOCK_SKEW_S = 300.0
+# Same window and thresholds as calculateMoodTrend in the frontend
+RECENT_SAMPLES = 5
+DAY_S = 86400.0
+# Rollups are kept for a few parameter sets per user (dashboard, pet room, prompt)
+ROLLUPS_PER_USER = 4
+
+Columns = Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]
+
+
+def trend_label(average: Optional[float]) -> str:
+    """Mood trend bucket for an average value, as the frontend names them."""
+    if average is None:
+        return "neutral"
+    if average >= 4.5:
+        return "very-positive"
+    if average >= 3.5:
+        return "positive"
+    if average <= 2.5:
+        return "negative"
+    return "neutral"
+
+
+def _parse_timestamp(value) -> Optional[float]:
+    if not isinstance(value, str):
+        return None
+    try:
+        return datetime.fromisoformat(value).timestamp()
+    except ValueError:
+        return None
+
+
+def _iso(ts: float) -> str:
+    return datetime.fromtimestamp(ts, tz=timezone.utc).isoformat(timespec="milliseconds").replace("+00:00", "Z")
+
+
+def parse_samples(entries: Iterable, now: Optional[float] = None) -> Tuple[Columns, int]:
+    """Columns (timestamps, values, confidences, sources) of the valid moodHistory entries.
+
+    Entries need a 1-5 ``value`` and an ISO ``timestamp``; anything else is
+    skipped and counted in the second return value. A missing confidence is NaN.
+    """
+    limit = (now if now is not None else time.time()) + MAX_CLOCK_SKEW_S
+    timestamps, values, confidences, sources = [], [], [], []
+    rejected = 0
+    for entry in entries:
+        if not isinstance(entry, dict):
+            rejected += 1
+            continue
+        value = entry.get("value")
+        ts = _parse_timestamp(entry.get("timestamp"))
+        if (isinstance(value, bool) or not isinstance(value, (int, float)) or not MIN_VALUE <= value <= MAX_VALUE
+                or ts is None or ts > limit):
+            rejected += 1
+            continue
+        confidence = entry.get("confidence")
+        timestamps.append(ts)
+        values.append(value)
+        confidences.append(confidence if isinstance(confidence, (int, float)) and not isinstance(confidence, bool)
+                           else np.nan)
+        sources.append(_SOURCE_CODES.get(entry.get("source"), 0))
+    return (
+        np.array(timestamps, dtype=np.float64),
+        np.array(values, dtype=np.float32),
+        np.array(confidences, dtype=np.float32),
+        np.array(sources, dtype=np.int8),
+    ), rejected
+
+
+class MoodSeries:
+    """One user's mood samples as parallel arrays sorted by time.
+
+    The arrays grow by doubling, so adding the newest samples (the usual
+    case) is amortized O(1) per sample; past ``max_samples`` the oldest are
+    dropped. ``version`` is set by the owning store and keys the rollup cache.
+    """
+
+    __slots__ = ("timestamps", "values", "confidences", "sources", "size", "version", "_rollups")
+
+    def __init__(self, capacity: int = 16):
+        self.timestamps = np.empty(capacity, dtype=np.float64)
+        self.values = np.empty(capacity, dtype=np.float32)
+        self.confidences = np.empty(capacity, dtype=np.float32)
+        self.sources = np.empty(capacity, dtype=np.int8)
+        self.size = 0
+        self.version = 0
+        self._rollups: Dict[Tuple, Tuple[int, Dict]] = {}
+
+    def __len__(self) -> int:
+        return self.size
+
+    def columns(self) -> Columns:
+        n = self.size
+        return self.timestamps[:n], self.values[:n], self.confidences[:n], self.sources[:n]
+
+    def _reserve(self, size: int):
+        capacity = len(self.timestamps)
+        if size <= capacity:
+            return
+        while capacity < size:
+            capacity *= 2
+        for name in ("timestamps", "values", "confidences", "sources"):
+            old = getattr(self, name)
+            grown = np.empty(capacity, dtype=old.dtype)
+            grown[:self.size] = old[:self.size]
+            setattr(self, name, grown)
+
+    def merge(self, columns: Columns, max_samples: int) -> int:
+        """Add the samples not already stored (matched by timestamp); returns how many were added.
+
+        Clients resend their recent check-ins with every message, so most
+        calls add nothing or just the newest sample.
+        """
+        timestamps, first = np.unique(columns[0], return_index=True)
+        values, confidences, sources = (column[first] for column in columns[1:])
+        n = self.size
+        stored = self.timestamps[:n]
+        if n and len(timestamps):
+            pos = np.searchsorted(stored, timestamps)
+            new = (pos == n) | (stored[np.minimum(pos, n - 1)] != timestamps)
+            timestamps, values, confidences, sources = timestamps[new], values[new], confidences[new], sources[new]
+        added = len(timestamps)
+        if not added:
+            return 0
+
+        self._reserve(n + added)
+        end = n + added
+        self.timestamps[n:end] = timestamps
+        self.values[n:end] = values
+        self.confidences[n:end] = confidences
+        self.sources[n:end] = sources
+        if n and timestamps[0] < self.timestamps[n - 1]:
+            # A late sample landed before stored ones: re-sort (rare)
+            order = np.argsort(self.timestamps[:end], kind="stable")
+            for name in ("timestamps", "values", "confidences", "sources"):
+                column = getattr(self, name)
+                column[:end] = column[:end][order]
+        self.size = end
+
+        if self.size > max_samples:
+            drop = self.size - max_samples
+            for name in ("timestamps", "values", "confidences", "sources"):
+                column = getattr(self, name)
+                column[:max_samples] = column[drop:self.size]
+            self.size = max_samples
+        return added
+
+    def expire(self, cutoff_ts: float) -> int:
+        """Drop samples at or before the cutoff; returns how many were dropped."""
+        drop = int(np.searchsorted(self.timestamps[:self.size], cutoff_ts, side="right"))
+        if drop:
+            keep = self.size - drop
+            for name in ("timestamps", "values", "confidences", "sources"):
+                column = getattr(self, name)
+                column[:keep] = column[drop:self.size]
+            self.size = keep
+        return drop
+
+    def rollup(self, window: int, days: int, utc_offset_s: int, points: int, now: float) -> Dict:
+        """Trend figures for the dashboard, cached until the series or the day changes."""
+        today = int((now + utc_offset_s) // DAY_S)
+        key = (window, days, utc_offset_s, points, today)
+        cached = self._rollups.get(key)
+        if cached is not None and cached[0] == self.version:
+            return cached[1]
+        result = self._compute(window, days, utc_offset_s, points, today)
+        if key not in self._rollups and len(self._rollups) >= ROLLUPS_PER_USER:
+            self._rollups.pop(next(iter(self._rollups)))
+        self._rollups[key] = (self.version, result)
+        return result
+
+    def _compute(self, window: int, days: int, utc_offset_s: int, points: int, today: int) -> Dict:
+        timestamps, values, confidences, sources = self.columns()
+        n = self.size
+        values = values.astype(np.float64)
+        recent = float(values[-RECENT_SAMPLES:].mean()) if n else None
+
+        # Moving average over the last ``window`` samples, via prefix sums
+        cumulative = np.concatenate(([0.0], np.cumsum(values)))
+        upper = np.arange(1, n + 1)
+        lower = np.maximum(upper - window, 0)
+        moving = (cumulative[upper] - cumulative[lower]) / (upper - lower)
+        shown = slice(max(n - points, 0), n)
+
+        # Samples inside the day window, bucketed by the user's local day
+        local_days = ((timestamps + utc_offset_s) // DAY_S).astype(np.int64)
+        inside = local_days > today - days
+        day_keys, day_values, day_ts = local_days[inside], values[inside], timestamps[inside]
+        daily = []
+        if len(day_keys):
+            starts = np.concatenate(([0], np.flatnonzero(np.diff(day_keys)) + 1))
+            counts = np.diff(np.append(starts, len(day_keys)))
+            means = np.add.reduceat(day_values, starts) / counts
+            lows = np.minimum.reduceat(day_values, starts)
+            highs = np.maximum.reduceat(day_values, starts)
+            for day, mean, low, high, count in zip(day_keys[starts], means, lows, highs, counts):
+                daily.append({
+                    "date": datetime.fromtimestamp(int(day) * DAY_S, tz=timezone.utc).date().isoformat(),
+                    "mean": round(float(mean), 3),
+                    "min": round(float(low), 3),
+                    "max": round(float(high), 3),
+                    "count": int(count),
+                })
+
+        # Least-squares slope of mood against time over the day window, per day
+        slope = None
+        if len(day_ts) >= 2:
+            t = (day_ts - day_ts.mean()) / DAY_S
+            spread = float(np.dot(t, t))
+            if spread > 0:
+                slope = round(float(np.dot(t, day_values - day_values.mean()) / spread), 4)
+
+        source_counts = np.bincount(sources[inside], minlength=len(SOURCES))
+        known_confidence = confidences[inside][~np.isnan(confidences[inside])]
+        return {
+            "count": n,
+            "first": _iso(float(timestamps[0])) if n else None,
+            "last": _iso(float(timestamps[-1])) if n else None,
+            "latest_value": float(values[-1]) if n else None,
+            "recent_average": round(recent, 3) if recent is not None else None,
+            "trend": trend_label(recent),
+            "days": days,
+            "samples_in_window": int(inside.sum()),
+            "slope_per_day": slope,
+            "mean_confidence": round(float(known_confidence.mean()), 3) if len(known_confidence) else None,
+            "sources": {name: int(count) for name, count in zip(SOURCES, source_counts) if count},
+            "moving_average": {
+                "window": window,
+                "points": [{"timestamp": _iso(float(ts)), "value": round(float(value), 3)}
+                           for ts, value in zip(timestamps[shown], moving[shown])],
+            },
+            "daily": daily,
+        }
+
+
+class MoodStore:
+    """Per-user mood time series, kept in memory and snapshotted to one .npz file.
+
+    The snapshot is columnar: every user's samples are concatenated into
+    one array per field, with a user name array and offsets into them.
+    It is rewritten every ``save_interval_s`` while there are unsaved
+    samples, and on shutdown. Clients resend their recent check-ins with
+    each message, so samples newer than the last save are mostly recovered
+    after a crash as well.
+    """
+
+    def __init__(self, path: Optional[str], max_samples_per_user: int, save_interval_s: float = 60.0):
+        self.path = path
+        self.max_samples_per_user = max_samples_per_user
+        self.save_interval_s = save_interval_s
+        self.series: Dict[str, MoodSeries] = {}
+        # Versions come from one store-wide counter started from the clock (µs),
+        # so they aren't reused across restarts (see JsonConversationStore)
+        self._version = time.time_ns() // 1000
+        self._dirty = False
+        self.ingested = 0
+        self.rejected = 0
+        self.saves = 0
+        self._task: Optional[asyncio.Task] = None
+
+    def ingest(self, user: str, entries: Iterable, now: Optional[float] = None) -> int:
+        """Store a client's mood check-ins; returns how many were new."""
+        columns, rejected = parse_samples(entries, now)
+        self.rejected += rejected
+        if not len(columns[0]):
+            return 0
+        return self._merge(user, columns)
+
+    def _merge(self, user: str, columns: Columns) -> int:
+        series = self.series.get(user)
+        if series is None:
+            series = MoodSeries()
+        added = series.merge(columns, self.max_samples_per_user)
+        if added:
+            self.series[user] = series
+            self._version += 1
+            series.version = self._version
+            self.ingested += added
+            self._dirty = True
+        return added
+
+    def version(self, user: str) -> int:
+        series = self.series.get(user)
+        return series.version if series is not None else 0
+
+    def trend(self, user: str, window: int, days: int, utc_offset_s: int = 0, points: int = 100,
+              now: Optional[float] = None) -> Dict:
+        series = self.series.get(user)
+        if series is None:
+            series = MoodSeries(capacity=1)
+        return series.rollup(window, days, utc_offset_s, points, now if now is not None else time.time())
+
+    def prompt_summary(self, user: str, days: int) -> str:
+        """One line on the user's recent mood check-ins for the model prompt ("" if none)."""
+        series = self.series.get(user)
+        if series is None:
+            return ""
+        trend = series.rollup(RECENT_SAMPLES, days, 0, 0, time.time())
+        line = f"recent average {trend['recent_average']:.1f}/5 ({trend['trend'].replace('-', ' ')})"
+        slope = trend["slope_per_day"]
+        if slope is not None and abs(slope) * days >= 0.5:
+            line += f", {'improving' if slope > 0 else 'declining'} over the last {days} days"
+        return f"\n\nMood check-ins: {line}.\n"
+
+    def clear(self, user: str) -> int:
+        series = self.series.pop(user, None)
+        if series is None:
+            return 0
+        self._dirty = True
+        return len(series)
+
+    def expire(self, cutoff_ts: float) -> int:
+        """Drop every user's samples at or before the cutoff; returns how many were dropped."""
+        removed = 0
+        for user, series in list(self.series.items()):
+            if not series.size or series.timestamps[0] > cutoff_ts:
+                continue
+            dropped = series.expire(cutoff_ts)
+            removed += dropped
+            if not series.size:
+                del self.series[user]
+            else:
+                self._version += 1
+                series.version = self._version
+        if removed:
+            self._dirty = True
+        return removed
+
+    def sample_count(self) -> int:
+        return sum(len(series) for series in self.series.values())
+
+    # --- Snapshot ---
+    async def load(self):
+        if not self.path or not os.path.exists(self.path):
+            return
+        # Check-ins may have arrived while the snapshot was loading; they are merged
+        # in and still need saving
+        unsaved = self._dirty
+        loaded = await asyncio.to_thread(self._read)
+        for user, columns in loaded.items():
+            self._merge(user, columns)
+        self._dirty = unsaved
+        logger.info(f"✅ Loaded mood history for {len(loaded)} users from {self.path}")
+
+    def _read(self) -> Dict[str, Columns]:
+        try:
+            with np.load(self.path, allow_pickle=False) as data:
+                users, offsets = data["users"], data["offsets"]
+                columns = [data[name] for name in ("timestamps", "values", "confidences", "sources")]
+        except (OSError, ValueError, KeyError) as e:
+            logger.error(f"❌ Could not read mood history '{self.path}': {e}. Starting fresh.")
+            return {}
+        return {
+            str(user): tuple(column[offsets[i]:offsets[i + 1]] for column in columns)
+            for i, user in enumerate(users)
+        }
+
+    async def save(self):
+        if not self.path or not self._dirty:
+            return
+        # Take the arrays now; the file is written off the event loop
+        self._dirty = False
+        users = list(self.series)
+        parts = [self.series[user].columns() for user in users]
+        snapshot = {
+            "users": np.array(users, dtype=str),
+            "offsets": np.concatenate(([0], np.cumsum([len(p[0]) for p in parts]))).astype(np.int64),
+        }
+        for i, name in enumerate(("timestamps", "values", "confidences", "sources")):
+            dtype = (np.float64, np.float32, np.float32, np.int8)[i]
+            snapshot[name] = np.concatenate([p[i] for p in parts]) if parts else np.empty(0, dtype=dtype)
+        try:
+            await asyncio.to_thread(self._write, snapshot)
+            self.saves += 1
+        except Exception:
+            self._dirty = True
+            raise
+
+    def _write(self, snapshot: Dict[str, np.ndarray]):
+        temp_path = f"{self.path}.tmp"
+        with open(temp_path, mode="wb") as f:
+            np.savez(f, **snapshot)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, self.path)
+
+    def disk_usage(self) -> int:
+        try:
+            return os.path.getsize(self.path) if self.path else 0
+        except OSError:
+            return 0
+
+    # --- Background saves ---
+    def start(self):
+        if self.path and self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.save_interval_s)
+            try:
+                await self.save()
+            except Exception as e:
+                logger.error(f"❌ Mood history save failed: {e}")
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    def stats(self) -> Dict:
+        return {
+            "users": len(self.series),
+            "samples": self.sample_count(),
+            "ingested": self.ingested,
+            "rejected": self.rejected,
+            "saves": self.saves,
+            "unsaved": self._dirty,
+            "disk_bytes": self.disk_usage(),
+        }
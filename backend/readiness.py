@@ -0,0 +1,142 @@
+import time
+import asyncio
+import logging
+from typing import Awaitable, Callable, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+PENDING = "pending"
+WARMING = "warming"
+READY = "ready"
+FAILED = "failed"
+
+
+class NotReady(Exception):
+    """A subsystem a request needs hasn't finished (or failed) warming up."""
+
+    def __init__(self, phase: str, reason: str, retry_after_s: float):
+        super().__init__(f"{phase} {reason}")
+        self.phase = phase
+        self.reason = reason
+        self.retry_after_s = retry_after_s
+
+
+class _Phase:
+    __slots__ = ("name", "state", "started", "seconds", "error", "done")
+
+    def __init__(self, name: str):
+        self.name = name
+        self.state = PENDING
+        self.started: Optional[float] = None
+        self.seconds: Optional[float] = None
+        self.error: Optional[str] = None
+        self.done = asyncio.Event()
+
+
+class StartupPhases:
+    """Background warm-up of the app's subsystems, for liveness vs readiness.
+
+    The process is live as soon as it can answer requests; it is ready
+    once every phase (model client, storage, ...) has warmed up. Phases run
+    concurrently in the background from ``start``. Handlers call
+    ``wait(*names)`` for just the phases they need: a request that arrives
+    during warm-up waits up to ``max_wait_s`` rather than failing, and one
+    that needs a failed phase gets ``NotReady`` straight away.
+    ``process_started`` (a ``time.perf_counter`` value) anchors the
+    time-to-ready report, normally the start of the main module import.
+    """
+
+    def __init__(self, max_wait_s: float, process_started: Optional[float] = None):
+        self.max_wait_s = max_wait_s
+        self.process_started = process_started if process_started is not None else time.perf_counter()
+        self.import_s: Optional[float] = None
+        self.ready_at: Optional[float] = None
+        self._phases: Dict[str, _Phase] = {}
+        self._tasks = []
+
+    def imported(self):
+        """Mark the end of module import."""
+        self.import_s = time.perf_counter() - self.process_started
+
+    def start(self, phases: Dict[str, Callable[[], Awaitable[None]]]):
+        for name in phases:
+            self._phases[name] = _Phase(name)
+        self._tasks = [asyncio.create_task(self._run(self._phases[name], warm_up))
+                       for name, warm_up in phases.items()]
+
+    async def _run(self, phase: _Phase, warm_up: Callable[[], Awaitable[None]]):
+        phase.state = WARMING
+        phase.started = time.perf_counter()
+        try:
+            await warm_up()
+            phase.state = READY
+            logger.info(f"🔥 {phase.name} warm in {time.perf_counter() - phase.started:.2f}s")
+        except asyncio.CancelledError:
+            phase.state = FAILED
+            phase.error = "cancelled"
+            raise
+        except Exception as e:
+            phase.state = FAILED
+            phase.error = str(e)[:200]
+            logger.error(f"❌ Startup phase {phase.name} failed: {phase.error}")
+        finally:
+            phase.seconds = time.perf_counter() - phase.started
+            phase.done.set()
+            if self.ready_at is None and self.ready:
+                self.ready_at = time.perf_counter()
+                logger.info(f"🟢 Ready {self.ready_at - self.process_started:.2f}s after import began")
+
+    @property
+    def ready(self) -> bool:
+        return bool(self._phases) and all(p.state == READY for p in self._phases.values())
+
+    def is_ready(self, name: str) -> bool:
+        phase = self._phases.get(name)
+        return phase is not None and phase.state == READY
+
+    async def wait(self, *names: str):
+        """Return once the named phases are warm; raise NotReady if one failed or took too long."""
+        for name in names:
+            phase = self._phases.get(name)
+            if phase is None:
+                raise NotReady(name, "has not started", self.max_wait_s)
+            if phase.state == READY:
+                continue
+            if phase.state != FAILED:
+                try:
+                    await asyncio.wait_for(phase.done.wait(), timeout=self.max_wait_s)
+                except asyncio.TimeoutError:
+                    raise NotReady(name, "is still warming up", self.max_wait_s)
+            if phase.state == FAILED:
+                raise NotReady(name, f"failed to start: {phase.error}", 60.0)
+
+    async def settled(self, name: str) -> bool:
+        """Wait however long the phase takes; return whether it warmed up."""
+        phase = self._phases.get(name)
+        if phase is None:
+            return False
+        await phase.done.wait()
+        return phase.state == READY
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    def stats(self) -> Dict:
+        now = time.perf_counter()
+        return {
+            "ready": self.ready,
+            "uptime_s": round(now - self.process_started, 3),
+            "import_s": round(self.import_s, 3) if self.import_s is not None else None,
+            "time_to_ready_s": round(self.ready_at - self.process_started, 3) if self.ready_at else None,
+            "phases": {
+                name: {
+                    "state": phase.state,
+                    "seconds": round(phase.seconds if phase.seconds is not None
+                                     else now - phase.started if phase.started else 0.0, 3),
+                    "error": phase.error,
+                }
+                for name, phase in self._phases.items()
+            },
+        }
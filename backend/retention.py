@@ -0,0 +1,110 @@
+import time
+import heapq
+import asyncio
+import logging
+from typing import Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class ExpiryIndex:
+    """Min-heap of (oldest message timestamp, user).
+
+    Entries are only ever too early, never too late: a user's oldest message
+    can move forward (trimming, expiry) or the user can disappear without the
+    heap being told. Stale entries are resolved when they are popped, by
+    asking the store for the user's real oldest timestamp and re-adding it.
+    """
+
+    def __init__(self):
+        self._heap: List[Tuple[float, str]] = []
+
+    def __len__(self) -> int:
+        return len(self._heap)
+
+    def add(self, user: str, oldest_ts: float):
+        heapq.heappush(self._heap, (oldest_ts, user))
+
+    def pop_due(self, cutoff_ts: float, limit: int) -> List[str]:
+        """Pop up to ``limit`` distinct users whose oldest entry is at or before the cutoff."""
+        users: Dict[str, None] = {}
+        while self._heap and self._heap[0][0] <= cutoff_ts and len(users) < limit:
+            _, user = heapq.heappop(self._heap)
+            users[user] = None
+        return list(users)
+
+    def next_due(self) -> Optional[float]:
+        return self._heap[0][0] if self._heap else None
+
+
+class RetentionWorker:
+    """Background task that expires old messages a bounded batch of users at a time.
+
+    With a ``mood_store``, mood check-ins past the same cutoff are dropped
+    on every tick too.
+    """
+
+    def __init__(self, store, retention_days: float, interval_s: float, batch_users: int, mood_store=None):
+        self.store = store
+        self.mood_store = mood_store
+        self.retention_s = retention_days * 24 * 3600
+        self.interval_s = interval_s
+        self.batch_users = batch_users
+        self.ticks = 0
+        self.expired_messages = 0
+        self.expired_mood_samples = 0
+        self.last_tick: Optional[float] = None
+        self._task: Optional[asyncio.Task] = None
+
+    async def tick(self) -> int:
+        """Expire one batch of due users; returns how many messages were removed."""
+        cutoff_ts = time.time() - self.retention_s
+        removed = await self.store.expire_due(cutoff_ts, self.batch_users)
+        if self.mood_store is not None:
+            samples = self.mood_store.expire(cutoff_ts)
+            if samples:
+                self.expired_mood_samples += samples
+                logger.info(f"🧹 Retention removed {samples} mood samples older than {self.retention_s / 86400:g} days")
+        self.ticks += 1
+        self.last_tick = time.time()
+        if removed:
+            self.expired_messages += removed
+            logger.info(f"🧹 Retention removed {removed} messages older than {self.retention_s / 86400:g} days")
+        return removed
+
+    async def _run(self):
+        while True:
+            try:
+                await self.tick()
+                next_due = self.store.expiry.next_due()
+                more_due = next_due is not None and next_due <= time.time() - self.retention_s
+            except Exception as e:
+                logger.error(f"❌ Retention tick failed: {e}", exc_info=True)
+                more_due = False
+            # Keep draining, yielding between batches, while users are still due
+            await asyncio.sleep(0 if more_due else self.interval_s)
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def stats(self) -> Dict:
+        return {
+            "retention_days": self.retention_s / 86400,
+            "interval_s": self.interval_s,
+            "batch_users": self.batch_users,
+            "ticks": self.ticks,
+            "expired_messages": self.expired_messages,
+            "expired_mood_samples": self.expired_mood_samples,
+            "index_size": len(self.store.expiry),
+            "last_tick": self.last_tick,
+        }
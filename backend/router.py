@@ -0,0 +1,366 @@
+import re
+import time
+import asyncio
+import logging
+from collections import deque
+from typing import AsyncIterator, Callable, Dict, List, Optional, Tuple
+
+from metrics import percentile
+
+logger = logging.getLogger(__name__)
+
+# Errors worth trying on another model: rate limits, timeouts, connection
+# errors and 5xx responses. Google API errors carry their HTTP status in
+# ``code``; other clients are matched on a leading status code in the
+# message ("503 The service is currently unavailable."). Anything else
+# (bad request, blocked prompt) would fail the same way everywhere: it is
+# raised straight away and doesn't count against the model's health.
+FAILOVER_ERRORS = (asyncio.TimeoutError, TimeoutError, ConnectionError)
+SERVER_ERROR_STATUS = re.compile(r"^\s*5\d\d\b")
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class ModelHealth:
+    """Rolling health of one model plus its circuit breaker.
+
+    The breaker opens after ``breaker_threshold`` consecutive failures
+    (typically a 429 storm). After ``cooldown_s`` one probe request is let
+    through: success closes the breaker, failure reopens it for twice as
+    long, up to ``max_cooldown_s``.
+    """
+
+    def __init__(self, name: str, ewma_alpha: float, breaker_threshold: int,
+                 cooldown_s: float, max_cooldown_s: float, latency_window: int = 200):
+        self.name = name
+        self.ewma_alpha = ewma_alpha
+        self.breaker_threshold = breaker_threshold
+        self.base_cooldown_s = cooldown_s
+        self.max_cooldown_s = max_cooldown_s
+        self.cooldown_s = cooldown_s
+        self.requests = 0
+        self.failures = 0
+        self.rate_limits = 0
+        self.rejections = 0
+        self.latency_ewma: Optional[float] = None
+        self.error_ewma = 0.0
+        self.latencies: deque = deque(maxlen=latency_window)
+        self.consecutive_failures = 0
+        self.state = CLOSED
+        self.opened_at = 0.0
+        self.probing = False
+
+    def available(self, now: float) -> bool:
+        if self.state == CLOSED:
+            return True
+        if self.state == OPEN and now - self.opened_at >= self.cooldown_s:
+            self.state = HALF_OPEN
+        return self.state == HALF_OPEN and not self.probing
+
+    def begin(self):
+        self.requests += 1
+        if self.state == HALF_OPEN:
+            self.probing = True
+
+    def record_success(self, latency_s: float):
+        self.latencies.append(latency_s)
+        if self.latency_ewma is None:
+            self.latency_ewma = latency_s
+        else:
+            self.latency_ewma += self.ewma_alpha * (latency_s - self.latency_ewma)
+        self.error_ewma -= self.ewma_alpha * self.error_ewma
+        self._close()
+
+    def record_rejected(self):
+        # The model answered but refused this request (blocked prompt, 4xx):
+        # it is healthy, though the latency says nothing about normal answers
+        self.rejections += 1
+        self._close()
+
+    def _close(self):
+        self.consecutive_failures = 0
+        self.probing = False
+        if self.state != CLOSED:
+            logger.info(f"✅ Circuit closed for {self.name}")
+        self.state = CLOSED
+        self.cooldown_s = self.base_cooldown_s
+
+    def record_failure(self, rate_limited: bool, now: float):
+        self.failures += 1
+        self.rate_limits += rate_limited
+        self.error_ewma += self.ewma_alpha * (1 - self.error_ewma)
+        self.consecutive_failures += 1
+        if self.state == HALF_OPEN:
+            self.cooldown_s = min(self.cooldown_s * 2, self.max_cooldown_s)
+            self._open(now)
+        elif self.state == CLOSED and self.consecutive_failures >= self.breaker_threshold:
+            self._open(now)
+
+    def record_cancelled(self):
+        # A hedged loser or abandoned request says nothing about health
+        self.probing = False
+
+    def _open(self, now: float):
+        self.state = OPEN
+        self.opened_at = now
+        self.probing = False
+        logger.warning(f"🔌 Circuit opened for {self.name} for {self.cooldown_s:g}s "
+                       f"after {self.consecutive_failures} consecutive failures")
+
+    def latency_percentile(self, p: float) -> Optional[float]:
+        return percentile(self.latencies, p)
+
+    def stats(self) -> Dict:
+        return {
+            "state": self.state,
+            "requests": self.requests,
+            "failures": self.failures,
+            "rate_limits": self.rate_limits,
+            "rejections": self.rejections,
+            "error_rate_ewma": round(self.error_ewma, 4),
+            "latency_ewma_s": round(self.latency_ewma, 4) if self.latency_ewma is not None else None,
+            "latency_p95_s": self.latency_percentile(95),
+            "cooldown_s": self.cooldown_s,
+        }
+
+
+class ModelRouter:
+    """Sends each generation to the healthiest preferred model, failing over on errors.
+
+    ``models`` is a priority-ordered list of (name, client) pairs where the
+    client exposes ``generate_content_async(prompt, stream=...)`` like
+    ``genai.GenerativeModel``. Models with an open breaker are skipped;
+    rate limits, timeouts and server errors move the request on to the next
+    model. With ``hedge_percentile`` set, a backup request goes to the next
+    model when the first hasn't answered within that latency percentile,
+    and whichever answers first wins. ``on_call(model, seconds, outcome)``
+    is invoked after every upstream call, for metrics.
+    """
+
+    def __init__(
+        self,
+        models: List[Tuple[str, object]],
+        is_rate_limit: Callable[[Exception], bool],
+        attempt_timeout_s: float,
+        breaker_threshold: int = 3,
+        cooldown_s: float = 30.0,
+        max_cooldown_s: float = 300.0,
+        ewma_alpha: float = 0.2,
+        hedge_percentile: Optional[float] = None,
+        hedge_min_samples: int = 20,
+        on_call: Optional[Callable[[str, float, str], None]] = None,
+    ):
+        if not models:
+            raise ValueError("ModelRouter needs at least one model")
+        self.clients = dict(models)
+        self.order = [name for name, _ in models]
+        self.health = {
+            name: ModelHealth(name, ewma_alpha, breaker_threshold, cooldown_s, max_cooldown_s)
+            for name in self.order
+        }
+        self.is_rate_limit = is_rate_limit
+        self.attempt_timeout_s = attempt_timeout_s
+        self.hedge_percentile = hedge_percentile
+        self.hedge_min_samples = hedge_min_samples
+        self.on_call = on_call
+        self.failovers = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+
+    @property
+    def primary(self) -> str:
+        return self.order[0]
+
+    def candidates(self) -> List[str]:
+        """Models to try, in priority order, skipping open breakers.
+
+        If every breaker is open, the one closest to reopening is tried
+        anyway rather than failing without a call.
+        """
+        now = time.monotonic()
+        names = [name for name in self.order if self.health[name].available(now)]
+        if not names:
+            names = [min(self.order, key=lambda n: self.health[n].opened_at + self.health[n].cooldown_s)]
+        return names
+
+    def should_fail_over(self, error: Exception) -> bool:
+        if isinstance(error, FAILOVER_ERRORS) or self.is_rate_limit(error):
+            return True
+        code = getattr(error, "code", None)
+        if isinstance(code, int):
+            return 500 <= code < 600
+        return SERVER_ERROR_STATUS.match(str(error)) is not None
+
+    def _report(self, name: str, start: float, outcome: str):
+        if self.on_call is not None:
+            self.on_call(name, time.monotonic() - start, outcome)
+
+    def _outcome(self, error: BaseException) -> str:
+        if isinstance(error, asyncio.CancelledError):
+            return "cancelled"
+        if isinstance(error, asyncio.TimeoutError):
+            return "timeout"
+        if self.is_rate_limit(error):
+            return "rate_limited"
+        if isinstance(error, Exception) and not self.should_fail_over(error):
+            return "rejected"
+        return "error"
+
+    def _record_error(self, name: str, error: BaseException, start: float):
+        outcome = self._outcome(error)
+        self._report(name, start, outcome)
+        if outcome == "cancelled":
+            self.health[name].record_cancelled()
+            return
+        if outcome == "rejected":
+            logger.info(f"🚫 {name} rejected the request ({type(error).__name__}): {str(error)[:100]}")
+            self.health[name].record_rejected()
+            return
+        rate_limited = self.is_rate_limit(error)
+        logger.warning(f"⚠️ {name} failed ({'rate limited' if rate_limited else type(error).__name__}): "
+                       f"{str(error)[:100]}")
+        self.health[name].record_failure(rate_limited, time.monotonic())
+
+    async def _call(self, name: str, prompt: str) -> str:
+        health = self.health[name]
+        health.begin()
+        start = time.monotonic()
+        try:
+            response = await asyncio.wait_for(
+                self.clients[name].generate_content_async(prompt), timeout=self.attempt_timeout_s
+            )
+            text = response.text.strip()
+        except BaseException as e:
+            self._record_error(name, e, start)
+            raise
+        health.record_success(time.monotonic() - start)
+        self._report(name, start, "ok")
+        return text
+
+    def _hedge_delay(self, name: str) -> Optional[float]:
+        if self.hedge_percentile is None:
+            return None
+        health = self.health[name]
+        if len(health.latencies) < self.hedge_min_samples:
+            return None
+        return health.latency_percentile(self.hedge_percentile)
+
+    async def _call_hedged(self, name: str, backup: Optional[str], prompt: str, tried: set) -> Tuple[str, str]:
+        """Call ``name``; if it is slower than its hedge delay, race ``backup`` against it."""
+        tried.add(name)
+        delay = self._hedge_delay(name) if backup else None
+        if delay is None:
+            return await self._call(name, prompt), name
+
+        tasks = {asyncio.ensure_future(self._call(name, prompt)): name}
+        try:
+            done, _ = await asyncio.wait(tasks, timeout=delay)
+            if not done:
+                self.hedges += 1
+                logger.info(f"🏁 {name} slower than p{self.hedge_percentile:g} ({delay:.2f}s), hedging on {backup}")
+                tasks[asyncio.ensure_future(self._call(backup, prompt))] = backup
+                tried.add(backup)
+            pending = set(tasks)
+            error: Optional[BaseException] = None
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if tasks[task] != name:
+                            self.hedge_wins += 1
+                        return task.result(), tasks[task]
+                    error = task.exception()
+            raise error
+        finally:
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+
+    async def generate(self, prompt: str) -> Tuple[str, str]:
+        """Generate a response; returns (text, model name that answered).
+
+        Raises the last error if every candidate failed, so callers can
+        still back off on rate limits.
+        """
+        names = self.candidates()
+        tried: set = set()
+        last_error: Optional[Exception] = None
+        while True:
+            remaining = [name for name in names if name not in tried]
+            if not remaining:
+                raise last_error
+            if last_error is not None:
+                self.failovers += 1
+                logger.info(f"↪️ Failing over to {remaining[0]}")
+            backup = remaining[1] if len(remaining) > 1 else None
+            try:
+                return await self._call_hedged(remaining[0], backup, prompt, tried)
+            except Exception as e:
+                last_error = e
+                if not self.should_fail_over(e):
+                    raise
+
+    async def stream(self, prompt: str) -> AsyncIterator[Tuple[str, str]]:
+        """Yield (model name, text chunk) pairs.
+
+        Failover is possible until the first chunk has been received; after
+        that, text has reached the client and can't be replayed.
+        """
+        names = self.candidates()
+        last_error: Optional[Exception] = None
+        for i, name in enumerate(names):
+            health = self.health[name]
+            health.begin()
+            start = time.monotonic()
+            try:
+                response = await asyncio.wait_for(
+                    self.clients[name].generate_content_async(prompt, stream=True),
+                    timeout=self.attempt_timeout_s
+                )
+                chunks = response.__aiter__()
+                first = await asyncio.wait_for(chunks.__anext__(), timeout=self.attempt_timeout_s)
+                # .text raises ValueError on a blocked or empty candidate; read it
+                # here so that is classified (and accounted) like any other error
+                text = first.text
+            except StopAsyncIteration:
+                health.record_success(time.monotonic() - start)
+                self._report(name, start, "ok")
+                return
+            except BaseException as e:
+                self._record_error(name, e, start)
+                if not isinstance(e, Exception) or not self.should_fail_over(e):
+                    raise
+                last_error = e
+                if i + 1 < len(names):
+                    self.failovers += 1
+                    logger.info(f"↪️ Failing over to {names[i + 1]}")
+                continue
+
+            # Time to first chunk is what the breaker, hedging and metrics care about
+            health.record_success(time.monotonic() - start)
+            self._report(name, start, "ok")
+            if text:
+                yield name, text
+            while True:
+                try:
+                    chunk = await asyncio.wait_for(chunks.__anext__(), timeout=self.attempt_timeout_s)
+                    text = chunk.text
+                except StopAsyncIteration:
+                    return
+                except Exception as e:
+                    self._record_error(name, e, start)
+                    raise
+                if text:
+                    yield name, text
+        raise last_error
+
+    def stats(self) -> Dict:
+        return {
+            "order": self.order,
+            "failovers": self.failovers,
+            "hedges": self.hedges,
+            "hedge_wins": self.hedge_wins,
+            "models": {name: self.health[name].stats() for name in self.order},
+        }
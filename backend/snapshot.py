@@ -0,0 +1,208 @@
+"""Compact binary snapshot of chat history: length-prefixed records behind a per-user index.
+
+Layout (little-endian), format version 1::
+
+    header  magic b"WBSNAP\\r\\n" (8s), version (H), reserved (H), user count (I),
+            index offset (Q), index length (Q), index CRC-32 (I)
+    blocks  one per user, back to back: message count (I), then per message
+            role (B), timestamp in epoch seconds (d), content length (I), UTF-8 content
+    index   per user: name length (H), UTF-8 name, block offset (Q), block length (I),
+            message count (I), oldest timestamp (d), block CRC-32 (I)
+
+The index goes last so the file is written in one pass, with the header
+filled in at the end. Readers mmap the file and parse only the header and
+index; a user's block is decoded, and its checksum verified, when that
+user is asked for. Content is stored as raw UTF-8, so non-Latin text costs
+its encoded size rather than six bytes per character of JSON escapes.
+"""
+import os
+import json
+import mmap
+import zlib
+import struct
+from typing import Dict, Iterable, List, NamedTuple, Tuple
+
+from messages import Message, Role
+
+MAGIC = b"WBSNAP\r\n"
+FORMAT_VERSION = 1
+
+_HEADER = struct.Struct("<8sHHIQQI")
+_COUNT = struct.Struct("<I")
+_MESSAGE = struct.Struct("<BdI")
+_NAME_LENGTH = struct.Struct("<H")
+_INDEX_ENTRY = struct.Struct("<QIIdI")
+
+
+class SnapshotError(Exception):
+    """The file is not a readable snapshot of a supported version, or part of it is damaged."""
+
+
+class UserIndex(NamedTuple):
+    offset: int
+    length: int
+    message_count: int
+    oldest: float
+    crc: int
+
+
+def is_binary_snapshot(path: str) -> bool:
+    try:
+        with open(path, mode="rb") as f:
+            return f.read(len(MAGIC)) == MAGIC
+    except OSError:
+        return False
+
+
+def encode_messages(messages: List[Message]) -> bytes:
+    parts = [_COUNT.pack(len(messages))]
+    for message in messages:
+        content = message.content.encode("utf-8")
+        parts.append(_MESSAGE.pack(int(message.role), message.timestamp, len(content)))
+        parts.append(content)
+    return b"".join(parts)
+
+
+def decode_messages(block: bytes) -> List[Message]:
+    (count,) = _COUNT.unpack_from(block, 0)
+    position = _COUNT.size
+    messages = []
+    for _ in range(count):
+        role, timestamp, length = _MESSAGE.unpack_from(block, position)
+        position += _MESSAGE.size
+        messages.append(Message(Role(role), block[position:position + length].decode("utf-8"), timestamp))
+        position += length
+    return messages
+
+
+def write_snapshot(
+    path: str,
+    history: Iterable[Tuple[str, List[Message]]],
+    blocks: Iterable[Tuple[str, bytes, UserIndex]] = (),
+) -> int:
+    """Write (user, messages) pairs as a snapshot file, fsynced; returns its size in bytes.
+
+    Messages must be in timestamp order; users without messages are left
+    out. ``blocks`` are users copied as-is from another snapshot, as
+    returned by ``SnapshotReader.raw``.
+    """
+    index = []
+    users = 0
+    encoded = (
+        (user, encode_messages(messages), len(messages), messages[0].timestamp)
+        for user, messages in history if messages
+    )
+    copied = ((user, block, entry.message_count, entry.oldest) for user, block, entry in blocks)
+    with open(path, mode="wb") as f:
+        f.write(bytes(_HEADER.size))
+        offset = _HEADER.size
+        for source in (encoded, copied):
+            for user, block, message_count, oldest in source:
+                name = user.encode("utf-8")
+                index.append(_NAME_LENGTH.pack(len(name)))
+                index.append(name)
+                index.append(_INDEX_ENTRY.pack(offset, len(block), message_count, oldest, zlib.crc32(block)))
+                f.write(block)
+                offset += len(block)
+                users += 1
+        index_bytes = b"".join(index)
+        f.write(index_bytes)
+        f.seek(0)
+        f.write(_HEADER.pack(MAGIC, FORMAT_VERSION, 0, users, offset, len(index_bytes), zlib.crc32(index_bytes)))
+        f.flush()
+        os.fsync(f.fileno())
+    return offset + len(index_bytes)
+
+
+class SnapshotReader:
+    """Memory-mapped snapshot: the index is parsed on open, users are decoded on demand."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._file = open(path, mode="rb")
+        try:
+            if os.fstat(self._file.fileno()).st_size < _HEADER.size:
+                raise SnapshotError(f"'{path}' is too short to be a snapshot")
+            self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+            try:
+                self.index = self._read_index()
+            except Exception:
+                self._map.close()
+                raise
+        except Exception:
+            self._file.close()
+            raise
+
+    def _read_index(self) -> Dict[str, UserIndex]:
+        magic, version, _, users, index_offset, index_length, index_crc = _HEADER.unpack_from(self._map, 0)
+        if magic != MAGIC:
+            raise SnapshotError(f"'{self.path}' is not a binary snapshot")
+        if version != FORMAT_VERSION:
+            raise SnapshotError(f"'{self.path}' has snapshot format version {version}, expected {FORMAT_VERSION}")
+        if index_offset + index_length > len(self._map):
+            raise SnapshotError(f"'{self.path}' is truncated")
+        raw = self._map[index_offset:index_offset + index_length]
+        if zlib.crc32(raw) != index_crc:
+            raise SnapshotError(f"'{self.path}' index checksum mismatch")
+
+        index = {}
+        position = 0
+        for _ in range(users):
+            (length,) = _NAME_LENGTH.unpack_from(raw, position)
+            position += _NAME_LENGTH.size
+            name = raw[position:position + length].decode("utf-8")
+            position += length
+            index[name] = UserIndex(*_INDEX_ENTRY.unpack_from(raw, position))
+            position += _INDEX_ENTRY.size
+        return index
+
+    def __contains__(self, user: str) -> bool:
+        return user in self.index
+
+    def __len__(self) -> int:
+        return len(self.index)
+
+    def read(self, user: str) -> List[Message]:
+        """Decode one user's messages ([] for a user not in the snapshot)."""
+        if user not in self.index:
+            return []
+        return decode_messages(self.raw(user)[0])
+
+    def raw(self, user: str) -> Tuple[bytes, UserIndex]:
+        """One user's encoded block, checksum verified, and its index entry."""
+        entry = self.index[user]
+        block = self._map[entry.offset:entry.offset + entry.length]
+        if zlib.crc32(block) != entry.crc:
+            raise SnapshotError(f"'{self.path}' checksum mismatch in the history of {user}")
+        return block, entry
+
+    def close(self):
+        self._map.close()
+        self._file.close()
+
+    def __enter__(self) -> "SnapshotReader":
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+# --- Conversion to and from the JSON snapshot ---
+def json_to_snapshot(json_path: str, snapshot_path: str) -> int:
+    """Convert a {user: [{role, content, timestamp}]} JSON history to a binary snapshot."""
+    with open(json_path, mode="r", encoding="utf-8") as f:
+        content = f.read()
+    raw = json.loads(content) if content.strip() else {}
+    return write_snapshot(snapshot_path, (
+        (user, sorted(map(Message.from_dict, messages), key=lambda message: message.timestamp))
+        for user, messages in raw.items()
+    ))
+
+
+def snapshot_to_json(snapshot_path: str, json_path: str) -> int:
+    """Convert a binary snapshot back to the JSON history layout; returns the JSON size in bytes."""
+    with SnapshotReader(snapshot_path) as reader:
+        history = {user: [message.to_dict() for message in reader.read(user)] for user in reader.index}
+    with open(json_path, mode="w", encoding="utf-8") as f:
+        f.write(json.dumps(history, indent=2))
+    return os.path.getsize(json_path)
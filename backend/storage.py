@@ -0,0 +1,1266 @@
+import os
+import json
+import time
+import asyncio
+import logging
+import sqlite3
+try:
+    import fcntl
+except ImportError:  # Windows: no advisory locks, single worker assumed
+    fcntl = None
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import AsyncIterator, Callable, Collection, Dict, List, Optional, Tuple
+
+from cache import ConversationCache
+from messages import Message, MessageRing, Summary
+from retention import ExpiryIndex
+from snapshot import SnapshotError, SnapshotReader, is_binary_snapshot, json_to_snapshot, write_snapshot
+
+logger = logging.getLogger(__name__)
+
+FSYNC_POLICIES = ("always", "interval", "never")
+SNAPSHOT_FORMATS = ("json", "binary")
+
+History = Dict[str, MessageRing]
+Summaries = Dict[str, Summary]
+# Users left on disk at load: name -> (message count, oldest timestamp)
+ColdIndex = Dict[str, Tuple[int, float]]
+# Returned for unknown users; read-only
+EMPTY_RING = MessageRing(0)
+
+
+class JournalStore:
+    """Chat history persisted as a JSON snapshot plus an append-only JSONL journal.
+
+    Every mutation is one line appended to the journal, so a write costs
+    O(message) instead of O(total history). Once the journal grows past
+    ``compact_every`` records the caller compacts it: the journal segment is
+    rotated out, the full history is written to the snapshot, and the segment
+    is dropped. ``load`` replays snapshot + journal and finishes any
+    compaction that was interrupted by a crash.
+
+    Conversation summaries are journaled the same way and compacted into a
+    sidecar file next to the snapshot, so the snapshot keeps its original
+    {user: [messages]} shape.
+
+    With ``snapshot_format="binary"`` the snapshot is the indexed binary
+    format from snapshot.py instead. It is memory-mapped: loading parses
+    only its index plus the users the journal touches, and every other
+    user is decoded the first time it is read. If the binary snapshot
+    doesn't exist yet, ``import_from`` (a JSON snapshot) is converted on
+    first load and left in place.
+    """
+
+    def __init__(
+        self,
+        snapshot_path: str,
+        journal_path: str,
+        max_messages_per_user: int,
+        fsync_policy: str = "interval",
+        fsync_interval: float = 1.0,
+        compact_every: int = 500,
+        lock: Optional[asyncio.Lock] = None,
+        snapshot_format: str = "json",
+        import_from: Optional[str] = None,
+    ):
+        if fsync_policy not in FSYNC_POLICIES:
+            raise ValueError(f"fsync policy must be one of {FSYNC_POLICIES}, got '{fsync_policy}'")
+        if snapshot_format not in SNAPSHOT_FORMATS:
+            raise ValueError(f"snapshot format must be one of {SNAPSHOT_FORMATS}, got '{snapshot_format}'")
+        self.snapshot_path = snapshot_path
+        self.journal_path = journal_path
+        self.fsync_policy = fsync_policy
+        self.fsync_interval = fsync_interval
+        self.compact_every = compact_every
+        self.max_messages_per_user = max_messages_per_user
+        self.lock = lock or asyncio.Lock()
+        self.binary = snapshot_format == "binary"
+        self.import_from = import_from
+        self._reader: Optional[SnapshotReader] = None
+
+        self._segment_path = f"{journal_path}.compacting"
+        self._snapshot_tmp_path = f"{snapshot_path}.tmp"
+        self._backup_path = f"{snapshot_path}.backup"
+        self.summaries_path = f"{os.path.splitext(snapshot_path)[0]}.summaries.json"
+        # Locked by journal, which stays the same when SNAPSHOT_FORMAT switches snapshot files
+        self._lock_path = f"{journal_path}.lock"
+        self._lock_fd: Optional[int] = None
+        self._fd: Optional[int] = None
+        self._records = 0
+        self._last_fsync = time.monotonic()
+
+    # --- Loading ---
+    async def load(self) -> Tuple[History, Summaries, ColdIndex]:
+        """Replay snapshot + journal into fresh history and summary dicts.
+
+        Users a binary snapshot leaves undecoded come back in the cold index
+        instead of the history; a JSON snapshot decodes everyone.
+        """
+        async with self.lock:
+            return await asyncio.to_thread(self._load_sync)
+
+    def _load_sync(self) -> Tuple[History, Summaries, ColdIndex]:
+        self._acquire_process_lock()
+        self._recover_compaction()
+
+        on_user = None
+        if self.binary:
+            self._import_json_snapshot()
+            self._open_reader()
+            history: History = {}
+            touched = set()
+
+            def on_user(user: str):
+                # Decode a user from the snapshot before the journal changes them
+                if user not in touched:
+                    touched.add(user)
+                    messages = self._snapshot_messages(user)
+                    if messages:
+                        history[user] = MessageRing(self.max_messages_per_user, messages)
+        else:
+            history = self._to_rings(self._read_snapshot())
+        summaries = self._read_summaries()
+        replayed = 0
+        for path in (self._segment_path, self.journal_path):
+            if os.path.exists(path):
+                self._repair_torn_tail(path)
+        if os.path.exists(self._segment_path):
+            replayed += self._replay(self._segment_path, history, summaries, on_user=on_user)
+        if os.path.exists(self.journal_path):
+            self._records = self._replay(self.journal_path, history, summaries, on_user=on_user)
+            replayed += self._records
+
+        if replayed:
+            logger.info(f"📜 Replayed {replayed} journal records")
+        cold: ColdIndex = {}
+        if self._reader is not None:
+            cold = {
+                user: (min(entry.message_count, self.max_messages_per_user), entry.oldest)
+                for user, entry in self._reader.index.items() if user not in touched
+            }
+            logger.info(f"✅ Indexed chat history for {len(self._reader)} users from {self.snapshot_path}")
+        return history, summaries, cold
+
+    def _import_json_snapshot(self):
+        """Convert the JSON snapshot the first time the binary format is used."""
+        if os.path.exists(self.snapshot_path) or not self.import_from or not os.path.exists(self.import_from):
+            return
+        if is_binary_snapshot(self.import_from):
+            return
+        json_size = os.path.getsize(self.import_from)
+        size = json_to_snapshot(self.import_from, self._snapshot_tmp_path)
+        os.replace(self._snapshot_tmp_path, self.snapshot_path)
+        logger.info(f"📦 Converted '{self.import_from}' to binary snapshot '{self.snapshot_path}' "
+                    f"({json_size / 1024:.0f} KB -> {size / 1024:.0f} KB)")
+
+    def _open_reader(self):
+        if self._reader is not None:
+            self._reader.close()
+            self._reader = None
+        if not os.path.exists(self.snapshot_path):
+            logger.info(f"'{self.snapshot_path}' not found, starting with empty history.")
+            return
+        try:
+            self._reader = SnapshotReader(self.snapshot_path)
+        except (OSError, SnapshotError) as e:
+            logger.error(f"❌ Cannot read snapshot '{self.snapshot_path}': {e}. Starting fresh.")
+            backup_file = f"{self.snapshot_path}.corrupted_{datetime.now().timestamp()}"
+            os.replace(self.snapshot_path, backup_file)
+            logger.info(f"⚠️ Moved unreadable snapshot to {backup_file}")
+
+    def _snapshot_messages(self, user: str) -> List[Message]:
+        if self._reader is None:
+            return []
+        try:
+            return self._reader.read(user)
+        except SnapshotError as e:
+            logger.error(f"❌ {e}. Skipping that history.")
+            return []
+
+    def _read_summaries(self) -> Summaries:
+        if not os.path.exists(self.summaries_path):
+            return {}
+        try:
+            with open(self.summaries_path, mode='r', encoding='utf-8') as f:
+                return {user: Summary.from_dict(data) for user, data in json.load(f).items()}
+        except (OSError, ValueError, KeyError) as e:
+            # Summaries can be rebuilt from new turns; don't refuse to start over them
+            logger.error(f"❌ Error loading '{self.summaries_path}': {e}. Starting without summaries.")
+            return {}
+
+    async def read_users(self, users: Collection[str]) -> History:
+        """Rebuild selected users from disk (snapshot + journal)."""
+        async with self.lock:
+            return await asyncio.to_thread(self._read_users_sync, users, True)
+
+    def _read_users_sync(self, users: Collection[str], include_journal: bool) -> History:
+        if self.binary:
+            history = {}
+            for user in users:
+                messages = self._snapshot_messages(user)
+                if messages:
+                    history[user] = MessageRing(self.max_messages_per_user, messages)
+        else:
+            snapshot = self._read_snapshot(quiet=True)
+            history = self._to_rings({user: snapshot[user] for user in users if user in snapshot})
+        paths = [self._segment_path, self.journal_path] if include_journal else [self._segment_path]
+        for path in paths:
+            if os.path.exists(path):
+                self._replay(path, history, users=users)
+        return history
+
+    def _acquire_process_lock(self):
+        """Refuse to share the journal with another process; each would clobber the other's snapshot."""
+        if fcntl is None or self._lock_fd is not None:
+            return
+        fd = os.open(self._lock_path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            os.close(fd)
+            raise RuntimeError(
+                f"'{self.journal_path}' is in use by another process. JSON storage supports a single "
+                f"worker; use STORAGE_BACKEND=sqlite with SHARED_STATE=1 to run several workers."
+            )
+        self._lock_fd = fd
+
+    def _recover_compaction(self):
+        """Finish or roll back a compaction interrupted by a crash."""
+        if os.path.exists(self._segment_path):
+            # Segment still present: the snapshot was never replaced, so any
+            # temp file is incomplete. Replay the segment on top of the old one.
+            if os.path.exists(self._snapshot_tmp_path):
+                os.remove(self._snapshot_tmp_path)
+                logger.warning("⚠️ Discarded incomplete snapshot from interrupted compaction")
+        elif os.path.exists(self._snapshot_tmp_path):
+            # Segment already dropped: the temp snapshot is complete.
+            if os.path.exists(self.snapshot_path):
+                os.replace(self.snapshot_path, self._backup_path)
+            os.replace(self._snapshot_tmp_path, self.snapshot_path)
+            logger.warning("⚠️ Completed snapshot from interrupted compaction")
+
+    def _repair_torn_tail(self, path: str):
+        """End the file on a complete record after a crash mid-append.
+
+        Every write ends in a newline, so an unterminated last line is a torn
+        record. Left in place, the next append would be glued onto it and
+        become unreadable too. It is cut off, or just terminated if it happens
+        to be a whole record.
+        """
+        with open(path, 'rb+') as f:
+            size = f.seek(0, os.SEEK_END)
+            if not size:
+                return
+            f.seek(size - 1)
+            if f.read(1) == b"\n":
+                return
+            keep = 0
+            end = size
+            while end > 0:
+                start = max(0, end - 65536)
+                f.seek(start)
+                newline = f.read(end - start).rfind(b"\n")
+                if newline >= 0:
+                    keep = start + newline + 1
+                    break
+                end = start
+            f.seek(keep)
+            tail = f.read()
+            try:
+                json.loads(tail)
+            except ValueError:
+                f.truncate(keep)
+                logger.warning(f"⚠️ Dropped a torn record ({size - keep} bytes) at the end of {path}")
+            else:
+                f.write(b"\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+    def _to_rings(self, raw: Dict[str, List[Dict[str, str]]]) -> History:
+        return {
+            user: MessageRing(self.max_messages_per_user, map(Message.from_dict, messages))
+            for user, messages in raw.items()
+        }
+
+    def _read_snapshot(self, quiet: bool = False) -> Dict[str, List[Dict[str, str]]]:
+        if not os.path.exists(self.snapshot_path):
+            if not quiet:
+                logger.info(f"'{self.snapshot_path}' not found, starting with empty history.")
+            return {}
+
+        try:
+            with open(self.snapshot_path, mode='r', encoding='utf-8') as f:
+                content = f.read()
+        except Exception as e:
+            logger.error(f"❌ Error loading '{self.snapshot_path}': {e}. Starting with empty history.")
+            return {}
+
+        if not content:
+            logger.info("History file is empty, starting fresh.")
+            return {}
+
+        try:
+            history = json.loads(content)
+            if not quiet:
+                logger.info(f"✅ Successfully loaded chat history for {len(history)} users.")
+            return history
+        except json.JSONDecodeError:
+            logger.error(f"❌ JSON corrupted in '{self.snapshot_path}'. Starting fresh.")
+            backup_file = f"{self.snapshot_path}.corrupted_{datetime.now().timestamp()}"
+            with open(backup_file, mode='w', encoding='utf-8') as backup:
+                backup.write(content)
+            logger.info(f"⚠️ Backed up corrupted file to {backup_file}")
+            return {}
+
+    def _replay(
+        self,
+        path: str,
+        history: History,
+        summaries: Optional[Summaries] = None,
+        users: Optional[Collection[str]] = None,
+        on_user: Optional[Callable[[str], None]] = None,
+    ) -> int:
+        applied = 0
+        with open(path, mode='r', encoding='utf-8') as f:
+            for line_no, line in enumerate(f, 1):
+                if not line.strip():
+                    continue
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    # Torn tails are repaired on load (_repair_torn_tail), so this is corruption
+                    logger.warning(f"⚠️ Skipping unreadable journal record {path}:{line_no}")
+                    continue
+                if users is not None and record.get("user") not in users:
+                    continue
+                if on_user is not None and record.get("op") != "summary":
+                    on_user(record.get("user"))
+                self._apply(record, history, summaries)
+                applied += 1
+        return applied
+
+    def _snapshot_blocks(self, users: Collection[str]):
+        for user in users:
+            try:
+                yield (user, *self._reader.raw(user))
+            except SnapshotError as e:
+                logger.error(f"❌ {e}. Dropping that history from the new snapshot.")
+
+    def _journal_users(self, path: str) -> set:
+        users = set()
+        if os.path.exists(path):
+            with open(path, mode='r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        users.add(json.loads(line).get("user"))
+                    except json.JSONDecodeError:
+                        continue
+        return users
+
+    def _apply(self, record: Dict, history: History, summaries: Optional[Summaries]):
+        """Apply one journal record; summary records are skipped when ``summaries`` is None."""
+        op = record.get("op")
+        user = record.get("user")
+        if op == "append":
+            if user not in history:
+                history[user] = MessageRing(self.max_messages_per_user)
+            history[user].append(Message.from_dict(record["message"]))
+        elif op == "clear":
+            history.pop(user, None)
+            if summaries is not None:
+                summaries.pop(user, None)
+        elif op == "expire":
+            if user in history:
+                kept = [msg for msg in history[user] if msg.timestamp > record["before"]]
+                if kept:
+                    history[user] = MessageRing(self.max_messages_per_user, kept)
+                else:
+                    del history[user]
+                    if summaries is not None:
+                        summaries.pop(user, None)
+        elif op == "summary":
+            if summaries is not None:
+                summaries[user] = Summary.from_dict(record["summary"])
+        else:
+            logger.warning(f"⚠️ Unknown journal op '{op}', skipping")
+
+    # --- Journal writes ---
+    async def append(self, user: str, message: Message):
+        """Journal one appended message."""
+        await self.append_many([(user, message)])
+
+    async def append_many(self, entries: List[Tuple[str, Message]]):
+        """Journal several appended messages in one write (and at most one fsync)."""
+        if entries:
+            await self._write([{"op": "append", "user": user, "message": message.to_dict()}
+                               for user, message in entries])
+
+    async def clear(self, user: str):
+        """Journal removal of a user's history."""
+        await self._write([{"op": "clear", "user": user}])
+
+    async def set_summary(self, user: str, summary: Summary):
+        """Journal a user's new conversation summary."""
+        await self._write([{"op": "summary", "user": user, "summary": summary.to_dict()}])
+
+    async def expire(self, users: Collection[str], before: float):
+        """Journal expiry of messages at or before ``before`` for several users in one write."""
+        if users:
+            await self._write([{"op": "expire", "user": user, "before": before} for user in users])
+
+    async def _write(self, records: List[Dict]):
+        data = "".join(json.dumps(record, ensure_ascii=False) + "\n" for record in records).encode("utf-8")
+        # The write itself happens before the first await, so it is atomic with
+        # the caller's in-memory mutation relative to a compaction snapshot.
+        if self._fd is None:
+            self._fd = os.open(self.journal_path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        os.write(self._fd, data)
+        self._records += len(records)
+
+        if self.fsync_policy == "always":
+            await self._fsync()
+        elif self.fsync_policy == "interval":
+            now = time.monotonic()
+            if now - self._last_fsync >= self.fsync_interval:
+                self._last_fsync = now
+                await self._fsync()
+
+    async def _fsync(self):
+        # Sync a duplicate of the fd rather than taking self.lock: compaction
+        # holds the lock while it writes the snapshot, and appends must not
+        # wait for that. The duplicate stays valid if the journal is rotated
+        # meanwhile (rotation syncs it anyway).
+        if self._fd is None:
+            return
+        fd = os.dup(self._fd)
+        try:
+            await asyncio.to_thread(os.fsync, fd)
+        finally:
+            os.close(fd)
+
+    async def sync(self):
+        self._last_fsync = time.monotonic()
+        await self._fsync()
+
+    def should_compact(self) -> bool:
+        return self._records >= self.compact_every
+
+    # --- Compaction ---
+    async def compact(
+        self,
+        collect: Callable[[], Tuple[History, Collection[str], Summaries]],
+    ):
+        """Write a new snapshot and drop the journal it covers.
+
+        ``collect`` returns the in-memory users, the names of cold users
+        that only exist on disk, and all summaries; cold users are carried
+        over from the previous snapshot.
+        """
+        async with self.lock:
+            # Rotation and collection below run without yielding, so every
+            # journal record in the rotated segment is reflected in the copy.
+            # Messages themselves are immutable, so copying the rings is
+            # enough to serialize off the event loop.
+            self._rotate()
+            history, cold_users, summaries = collect()
+            snapshot = {user: ring.to_list() for user, ring in history.items()}
+            cold_users = set(cold_users) - snapshot.keys()
+            summaries = {user: summary.to_dict() for user, summary in summaries.items()}
+            try:
+                await asyncio.to_thread(self._write_snapshot, snapshot, cold_users, summaries)
+            except Exception as e:
+                logger.error(f"❌ Error saving chat history to '{self.snapshot_path}': {e}")
+                # Keep the rotated segment; it is replayed on next startup
+                return
+        logger.debug(f"💾 Chat history compacted ({len(snapshot)} users)")
+
+    def _rotate(self):
+        if self._fd is not None:
+            os.fsync(self._fd)
+            os.close(self._fd)
+            self._fd = None
+        if os.path.exists(self.journal_path):
+            if os.path.exists(self._segment_path):
+                # A previous compaction failed; fold its records into this one
+                with open(self._segment_path, 'ab') as segment, open(self.journal_path, 'rb') as journal:
+                    segment.write(journal.read())
+                os.remove(self.journal_path)
+            else:
+                os.replace(self.journal_path, self._segment_path)
+        self._records = 0
+
+    def _write_snapshot(
+        self,
+        snapshot: Dict[str, List[Message]],
+        cold_users: Collection[str],
+        summaries: Dict[str, Dict],
+    ):
+        copied = []
+        if cold_users and self._reader is not None:
+            # Cold users the rotated segment doesn't touch are unchanged since
+            # the last snapshot: copy their blocks as they are
+            touched = self._journal_users(self._segment_path)
+            copied = [user for user in cold_users if user not in touched and user in self._reader]
+            cold_users = set(cold_users).difference(copied)
+        if cold_users:
+            for user, ring in self._read_users_sync(cold_users, include_journal=False).items():
+                snapshot[user] = ring.to_list()
+
+        # Summaries go first: until the segment is dropped below, replaying it
+        # reapplies the same summary records, so a crash in between is harmless.
+        # No summaries, no sidecar file.
+        if summaries:
+            summaries_tmp_path = f"{self.summaries_path}.tmp"
+            with open(summaries_tmp_path, mode='w', encoding='utf-8') as f:
+                f.write(json.dumps(summaries, ensure_ascii=False))
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(summaries_tmp_path, self.summaries_path)
+        elif os.path.exists(self.summaries_path):
+            os.remove(self.summaries_path)
+
+        if self.binary:
+            write_snapshot(self._snapshot_tmp_path, snapshot.items(), self._snapshot_blocks(copied))
+        else:
+            with open(self._snapshot_tmp_path, mode='w', encoding='utf-8') as f:
+                serialized = {user: [msg.to_dict() for msg in messages] for user, messages in snapshot.items()}
+                f.write(json.dumps(serialized, indent=2))
+                f.flush()
+                os.fsync(f.fileno())
+        if self._reader is not None:
+            # Unmap before replacing the file (required on Windows)
+            self._reader.close()
+            self._reader = None
+        # Order matters for crash recovery, see _recover_compaction
+        if os.path.exists(self._segment_path):
+            os.remove(self._segment_path)
+        if os.path.exists(self.snapshot_path):
+            os.replace(self.snapshot_path, self._backup_path)
+        os.replace(self._snapshot_tmp_path, self.snapshot_path)
+        if self.binary:
+            self._open_reader()
+
+    async def close(self):
+        async with self.lock:
+            if self._fd is not None:
+                os.fsync(self._fd)
+                os.close(self._fd)
+                self._fd = None
+            if self._lock_fd is not None:
+                os.close(self._lock_fd)
+                self._lock_fd = None
+            if self._reader is not None:
+                self._reader.close()
+                self._reader = None
+
+    def disk_usage(self) -> int:
+        """Bytes used by snapshot and journal."""
+        total = 0
+        for path in (self.snapshot_path, self.journal_path, self._segment_path, self.summaries_path):
+            if os.path.exists(path):
+                total += os.path.getsize(path)
+        return total
+
+
+class ConversationStore:
+    """Repository interface used by the API for conversation history.
+
+    Rings returned by ``get_messages`` are owned by the store and must not
+    be mutated by callers. Stores keep ``expiry`` up to date with each new
+    user's oldest message so retention can find due users without scanning.
+    """
+
+    expiry: ExpiryIndex
+
+    async def load(self):
+        raise NotImplementedError
+
+    async def get_messages(self, user: str) -> MessageRing:
+        raise NotImplementedError
+
+    async def append(self, user: str, message: Message):
+        raise NotImplementedError
+
+    async def append_many(self, entries: List[Tuple[str, Message]]):
+        """Append several (user, message) pairs as one group commit, in order."""
+        raise NotImplementedError
+
+    async def clear(self, user: str) -> int:
+        """Remove a user's history and summary, returning how many messages were dropped."""
+        raise NotImplementedError
+
+    async def get_summary(self, user: str) -> Optional[Summary]:
+        raise NotImplementedError
+
+    async def set_summary(self, user: str, summary: Summary):
+        raise NotImplementedError
+
+    async def expire_due(self, cutoff_ts: float, limit: int) -> int:
+        """Expire messages at or before ``cutoff_ts`` for up to ``limit`` due users.
+
+        Returns how many messages were removed. Users that still have
+        messages are re-indexed under their new oldest timestamp.
+        """
+        users = self.expiry.pop_due(cutoff_ts, limit)
+        if not users:
+            return 0
+        removed, oldest = await self._expire_users(users, cutoff_ts)
+        for user, oldest_ts in oldest.items():
+            if oldest_ts is not None:
+                self.expiry.add(user, oldest_ts)
+        return removed
+
+    async def _expire_users(self, users: List[str], cutoff_ts: float) -> Tuple[int, Dict[str, Optional[float]]]:
+        """Expire the given users with one batched write.
+
+        Returns the number of messages removed and each user's remaining
+        oldest timestamp (None once the user has no messages left).
+        """
+        raise NotImplementedError
+
+    async def get_version(self, user: str) -> int:
+        """Version of the user's history: changes with every write and is never
+        reused for different contents (0 for a user with no history)."""
+        raise NotImplementedError
+
+    def iter_histories(self, batch_users: int) -> AsyncIterator[Tuple[str, MessageRing]]:
+        """Yield (user, messages) for every stored user, loading ``batch_users`` at a time."""
+        raise NotImplementedError
+
+    async def sync_counts(self):
+        """Refresh user/message counts that other processes may have changed."""
+
+    def user_count(self) -> int:
+        raise NotImplementedError
+
+    def message_count(self) -> int:
+        raise NotImplementedError
+
+    def disk_usage(self) -> int:
+        raise NotImplementedError
+
+    async def sync(self):
+        """Make everything written so far durable now, whatever the fsync policy."""
+
+    async def flush(self):
+        """Make everything written so far durable in its compact on-disk form."""
+
+    async def close(self):
+        pass
+
+
+class JsonConversationStore(ConversationStore):
+    """History persisted through a JournalStore, with hot users held in an LRU cache.
+
+    Users evicted from the cache stay on disk (every change is journaled
+    before it is acknowledged) and are rebuilt from snapshot + journal on the
+    next access. Compaction carries cold users over from the previous
+    snapshot. Rebuilding a user from a JSON snapshot parses the whole file,
+    so give this store a bounded cache only with the binary snapshot.
+    """
+
+    def __init__(self, journal: JournalStore, cache: ConversationCache, max_messages_per_user: int):
+        self.journal = journal
+        self.cache = cache
+        self.max_messages_per_user = max_messages_per_user
+        # Message count per stored user, hot or cold
+        self.counts: Dict[str, int] = {}
+        # Summaries are small and kept for every user, hot or cold
+        self.summaries: Summaries = {}
+        self.expiry = ExpiryIndex()
+        # Per-user history versions, stamped from one store-wide counter. It
+        # starts from the clock (µs) so versions from an earlier run of the
+        # process aren't handed out again for different contents.
+        self.versions: Dict[str, int] = {}
+        self._version = time.time_ns() // 1000
+        self._message_count = 0
+        self._compaction_task: Optional[asyncio.Task] = None
+
+    def _bump_version(self, user: str):
+        self._version += 1
+        self.versions[user] = self._version
+
+    async def load(self):
+        history, self.summaries, cold = await self.journal.load()
+        self.counts = {user: count for user, (count, _) in cold.items()}
+        self.counts.update((user, len(messages)) for user, messages in history.items())
+        self.versions = dict.fromkeys(self.counts, self._version)
+        self._message_count = sum(self.counts.values())
+        for user, (_, oldest_ts) in cold.items():
+            self.expiry.add(user, oldest_ts)
+        for user, messages in history.items():
+            self.expiry.add(user, messages.oldest().timestamp)
+            self.cache.put(user, messages)
+        if len(self.cache) < len(history):
+            logger.info(f"♻️ {len(history) - len(self.cache)} users left on disk by the cache budget")
+
+    async def get_messages(self, user: str) -> MessageRing:
+        messages = self.cache.get(user)
+        if messages is not None:
+            return messages
+        if user not in self.counts:
+            return EMPTY_RING
+
+        loaded = (await self.journal.read_users([user])).get(user, EMPTY_RING)
+        # Another request may have loaded (and appended to) this user meanwhile
+        if user in self.cache:
+            return self.cache.get(user)
+        self.cache.put(user, loaded)
+        return loaded
+
+    async def append(self, user: str, message: Message):
+        await self.append_many([(user, message)])
+
+    async def append_many(self, entries: List[Tuple[str, Message]]):
+        if not entries:
+            return
+        rings = {}
+        for user, _ in entries:
+            if user not in rings:
+                rings[user] = await self.get_messages(user)
+
+        # No awaits from here to the journal write, so the in-memory changes
+        # and their records land together relative to a compaction snapshot
+        for user, message in entries:
+            messages = rings[user]
+            if not messages:
+                messages = rings[user] = MessageRing(self.max_messages_per_user)
+                self.expiry.add(user, message.timestamp)
+            if messages.append(message) is not None:
+                logger.info(f"Trimmed history for {user} to {self.max_messages_per_user} messages")
+
+        for user, messages in rings.items():
+            self._message_count += len(messages) - self.counts.get(user, 0)
+            self.counts[user] = len(messages)
+            self._bump_version(user)
+            self.cache.put(user, messages)
+
+        await self.journal.append_many(entries)
+        self._schedule_compaction()
+
+    async def clear(self, user: str) -> int:
+        count = self.counts.pop(user, None)
+        if count is None:
+            return 0
+        self.cache.pop(user)
+        self.summaries.pop(user, None)
+        self.versions.pop(user, None)
+        self._message_count -= count
+        await self.journal.clear(user)
+        return count
+
+    async def get_version(self, user: str) -> int:
+        return self.versions.get(user, 0)
+
+    async def iter_histories(self, batch_users: int) -> AsyncIterator[Tuple[str, MessageRing]]:
+        users = list(self.counts)
+        for i in range(0, len(users), batch_users):
+            batch = users[i:i + batch_users]
+            # Peek so a bulk export doesn't reshuffle the LRU; cold users come
+            # from disk, one snapshot read per batch
+            hot = {user: self.cache.peek(user) for user in batch if user in self.cache}
+            cold = [user for user in batch if user not in hot and user in self.counts]
+            loaded = await self.journal.read_users(cold) if cold else {}
+            for user in batch:
+                messages = hot.get(user) or loaded.get(user)
+                if messages:
+                    yield user, messages
+
+    async def get_summary(self, user: str) -> Optional[Summary]:
+        return self.summaries.get(user)
+
+    async def set_summary(self, user: str, summary: Summary):
+        if user not in self.counts:
+            return  # cleared or expired while the summary was being written
+        self.summaries[user] = summary
+        await self.journal.set_summary(user, summary)
+        self._schedule_compaction()
+
+    async def _expire_users(self, users: List[str], cutoff_ts: float) -> Tuple[int, Dict[str, Optional[float]]]:
+        cold = [user for user in users if user in self.counts and user not in self.cache]
+        loaded = await self.journal.read_users(cold) if cold else {}
+
+        removed = 0
+        expired: List[str] = []
+        oldest: Dict[str, Optional[float]] = {}
+        for user in users:
+            if user not in self.counts:
+                oldest[user] = None
+                continue
+            # A cold user may have been loaded (and appended to) meanwhile
+            cached = user in self.cache
+            messages = self.cache.peek(user) if cached else loaded.get(user, EMPTY_RING)
+            kept = [msg for msg in messages if msg.timestamp > cutoff_ts]
+            if len(kept) < len(messages):
+                expired.append(user)
+                removed += len(messages) - len(kept)
+                if kept:
+                    self.counts[user] = len(kept)
+                    self._bump_version(user)
+                    if cached:
+                        self.cache.put(user, MessageRing(self.max_messages_per_user, kept))
+                else:
+                    del self.counts[user]
+                    self.versions.pop(user, None)
+                    self.cache.pop(user)
+                    self.summaries.pop(user, None)
+                    logger.info(f"🗑️ Removed empty user: {user}")
+            oldest[user] = kept[0].timestamp if kept else None
+
+        self._message_count -= removed
+        await self.journal.expire(expired, cutoff_ts)
+        self._schedule_compaction()
+        return removed, oldest
+
+    def user_count(self) -> int:
+        return len(self.counts)
+
+    def message_count(self) -> int:
+        return self._message_count
+
+    def disk_usage(self) -> int:
+        return self.journal.disk_usage()
+
+    def _schedule_compaction(self):
+        """Compact in the background once the journal is long enough."""
+        if self._compaction_task is not None and not self._compaction_task.done():
+            return
+        if self.journal.should_compact():
+            self._compaction_task = asyncio.create_task(self.flush())
+
+    def _collect(self):
+        hot = dict(self.cache.items())
+        return hot, [user for user in self.counts if user not in hot], dict(self.summaries)
+
+    async def sync(self):
+        await self.journal.sync()
+
+    async def flush(self):
+        await self.journal.compact(self._collect)
+
+    async def close(self):
+        if self._compaction_task is not None:
+            await self._compaction_task
+        await self.flush()
+        await self.journal.close()
+
+
+class SQLiteConversationStore(ConversationStore):
+    """History in a SQLite database (WAL mode), loaded into memory per user on demand.
+
+    Only recently used users are held in the cache, each trimmed to the
+    recent window, so startup time and resident memory do not depend on how
+    much history is stored. All database work runs on one dedicated
+    thread, which owns the connection.
+
+    Every write stamps the user with a new value of a database-wide version
+    counter, and user/message totals are kept by triggers. With ``shared``
+    set, several processes can use the same database: cached conversations
+    are revalidated against the stored version before being served.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS messages (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user TEXT NOT NULL,
+            role TEXT NOT NULL,
+            content TEXT NOT NULL,
+            timestamp TEXT NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS idx_messages_user_timestamp ON messages (user, timestamp);
+        CREATE INDEX IF NOT EXISTS idx_messages_timestamp ON messages (timestamp);
+        CREATE TABLE IF NOT EXISTS users (
+            name TEXT PRIMARY KEY,
+            message_count INTEGER NOT NULL DEFAULT 0,
+            version INTEGER NOT NULL DEFAULT 0
+        );
+        CREATE TABLE IF NOT EXISTS totals (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            users INTEGER NOT NULL,
+            messages INTEGER NOT NULL,
+            version INTEGER NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS meta (
+            key TEXT PRIMARY KEY,
+            value TEXT NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS summaries (
+            user TEXT PRIMARY KEY,
+            text TEXT NOT NULL,
+            covered_until TEXT NOT NULL,
+            message_count INTEGER NOT NULL
+        );
+        INSERT OR IGNORE INTO totals (id, users, messages, version)
+            SELECT 1, COUNT(*), COALESCE(SUM(message_count), 0), 0 FROM users;
+        CREATE TRIGGER IF NOT EXISTS users_insert_totals AFTER INSERT ON users BEGIN
+            UPDATE totals SET users = users + 1, messages = messages + NEW.message_count;
+        END;
+        CREATE TRIGGER IF NOT EXISTS users_delete_totals AFTER DELETE ON users BEGIN
+            UPDATE totals SET users = users - 1, messages = messages - OLD.message_count;
+        END;
+        CREATE TRIGGER IF NOT EXISTS users_update_totals AFTER UPDATE OF message_count ON users BEGIN
+            UPDATE totals SET messages = messages + NEW.message_count - OLD.message_count;
+        END;
+    """
+
+    def __init__(
+        self,
+        db_path: str,
+        cache: ConversationCache,
+        max_messages_per_user: int,
+        import_from: Optional[str] = None,
+        shared: bool = False,
+    ):
+        self.db_path = db_path
+        self.cache = cache
+        self.max_messages_per_user = max_messages_per_user
+        self.import_from = import_from
+        self.shared = shared
+        self._user_count = 0
+        self._message_count = 0
+        self.expiry = ExpiryIndex()
+        self._conn = None
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="sqlite-store")
+
+    async def _run(self, func, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, func, *args)
+
+    # --- Runs on the store thread ---
+    def _open(self):
+        self._conn = sqlite3.connect(self.db_path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("PRAGMA busy_timeout=5000")
+        with self._conn:
+            # Serialize schema setup/import between workers starting together
+            self._conn.execute("BEGIN IMMEDIATE")
+            fresh = not self._table_exists("users")
+            self._migrate()
+            for statement in self._schema_statements():
+                self._conn.execute(statement)
+            self._import_once(fresh)
+        # Walks the (user, timestamp) index, not the message rows
+        oldest = self._conn.execute("SELECT user, MIN(timestamp) FROM messages GROUP BY user").fetchall()
+        return self._totals(), oldest
+
+    def _schema_statements(self) -> List[str]:
+        # executescript() would commit the surrounding transaction, so split by hand
+        statements, current = [], []
+        for line in self.SCHEMA.strip().splitlines():
+            current.append(line)
+            joined = "\n".join(current).strip()
+            if joined.endswith(";") and sqlite3.complete_statement(joined):
+                statements.append(joined)
+                current = []
+        return statements
+
+    def _migrate(self):
+        """Bring databases created before the version column up to date."""
+        columns = [row[1] for row in self._conn.execute("PRAGMA table_info(users)")]
+        if columns and "version" not in columns:
+            self._conn.execute("ALTER TABLE users ADD COLUMN version INTEGER NOT NULL DEFAULT 0")
+
+    def _table_exists(self, name: str) -> bool:
+        return self._conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (name,)
+        ).fetchone() is not None
+
+    def _import_once(self, fresh: bool):
+        """Import the JSON history into a newly created database, and record that it was decided.
+
+        Never decided by the user count: a database emptied by clears or
+        retention must not get the old history back on the next start.
+        """
+        if self._conn.execute("SELECT 1 FROM meta WHERE key = 'json_import'").fetchone() is not None:
+            return
+        if fresh and self.import_from and os.path.exists(self.import_from):
+            users = self._import_json(self.import_from)
+            note = f"{users} users from '{self.import_from}' at {datetime.now().isoformat()}"
+        else:
+            note = "none"
+        self._conn.execute("INSERT INTO meta (key, value) VALUES ('json_import', ?)", (note,))
+
+    def _import_json(self, path: str) -> int:
+        with open(path, mode='r', encoding='utf-8') as f:
+            history = json.load(f)
+        for user, messages in history.items():
+            messages = messages[-self.max_messages_per_user:]
+            self._conn.executemany(
+                "INSERT INTO messages (user, role, content, timestamp) VALUES (?, ?, ?, ?)",
+                [(user, m['role'], m['content'], m['timestamp']) for m in messages]
+            )
+            self._conn.execute(
+                "INSERT INTO users (name, message_count, version) VALUES (?, ?, ?)",
+                (user, len(messages), self._next_version())
+            )
+        logger.info(f"📥 Imported {len(history)} users from '{path}' into '{self.db_path}'")
+        return len(history)
+
+    def _totals(self) -> Tuple[int, int]:
+        return self._conn.execute("SELECT users, messages FROM totals WHERE id = 1").fetchone()
+
+    def _next_version(self) -> int:
+        return self._conn.execute("UPDATE totals SET version = version + 1 RETURNING version").fetchone()[0]
+
+    def _select_version(self, user: str) -> Optional[int]:
+        row = self._conn.execute("SELECT version FROM users WHERE name = ?", (user,)).fetchone()
+        return row[0] if row else None
+
+    def _select_recent(self, user: str) -> MessageRing:
+        with self._conn:
+            # One read transaction so the rows and the version match
+            self._conn.execute("BEGIN")
+            version = self._select_version(user)
+            rows = self._conn.execute(
+                "SELECT role, content, timestamp FROM messages WHERE user = ? "
+                "ORDER BY timestamp DESC, id DESC LIMIT ?",
+                (user, self.max_messages_per_user)
+            ).fetchall()
+        return MessageRing(self.max_messages_per_user, (
+            Message.from_dict({'role': role, 'content': content, 'timestamp': ts})
+            for role, content, ts in reversed(rows)
+        ), version=version or 0)
+
+    def _insert(self, entries: List[Tuple[str, Message]]):
+        """Insert messages in one transaction, trimming each user to the window.
+
+        Returns each entry's user version before (None for a new user) and
+        after its write, and the new totals.
+        """
+        with self._conn:
+            self._conn.execute("BEGIN IMMEDIATE")
+            versions = [self._insert_one(user, message) for user, message in entries]
+            return versions, self._totals()
+
+    def _insert_one(self, user: str, message: Message) -> Tuple[Optional[int], int]:
+        previous = self._select_version(user)
+        version = self._next_version()
+        self._conn.execute(
+            "INSERT INTO messages (user, role, content, timestamp) VALUES (?, ?, ?, ?)",
+            (user, message.role.label, message.content, message.iso_timestamp)
+        )
+        if previous is None:
+            self._conn.execute(
+                "INSERT INTO users (name, message_count, version) VALUES (?, 0, ?)", (user, version)
+            )
+        trimmed = self._conn.execute(
+            "DELETE FROM messages WHERE user = ? AND id NOT IN "
+            "(SELECT id FROM messages WHERE user = ? ORDER BY timestamp DESC, id DESC LIMIT ?)",
+            (user, user, self.max_messages_per_user)
+        ).rowcount
+        self._conn.execute(
+            "UPDATE users SET message_count = message_count + 1 - ?, version = ? WHERE name = ?",
+            (trimmed, version, user)
+        )
+        return previous, version
+
+    def _delete_user(self, user: str):
+        with self._conn:
+            self._conn.execute("BEGIN IMMEDIATE")
+            deleted = self._conn.execute("DELETE FROM messages WHERE user = ?", (user,)).rowcount
+            self._conn.execute("DELETE FROM users WHERE name = ?", (user,))
+            self._conn.execute("DELETE FROM summaries WHERE user = ?", (user,))
+            return deleted, self._totals()
+
+    def _delete_expired(self, users: List[str], cutoff: str):
+        """Expire several users in one transaction; returns (removed, new oldest) per user and the totals."""
+        results = {}
+        with self._conn:
+            self._conn.execute("BEGIN IMMEDIATE")
+            for user in users:
+                removed = self._conn.execute(
+                    "DELETE FROM messages WHERE user = ? AND timestamp <= ?", (user, cutoff)
+                ).rowcount
+                oldest = self._conn.execute(
+                    "SELECT MIN(timestamp) FROM messages WHERE user = ?", (user,)
+                ).fetchone()[0]
+                if oldest is None:
+                    self._conn.execute("DELETE FROM users WHERE name = ?", (user,))
+                    self._conn.execute("DELETE FROM summaries WHERE user = ?", (user,))
+                elif removed:
+                    self._conn.execute(
+                        "UPDATE users SET message_count = message_count - ?, version = ? WHERE name = ?",
+                        (removed, self._next_version(), user)
+                    )
+                results[user] = (removed, oldest)
+            return results, self._totals()
+
+    def _select_batch(self, after: str, limit: int) -> List[Tuple[str, MessageRing]]:
+        """Next ``limit`` users by name after ``after``, with their messages (keyset pagination)."""
+        with self._conn:
+            self._conn.execute("BEGIN")
+            users = [row[0] for row in self._conn.execute(
+                "SELECT name FROM users WHERE name > ? ORDER BY name LIMIT ?", (after, limit)
+            )]
+            if not users:
+                return []
+            rings = {user: MessageRing(self.max_messages_per_user) for user in users}
+            placeholders = ",".join("?" * len(users))
+            for user, role, content, ts in self._conn.execute(
+                f"SELECT user, role, content, timestamp FROM messages WHERE user IN ({placeholders}) "
+                f"ORDER BY user, timestamp, id", users
+            ):
+                rings[user].append(Message.from_dict({'role': role, 'content': content, 'timestamp': ts}))
+        return [(user, rings[user]) for user in users]
+
+    def _select_summary(self, user: str) -> Optional[Summary]:
+        row = self._conn.execute(
+            "SELECT text, covered_until, message_count FROM summaries WHERE user = ?", (user,)
+        ).fetchone()
+        if row is None:
+            return None
+        return Summary.from_dict({'text': row[0], 'covered_until': row[1], 'message_count': row[2]})
+
+    def _upsert_summary(self, user: str, summary: Summary):
+        data = summary.to_dict()
+        with self._conn:
+            # Skipped if the user was cleared or expired meanwhile
+            self._conn.execute(
+                "INSERT OR REPLACE INTO summaries (user, text, covered_until, message_count) "
+                "SELECT ?, ?, ?, ? WHERE EXISTS (SELECT 1 FROM users WHERE name = ?)",
+                (user, data['text'], data['covered_until'], data['message_count'], user)
+            )
+
+    def _checkpoint(self):
+        # With synchronous=NORMAL, WAL commits are only fsynced at checkpoints
+        self._conn.execute("PRAGMA wal_checkpoint(PASSIVE)")
+
+    def _close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    # --- Async interface ---
+    def _set_totals(self, totals: Tuple[int, int]):
+        self._user_count, self._message_count = totals
+
+    async def load(self):
+        totals, oldest = await self._run(self._open)
+        self._set_totals(totals)
+        for user, oldest_iso in oldest:
+            self.expiry.add(user, datetime.fromisoformat(oldest_iso).timestamp())
+        mode = "shared" if self.shared else "single-process"
+        logger.info(f"✅ Opened '{self.db_path}' ({self._user_count} users, loaded lazily, {mode})")
+
+    async def get_messages(self, user: str) -> MessageRing:
+        messages = self.cache.get(user)
+        if messages is not None:
+            if not self.shared:
+                return messages
+            # Another worker may have written to this user since we cached it
+            if await self._run(self._select_version, user) == messages.version:
+                return messages
+            self.cache.pop(user)
+
+        messages = await self._run(self._select_recent, user)
+        if not messages:
+            return EMPTY_RING
+        # Another request may have loaded (and appended to) this user meanwhile
+        cached = self.cache.peek(user)
+        if cached is not None and cached.version >= messages.version:
+            return self.cache.get(user)
+        self.cache.put(user, messages)
+        return messages
+
+    async def append(self, user: str, message: Message):
+        await self.append_many([(user, message)])
+
+    async def append_many(self, entries: List[Tuple[str, Message]]):
+        if not entries:
+            return
+        versions, totals = await self._run(self._insert, entries)
+        self._set_totals(totals)
+        for (user, message), (previous, version) in zip(entries, versions):
+            self._track_append(user, message, previous, version)
+
+    def _track_append(self, user: str, message: Message, previous: Optional[int], version: int):
+        """Keep the cached copy in step; if it isn't cached, the next read loads it."""
+        if previous is None:
+            self.expiry.add(user, message.timestamp)
+            self.cache.put(user, MessageRing(self.max_messages_per_user, [message], version=version))
+            return
+        cached = self.cache.peek(user)
+        if cached is None:
+            return
+        if cached.version == previous:
+            cached.append(message)
+            cached.version = version
+            self.cache.put(user, cached)
+        else:
+            # Someone else wrote in between; reload on next read
+            self.cache.pop(user)
+
+    async def clear(self, user: str) -> int:
+        self.cache.pop(user)
+        deleted, totals = await self._run(self._delete_user, user)
+        self._set_totals(totals)
+        return deleted
+
+    async def get_version(self, user: str) -> int:
+        cached = self.cache.peek(user)
+        if cached is not None and not self.shared:
+            return cached.version
+        return await self._run(self._select_version, user) or 0
+
+    async def iter_histories(self, batch_users: int) -> AsyncIterator[Tuple[str, MessageRing]]:
+        after = ""
+        while True:
+            batch = await self._run(self._select_batch, after, batch_users)
+            if not batch:
+                return
+            for user, messages in batch:
+                if messages:
+                    yield user, messages
+            after = batch[-1][0]
+
+    async def sync(self):
+        await self._run(self._checkpoint)
+
+    async def get_summary(self, user: str) -> Optional[Summary]:
+        return await self._run(self._select_summary, user)
+
+    async def set_summary(self, user: str, summary: Summary):
+        await self._run(self._upsert_summary, user, summary)
+
+    async def _expire_users(self, users: List[str], cutoff_ts: float) -> Tuple[int, Dict[str, Optional[float]]]:
+        results, totals = await self._run(
+            self._delete_expired, users, datetime.fromtimestamp(cutoff_ts).isoformat()
+        )
+        self._set_totals(totals)
+
+        total_removed = 0
+        oldest: Dict[str, Optional[float]] = {}
+        for user, (removed, oldest_iso) in results.items():
+            total_removed += removed
+            if removed:
+                self.cache.pop(user)
+            if oldest_iso is None:
+                oldest[user] = None
+                if removed:
+                    logger.info(f"🗑️ Removed empty user: {user}")
+            else:
+                oldest[user] = datetime.fromisoformat(oldest_iso).timestamp()
+        return total_removed, oldest
+
+    async def sync_counts(self):
+        if self.shared:
+            self._set_totals(await self._run(self._totals))
+
+    def user_count(self) -> int:
+        return self._user_count
+
+    def message_count(self) -> int:
+        return self._message_count
+
+    def disk_usage(self) -> int:
+        total = 0
+        for path in (self.db_path, f"{self.db_path}-wal"):
+            if os.path.exists(path):
+                total += os.path.getsize(path)
+        return total
+
+    async def close(self):
+        await self._run(self._close)
+        self._executor.shutdown(wait=True)
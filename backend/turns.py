@@ -0,0 +1,102 @@
+import time
+import asyncio
+import logging
+from contextlib import asynccontextmanager
+from typing import Awaitable, Callable, Dict, Tuple, TypeVar
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+
+class _Turn:
+    __slots__ = ("task", "started", "waiters")
+
+    def __init__(self, task: asyncio.Task):
+        self.task = task
+        self.started = time.monotonic()
+        self.waiters = 0
+
+
+class UserTurnQueue:
+    """Runs each user's chat turns one at a time, in arrival order.
+
+    Turns for different users run fully in parallel. A turn with the same
+    message as one the user started less than ``coalesce_window_s`` ago is
+    not run again: the caller shares the earlier turn's result. A turn is
+    cancelled once every caller waiting on it has gone away.
+
+    Ordering and coalescing only hold within one process; workers sharing
+    a store (SHARED_STATE) each have their own queue.
+    """
+
+    def __init__(self, coalesce_window_s: float = 0.0):
+        self.coalesce_window_s = coalesce_window_s
+        # asyncio.Lock wakes waiters first-come first-served
+        self._locks: Dict[str, asyncio.Lock] = {}
+        self._holders: Dict[str, int] = {}
+        self._recent: Dict[Tuple[str, str], _Turn] = {}
+        self.turns = 0
+        self.coalesced = 0
+
+    @asynccontextmanager
+    async def hold(self, user: str):
+        """Hold the user's turn slot, waiting behind earlier turns."""
+        lock = self._locks.get(user)
+        if lock is None:
+            lock = self._locks[user] = asyncio.Lock()
+        self._holders[user] = self._holders.get(user, 0) + 1
+        try:
+            async with lock:
+                yield
+        finally:
+            self._holders[user] -= 1
+            if not self._holders[user]:
+                # Nobody holds or waits: drop the lock so idle users cost nothing
+                del self._holders[user]
+                del self._locks[user]
+
+    async def run(self, user: str, message: str, turn_factory: Callable[[], Awaitable[T]]) -> T:
+        """Run ``turn_factory()`` in the user's turn order, or join an identical recent turn."""
+        key = (user, message)
+        turn = self._recent.get(key)
+        if (turn is not None and not turn.task.cancelled()
+                and time.monotonic() - turn.started <= self.coalesce_window_s):
+            self.coalesced += 1
+            logger.info(f"🔁 Coalesced duplicate message from {user} into the in-flight turn")
+        else:
+            turn = _Turn(asyncio.create_task(self._serialized(user, turn_factory)))
+            self.turns += 1
+            if self.coalesce_window_s > 0:
+                self._recent[key] = turn
+                turn.task.add_done_callback(lambda _: self._forget_later(key, turn))
+
+        turn.waiters += 1
+        try:
+            # Shielded so one caller leaving doesn't cancel the turn for the others
+            return await asyncio.shield(turn.task)
+        finally:
+            turn.waiters -= 1
+            if not turn.waiters and not turn.task.done():
+                turn.task.cancel()
+
+    async def _serialized(self, user: str, turn_factory: Callable[[], Awaitable[T]]) -> T:
+        async with self.hold(user):
+            return await turn_factory()
+
+    def _forget_later(self, key: Tuple[str, str], turn: _Turn):
+        remaining = self.coalesce_window_s - (time.monotonic() - turn.started)
+        asyncio.get_running_loop().call_later(max(remaining, 0), self._forget, key, turn)
+
+    def _forget(self, key: Tuple[str, str], turn: _Turn):
+        if self._recent.get(key) is turn:
+            del self._recent[key]
+
+    def stats(self) -> Dict:
+        return {
+            "active_users": len(self._locks),
+            "queued_turns": sum(self._holders.values()) - sum(lock.locked() for lock in self._locks.values()),
+            "turns": self.turns,
+            "coalesced": self.coalesced,
+            "coalesce_window_s": self.coalesce_window_s,
+        }